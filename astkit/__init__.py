@@ -16,5 +16,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 #
+__version__ = '0.5.4'
+
 from astkit.compat import ast
 from astkit.processor import install_processor
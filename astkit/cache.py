@@ -0,0 +1,317 @@
+""" cache.py
+
+An on-disk cache for the code objects produced by processing modules.
+
+Importing a module through the processor import hook means reading, parsing,
+processing and compiling its source. CodeCache stores the resulting code object
+in a __pycache__ style file so that the next process to import the module can
+load the marshalled code directly. Each entry is keyed by the state of the
+source file (its mtime and size, or a hash of its contents) and by a
+fingerprint of the installed processors, so editing either one invalidates it.
+"""
+import hashlib
+import logging
+import marshal
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import astkit
+
+log = logging.getLogger(__name__)
+
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
+
+try:
+    CACHE_TAG = sys.implementation.cache_tag
+except AttributeError:
+    CACHE_TAG = 'python%d%d' % sys.version_info[:2]
+
+CACHE_SUFFIX = '.astkit.pyc'
+_DIGEST_SIZE = hashlib.sha1().digest_size
+_HEADER_SIZE = len(MAGIC_NUMBER) + 2 * _DIGEST_SIZE
+# temporary files older than this were left behind by a writer that died
+_STALE_TEMP_AGE = 3600
+
+# module file -> (mtime, size), looked up once per process
+_module_stats = {}
+
+def _module_identity(name):
+    """ Describe the installed version of a module: its __version__, if it
+        has one, and the mtime and size of its file
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        return None
+    path = getattr(module, '__file__', None)
+    stat = None
+    if path is not None:
+        stat = _module_stats.get(path)
+        if stat is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                pass
+            else:
+                stat = _module_stats[path] = (st.st_mtime, st.st_size)
+    return (getattr(module, '__version__', None), stat)
+
+def processor_fingerprint(processors):
+    """ Summarize a sequence of processors as a digest
+
+        A processor is identified by its class and by the version of astkit
+        and of the module the class is defined in, so upgrading or editing
+        either one invalidates the cache. Processors whose behavior also
+        depends on how they were configured should provide a 'cache_key'
+        attribute describing that configuration, which is added to the rest.
+    """
+    fingerprint = hashlib.sha1()
+    fingerprint.update(("astkit %s;" % astkit.__version__).encode('utf-8'))
+    for processor in processors:
+        cls = processor.__class__
+        identity = "%s.%s:%r:%r;" % (cls.__module__, cls.__name__,
+                                     _module_identity(cls.__module__),
+                                     getattr(processor, 'cache_key', None))
+        fingerprint.update(identity.encode('utf-8'))
+    return fingerprint.digest()
+
+class CodeCache(object):
+    """ A cache of processed code objects stored alongside their sources
+
+        By default entries are written to a __pycache__ directory next to each
+        source file. If a directory is given, all entries are kept there
+        instead. Entries are validated against the source's mtime and size,
+        or against a hash of its contents when validation is 'hash'.
+
+        A cache in a single directory can be bounded by max_size (in bytes)
+        and max_entries. Using an entry bumps its mtime, and when a store
+        takes the cache over either limit the least recently used entries
+        are deleted. Several processes can share a cache directory.
+    """
+
+    def __init__(self, directory=None, validation='mtime', max_size=None,
+                 max_entries=None):
+        if validation not in ('mtime', 'hash'):
+            raise ValueError("validation must be 'mtime' or 'hash', not %r"
+                             % (validation,))
+        if directory is None and (max_size is not None or
+                                  max_entries is not None):
+            raise ValueError("only a cache in a single directory can be "
+                             "bounded")
+        self.directory = directory
+        self.validation = validation
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # an estimate of the cache's (entries, bytes), kept up to date with
+        # this process's writes; None until the directory has been scanned
+        self._usage = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def bounded(self):
+        return self.max_size is not None or self.max_entries is not None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_usage'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """ Get this process's hit, miss, store and eviction counts """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'stores': self.stores,
+                    'evictions': self.evictions,
+                    }
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def cache_path(self, source_path):
+        """ Get the path of the cache entry for a source file """
+        source_path = os.path.abspath(source_path)
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        if self.directory is None:
+            return os.path.join(os.path.dirname(source_path), '__pycache__',
+                                '%s.%s%s' % (name, CACHE_TAG, CACHE_SUFFIX))
+        # sources from different directories share the central directory, so
+        # tell them apart by their location
+        location = hashlib.sha1(source_path.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, '%s-%s.%s%s' % (name, location,
+                                                            CACHE_TAG,
+                                                            CACHE_SUFFIX))
+
+    def source_key(self, source_path):
+        """ Get a digest of the current state of a source file
+
+            The key should be taken before the source is read so that a change
+            made while the module is being processed isn't masked.
+        """
+        if self.validation == 'hash':
+            with open(source_path, 'rb') as f:
+                return hashlib.sha1(f.read()).digest()
+        st = os.stat(source_path)
+        return hashlib.sha1(("%r:%r" % (st.st_mtime, st.st_size))
+                            .encode('utf-8')).digest()
+
+    def load(self, source_path, fingerprint, key):
+        """ Get the cached code for a source file or None if there is no
+            valid entry for it
+        """
+        path = self.cache_path(source_path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            self._count('misses')
+            return None
+        if data[:_HEADER_SIZE] != MAGIC_NUMBER + fingerprint + key:
+            self._count('misses')
+            return None
+        try:
+            code = marshal.loads(data[_HEADER_SIZE:])
+        except (EOFError, ValueError, TypeError):
+            log.debug("ignoring corrupt cache entry %s", path)
+            self._count('misses')
+            return None
+        self._count('hits')
+        if self.bounded:
+            # mtime rather than atime, which is often not kept up to date
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return code
+
+    def store(self, source_path, fingerprint, key, code):
+        """ Write the code for a source file to the cache
+
+            Nothing is written when sys.dont_write_bytecode is set. Failing to
+            write is not an error; the module will simply be processed again
+            next time.
+        """
+        if sys.dont_write_bytecode:
+            return
+        path = self.cache_path(source_path)
+        data = MAGIC_NUMBER + fingerprint + key + marshal.dumps(code)
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # write to a temporary file and rename it into place so that a
+            # concurrent reader never sees a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                _replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except (IOError, OSError):
+            log.debug("couldn't write cache entry %s", path, exc_info=True)
+            return
+        self._count('stores')
+        if self.bounded:
+            self._added(len(data))
+
+    def _added(self, size):
+        """ Account for a new entry and evict entries if it was one too many
+
+            The usage estimate doesn't see other processes' writes or that an
+            entry was replaced rather than added, so it is only used to decide
+            when to scan the directory, which gives the real figures.
+        """
+        with self._lock:
+            if self._usage is not None:
+                entries, total = self._usage
+                self._usage = (entries + 1, total + size)
+            if self._usage is not None and not self._over_limit(*self._usage):
+                return
+        self.evict()
+
+    def _over_limit(self, entries, total):
+        return ((self.max_entries is not None and
+                 entries > self.max_entries) or
+                (self.max_size is not None and total > self.max_size))
+
+    def usage(self):
+        """ Get the number of entries in the cache directory and their total
+            size in bytes
+        """
+        entries = self._scan()
+        return len(entries), sum(size for mtime, size, path in entries)
+
+    def _scan(self):
+        """ List (mtime, size, path) for each entry in the cache directory,
+            removing abandoned temporary files on the way
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        now = time.time()
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+                if name.endswith(CACHE_SUFFIX):
+                    entries.append((st.st_mtime, st.st_size, path))
+                elif (name.endswith('.tmp') and
+                      now - st.st_mtime > _STALE_TEMP_AGE):
+                    os.unlink(path)
+            except OSError:
+                # another process got there first
+                continue
+        return entries
+
+    def evict(self):
+        """ Delete the least recently used entries until the cache is within
+            its limits
+        """
+        entries = self._scan()
+        entries.sort()
+        count = len(entries)
+        total = sum(size for mtime, size, path in entries)
+        evicted = 0
+        for mtime, size, path in entries:
+            if not self._over_limit(count, total):
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # already gone, or in use on a platform that won't allow it
+                pass
+            else:
+                evicted += 1
+            count -= 1
+            total -= size
+        with self._lock:
+            self.evictions += evicted
+            self._usage = (count, total)
+
+if hasattr(os, 'replace'):
+    _replace = os.replace
+else:
+    def _replace(source, destination):
+        if os.name == 'nt' and os.path.exists(destination):
+            os.unlink(destination)
+        os.rename(source, destination)
@@ -0,0 +1,287 @@
+""" compact.py
+
+Keep many trees in memory as a handful of flat arrays.
+
+An ast tree costs a Python object, and its attribute dictionary, for every
+node. A CompactTree stores the same tree in columns, one entry per node in
+document order:
+
+    types           the id of the node's class (see node_type_id)
+    parents         the index of the node's parent, -1 for the root
+    first_children  the index of the node's first child, or -1
+    next_siblings   the index of the node's next sibling, or -1
+    shapes          the index in the shape table of the node's field values
+    linenos, col_offsets, end_linenos, end_col_offsets
+                    the node's position, -1 where it has none
+
+Everything about a node other than its children (names, constants, flags,
+and where its children go among its fields) is its shape. Shapes are shared
+between nodes that have the same one, and the strings in them are kept once
+each in a string table, so a Name for 'self' costs a few array entries no
+matter how often it appears.
+
+    >>> compact = CompactTree(tree)
+    >>> compact.type_histogram()[ast.Call]
+    >>> function = compact.materialize(compact.find(ast.FunctionDef)[0])
+
+Queries over the columns, like type_histogram and find, use NumPy when it is
+installed.
+"""
+from array import array
+from collections import Counter
+
+from astkit import ast
+from astkit.util import ast_class_tree
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_node_types = []
+_node_type_ids = {}
+
+def node_type_id(cls):
+    """ Get the id that stands for a node class in CompactTree.types
+
+        Ids are given out as classes are first seen, so they are only
+        comparable between trees built in the same process.
+    """
+    try:
+        return _node_type_ids[cls]
+    except KeyError:
+        type_id = _node_type_ids[cls] = len(_node_types)
+        _node_types.append(cls)
+        return type_id
+
+def node_type(type_id):
+    """ Get the node class an id stands for """
+    return _node_types[type_id]
+
+for _cls in sorted(ast_class_tree().descendants(ast.AST),
+                   key=lambda cls: cls.__name__):
+    node_type_id(_cls)
+
+# A shape is a tuple with an entry for each of a class's fields:
+#   _CHILD                the next of the node's children
+#   (_STRING, index)      a string from the string table
+#   (_VALUE, value)       any other value
+#   (_LIST, entries)      a list, whose items are described the same way
+_CHILD = -1
+_STRING, _VALUE, _LIST = range(3)
+
+_POSITIONS = ('lineno', 'col_offset', 'end_lineno', 'end_col_offset')
+
+class CompactTree(object):
+    """ A tree stored as columns of node data """
+
+    def __init__(self, tree):
+        self.types = array('H')
+        self.parents = array('i')
+        self.first_children = array('i')
+        self.next_siblings = array('i')
+        self.shapes = array('i')
+        self.linenos = array('i')
+        self.col_offsets = array('i')
+        self.end_linenos = array('i')
+        self.end_col_offsets = array('i')
+        self.shape_table = []
+        self.strings = []
+        self._shape_ids = {}
+        self._string_ids = {}
+        self._add(tree)
+        # only needed while building
+        del self._shape_ids, self._string_ids
+
+    def __len__(self):
+        return len(self.types)
+
+    def _string(self, value):
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return (_STRING, string_id)
+
+    def _entry(self, value, children):
+        if isinstance(value, ast.AST):
+            children.append(value)
+            return _CHILD
+        if isinstance(value, list):
+            return (_LIST, tuple([self._entry(item, children)
+                                  for item in value]))
+        if isinstance(value, str):
+            return self._string(value)
+        return (_VALUE, value)
+
+    def _shape(self, shape):
+        try:
+            key = self._shape_key(shape)
+        except TypeError:
+            # unhashable constants
+            key = None
+        if key is not None:
+            shape_id = self._shape_ids.get(key)
+            if shape_id is not None:
+                return shape_id
+        shape_id = len(self.shape_table)
+        self.shape_table.append(shape)
+        if key is not None:
+            self._shape_ids[key] = shape_id
+        return shape_id
+
+    def _shape_key(self, shape):
+        """ Make a key under which equal shapes can be shared
+
+            Values compare equal across types (1, 1.0 and True) and floats
+            can be equal without being the same (0.0 and -0.0), so a value is
+            keyed by its class and floats and complex numbers by their repr.
+        """
+        key = []
+        for entry in shape:
+            if entry == _CHILD or entry[0] == _STRING:
+                key.append(entry)
+            elif entry[0] == _LIST:
+                key.append((_LIST, self._shape_key(entry[1])))
+            else:
+                value = entry[1]
+                if isinstance(value, (float, complex)):
+                    value = repr(value)
+                key.append((_VALUE, value.__class__, value))
+        key = tuple(key)
+        hash(key)
+        return key
+
+    def _add(self, tree):
+        types = self.types
+        parents = self.parents
+        first_children = self.first_children
+        next_siblings = self.next_siblings
+        position_columns = self._position_columns()
+        last_children = {}
+        stack = [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(types)
+            cls = node.__class__
+            types.append(node_type_id(cls))
+            parents.append(parent)
+            first_children.append(-1)
+            next_siblings.append(-1)
+            if parent != -1:
+                previous = last_children.get(parent)
+                if previous is None:
+                    first_children[parent] = index
+                else:
+                    next_siblings[previous] = index
+                last_children[parent] = index
+
+            children = []
+            shape = tuple([self._entry(getattr(node, field, None), children)
+                           for field in cls._fields])
+            self.shapes.append(self._shape(shape))
+            for attribute, column in zip(_POSITIONS, position_columns):
+                value = getattr(node, attribute, None)
+                column.append(-1 if value is None else value)
+            for child in reversed(children):
+                stack.append((child, index))
+
+    def _position_columns(self):
+        return (self.linenos, self.col_offsets, self.end_linenos,
+                self.end_col_offsets)
+
+    def node_type(self, index):
+        return _node_types[self.types[index]]
+
+    def children(self, index):
+        """ Get the indexes of a node's children """
+        children = []
+        child = self.first_children[index]
+        while child != -1:
+            children.append(child)
+            child = self.next_siblings[child]
+        return children
+
+    def subtree_end(self, index):
+        """ Get the index just past the last node in a node's subtree
+
+            Nodes are stored in document order, so a subtree is the range
+            from its root to here.
+        """
+        while index != -1:
+            following = self.next_siblings[index]
+            if following != -1:
+                return following
+            index = self.parents[index]
+        return len(self.types)
+
+    def _type_ids(self, node_type):
+        classes = [node_type]
+        class_tree = ast_class_tree()
+        if class_tree.contains(node_type):
+            classes.extend(class_tree.descendants(node_type))
+        return [_node_type_ids[cls] for cls in classes
+                if cls in _node_type_ids]
+
+    def find(self, node_type):
+        """ Get the indexes of the nodes that are instances of a node type,
+            in document order
+        """
+        type_ids = self._type_ids(node_type)
+        if numpy is not None:
+            types = numpy.frombuffer(self.types, dtype=numpy.uint16)
+            return numpy.nonzero(numpy.isin(types, type_ids))[0].tolist()
+        type_ids = frozenset(type_ids)
+        return [index for index, type_id in enumerate(self.types)
+                if type_id in type_ids]
+
+    def type_histogram(self):
+        """ Count the nodes of each class """
+        return type_histogram([self])
+
+    def materialize(self, index=0):
+        """ Build the subtree rooted at a node back into ast nodes """
+        end = self.subtree_end(index)
+        position_columns = self._position_columns()
+        nodes = {}
+        strings = self.strings
+        for position in range(end - 1, index - 1, -1):
+            cls = _node_types[self.types[position]]
+            shape = self.shape_table[self.shapes[position]]
+            children = [nodes.pop(child) for child in self.children(position)]
+            children.reverse()
+            node = cls()
+            for field, entry in zip(cls._fields, shape):
+                setattr(node, field, _value(entry, children, strings))
+            for attribute, column in zip(_POSITIONS, position_columns):
+                if attribute in cls._attributes and column[position] != -1:
+                    setattr(node, attribute, column[position])
+            nodes[position] = node
+        return nodes[index]
+
+def _value(entry, children, strings):
+    """ Rebuild a field value, taking nodes from the end of children """
+    if entry == _CHILD:
+        return children.pop()
+    kind, value = entry
+    if kind == _STRING:
+        return strings[value]
+    if kind == _LIST:
+        return [_value(item, children, strings) for item in value]
+    return value
+
+def type_histogram(trees):
+    """ Count the nodes of each class over many compact trees """
+    if numpy is not None:
+        totals = numpy.zeros(len(_node_types), dtype=numpy.int64)
+        for tree in trees:
+            counted = numpy.bincount(numpy.frombuffer(tree.types,
+                                                      dtype=numpy.uint16))
+            totals[:len(counted)] += counted
+        return dict((_node_types[type_id], int(totals[type_id]))
+                    for type_id in numpy.nonzero(totals)[0])
+    counts = Counter()
+    for tree in trees:
+        counts.update(tree.types)
+    return dict((_node_types[type_id], count)
+                for type_id, count in counts.items())
@@ -0,0 +1,171 @@
+""" hashing.py
+
+Content hashes of subtrees that ignore where the code is.
+
+Two subtrees get the same digest exactly when nodes_equal would say they are
+the same: the classes and field values must match, but line and column
+attributes don't count. A node's digest is computed from its own fields and
+the digests of its children, so a TreeHashes table is filled bottom-up in a
+single pass, and after a change only the digests on the path from the
+changed node to the root have to be computed again:
+
+    >>> hashes = TreeHashes(module)
+    >>> key = hashes.digest(function)
+    >>> before = hashes.digest(module)
+    >>> function.body.append(ast.Pass())
+    >>> hashes.update(function)
+    >>> hashes.digest(module) != before
+
+Digests are stable between runs on the same interpreter, so they can key
+caches of the work a processor does on each function or class. They are not
+suitable for keying compiled code, which records line numbers.
+"""
+import binascii
+import hashlib
+
+from astkit import ast
+from astkit.walker import walk
+
+# shared instances have no single parent; see astkit.index
+_SHARED_TYPES = (ast.expr_context, ast.boolop, ast.operator, ast.unaryop,
+                 ast.cmpop)
+
+# digests have a fixed size, while everything else is length-prefixed, so
+# that different trees can't produce the same input to the hash
+_NODE_TAG = b'n'
+
+def _list_tag(length):
+    return ('l%d:' % length).encode('ascii')
+
+def _scalar(value):
+    # 1, 1.0 and True are equal but are different constants
+    text = '%s:%r' % (value.__class__.__name__, value)
+    return ('s%d:%s' % (len(text), text)).encode('utf-8')
+
+class TreeHashes(object):
+    """ A side table of the digest of every subtree of a tree """
+
+    def __init__(self, tree):
+        self.tree = tree
+        # id -> (node, digest, children)
+        self._digests = {}
+        # id -> parent node
+        self._parents = {}
+        digests = self._digests
+        for node in walk(tree, 'post'):
+            if isinstance(node, _SHARED_TYPES) and id(node) in digests:
+                continue
+            self._store(node)
+
+    def __len__(self):
+        return len(self._digests)
+
+    def __contains__(self, node):
+        entry = self._digests.get(id(node))
+        return entry is not None and entry[0] is node
+
+    def _store(self, node):
+        """ Compute a node's digest from its fields and its children's
+            digests, which must already be known
+        """
+        digests = self._digests
+        parents = self._parents
+        parts = [node.__class__.__name__.encode('utf-8')]
+        children = []
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, ast.AST):
+                parts.append(_NODE_TAG)
+                parts.append(digests[id(value)][1])
+                if not isinstance(value, _SHARED_TYPES):
+                    parents[id(value)] = node
+                    children.append(value)
+            elif isinstance(value, list):
+                parts.append(_list_tag(len(value)))
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        parts.append(_NODE_TAG)
+                        parts.append(digests[id(item)][1])
+                        if not isinstance(item, _SHARED_TYPES):
+                            parents[id(item)] = node
+                            children.append(item)
+                    else:
+                        parts.append(_scalar(item))
+            else:
+                parts.append(_scalar(value))
+        digest = hashlib.sha1(b''.join(parts)).digest()
+        digests[id(node)] = (node, digest, tuple(children))
+        return digest
+    
+    def _restore(self, node):
+        """ Compute the digest of a node already in the table again, and
+            drop the subtrees of the children it no longer has
+        """
+        previous = self._digests.get(id(node))
+        digest = self._store(node)
+        if previous is not None and previous[0] is node:
+            children = set(map(id, self._digests[id(node)][2]))
+            for child in previous[2]:
+                if id(child) not in children:
+                    self._forget(child, node)
+        return digest
+    
+    def _forget(self, node, parent):
+        """ Drop a subtree that has been removed from parent """
+        digests = self._digests
+        parents = self._parents
+        stack = [(node, parent)]
+        while stack:
+            node, parent = stack.pop()
+            # a node that was moved has been hashed under its new parent
+            if parents.get(id(node)) is not parent:
+                continue
+            del parents[id(node)]
+            entry = digests.pop(id(node), None)
+            if entry is not None and entry[0] is node:
+                stack.extend([(child, node) for child in entry[2]])
+
+    def digest(self, node):
+        """ Get the digest of the subtree rooted at a node """
+        entry = self._digests.get(id(node))
+        if entry is None or entry[0] is not node:
+            raise KeyError(node)
+        return entry[1]
+
+    def hexdigest(self, node):
+        return binascii.hexlify(self.digest(node)).decode('ascii')
+
+    def parent(self, node):
+        return self._parents.get(id(node))
+
+    def update(self, node):
+        """ Bring the digests up to date after a node has been changed in
+            place
+
+            New nodes below it are hashed, children it no longer has are
+            dropped from the table along with their subtrees, and the digests
+            of the node and its ancestors are computed again, stopping at the
+            first one that comes out unchanged. Nodes below it that were
+            already in the table are assumed not to have changed; update them
+            first.
+        """
+        previous = self._digests.get(id(node))
+        known = lambda other: other is not node and other in self
+        for other in walk(node, 'post', prune=known):
+            if other is node:
+                digest = self._restore(node)
+            elif other not in self:
+                self._store(other)
+        if previous is not None and previous[0] is node and \
+                previous[1] == digest:
+            return
+        parent = self._parents.get(id(node))
+        while parent is not None:
+            previous = self._digests[id(parent)][1]
+            if self._restore(parent) == previous:
+                break
+            parent = self._parents.get(id(parent))
+
+def subtree_digest(node):
+    """ Get the digest of a single subtree """
+    return TreeHashes(node).digest(node)
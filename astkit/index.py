@@ -0,0 +1,202 @@
+""" index.py
+
+An index of the nodes in a tree, built in a single pass.
+
+Finding every Call in a module, the parent of a node or the function a node
+is in otherwise means walking the tree each time. A NodeIndex answers these
+questions from dictionaries:
+
+    >>> index = NodeIndex(tree)
+    >>> calls = index.nodes(ast.Call)
+    >>> expressions = index.nodes(ast.expr)   # every expression subclass
+    >>> index.parent(calls[0])
+    >>> index.enclosing_scope(calls[0])
+
+When a transformer replaces a node, tell the index through replace so that
+only the replaced subtree is indexed again.
+"""
+from collections import OrderedDict
+
+from astkit import ast
+from astkit.util import ast_class_tree
+from astkit.walker import child_fields
+
+_SCOPE_TYPES = tuple(getattr(ast, name) for name in ('FunctionDef',
+                                                     'AsyncFunctionDef',
+                                                     'ClassDef', 'Lambda')
+                     if hasattr(ast, name))
+
+# instances of these are shared between the places they appear in a tree,
+# so they have no single parent and aren't indexed
+_SHARED_TYPES = (ast.expr_context, ast.boolop, ast.operator, ast.unaryop,
+                 ast.cmpop)
+
+# positions in an index entry
+_NODE, _PARENT, _FIELD, _SCOPE, _ORDER, _CHILDREN = range(6)
+
+class NodeIndex(object):
+    """ Nodes by type, parents and enclosing scopes for a tree
+
+        Nodes are returned in the order they were indexed, which is document
+        order for a freshly built index; nodes added by replace come after
+        the rest. Contexts and operators such as ast.Load and ast.Add are
+        left out, since one instance of each is shared across the tree.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self._entries = {}
+        self._by_type = {}
+        self._queries = {}
+        self._order = 0
+        self._add(tree, None, None, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, node):
+        entry = self._entries.get(id(node))
+        return entry is not None and entry[_NODE] is node
+
+    def _entry(self, node):
+        entry = self._entries.get(id(node))
+        if entry is None or entry[_NODE] is not node:
+            raise KeyError(node)
+        return entry
+
+    def _add(self, node, parent, field, scope):
+        """ Index a subtree, returning the id of its root """
+        entries = self._entries
+        by_type = self._by_type
+        root_id = id(node)
+        stack = [(node, parent, field, scope)]
+        while stack:
+            node, parent, field, scope = stack.pop()
+            entry = [node, parent, field, scope, self._order, []]
+            self._order += 1
+            entries[id(node)] = entry
+            nodes = by_type.get(node.__class__)
+            if nodes is None:
+                nodes = by_type[node.__class__] = OrderedDict()
+            nodes[id(node)] = node
+            if parent is not None:
+                entries[id(parent)][_CHILDREN].append(id(node))
+
+            child_scope = node if isinstance(node, _SCOPE_TYPES) else scope
+            children = []
+            for child_field in child_fields(node.__class__):
+                value = getattr(node, child_field, None)
+                if isinstance(value, ast.AST):
+                    if not isinstance(value, _SHARED_TYPES):
+                        children.append((value, node, child_field,
+                                         child_scope))
+                elif isinstance(value, list):
+                    for item in value:
+                        if (isinstance(item, ast.AST) and
+                            not isinstance(item, _SHARED_TYPES)):
+                            children.append((item, node, child_field,
+                                             child_scope))
+            children.reverse()
+            stack.extend(children)
+        self._queries.clear()
+        return root_id
+
+    def _remove(self, node):
+        """ Forget a subtree as it was indexed, however it has changed since
+        """
+        entries = self._entries
+        stack = [id(node)]
+        while stack:
+            entry = entries.pop(stack.pop())
+            del self._by_type[entry[_NODE].__class__][id(entry[_NODE])]
+            stack.extend(entry[_CHILDREN])
+        self._queries.clear()
+
+    def nodes(self, node_type):
+        """ Get the nodes that are instances of a node type
+
+            Abstract types such as ast.expr give the nodes of all of their
+            subclasses.
+        """
+        result = self._queries.get(node_type)
+        if result is not None:
+            return list(result)
+        node_types = [node_type]
+        class_tree = ast_class_tree()
+        if class_tree.contains(node_type):
+            node_types.extend(class_tree.descendants(node_type))
+        groups = [self._by_type[cls] for cls in node_types
+                  if self._by_type.get(cls)]
+        if len(groups) == 1:
+            result = list(groups[0].values())
+        else:
+            entries = self._entries
+            result = sorted((node for group in groups
+                             for node in group.values()),
+                            key=lambda node: entries[id(node)][_ORDER])
+        self._queries[node_type] = result
+        return list(result)
+
+    def parent(self, node):
+        """ Get a node's parent, or None for the root of the tree """
+        return self._entry(node)[_PARENT]
+
+    def parent_field(self, node):
+        """ Get the name of the parent's field that holds a node """
+        return self._entry(node)[_FIELD]
+
+    def enclosing_scope(self, node):
+        """ Get the innermost function, lambda or class that contains a node,
+            or None at module level
+        """
+        return self._entry(node)[_SCOPE]
+
+    def ancestors(self, node):
+        """ Generate a node's ancestors, innermost first """
+        parent = self._entry(node)[_PARENT]
+        while parent is not None:
+            yield parent
+            parent = self._entries[id(parent)][_PARENT]
+
+    def replace(self, old, new):
+        """ Replace a node in the tree and update the index
+
+            new may be a node, a list of nodes (when old is in a list) or
+            None to remove old. replace(node, node) indexes a node's subtree
+            again after its children have been changed in place.
+        """
+        entry = self._entry(old)
+        parent, field, scope = entry[_PARENT], entry[_FIELD], entry[_SCOPE]
+        if parent is None:
+            if not isinstance(new, ast.AST):
+                raise ValueError("the root of the tree must stay a node")
+            self._remove(old)
+            self.tree = new
+            self._add(new, None, None, None)
+            return
+
+        if isinstance(new, ast.AST):
+            new_nodes = [new]
+        elif new is None:
+            new_nodes = []
+        else:
+            new_nodes = list(new)
+        value = getattr(parent, field)
+        if isinstance(value, list):
+            for position, item in enumerate(value):
+                if item is old:
+                    value[position:position + 1] = new_nodes
+                    break
+        elif len(new_nodes) == 1:
+            setattr(parent, field, new_nodes[0])
+        elif not new_nodes:
+            delattr(parent, field)
+        else:
+            raise ValueError("%s.%s holds a single node"
+                             % (parent.__class__.__name__, field))
+
+        self._remove(old)
+        siblings = self._entries[id(parent)][_CHILDREN]
+        siblings.remove(id(old))
+        for node in new_nodes:
+            self._add(node, parent, field, scope)
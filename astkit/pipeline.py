@@ -0,0 +1,345 @@
+""" pipeline.py
+
+Run several AST processors over a tree in a single traversal.
+
+A processor that subclasses PipelineProcessor declares what it does to each
+kind of node with handle_<NodeClass> methods instead of walking the tree
+itself. A Pipeline fuses consecutive pipeline processors so that every node
+is visited once and passed to each interested handler in turn, rather than
+the whole tree being walked once per processor.
+
+Handlers run in post-order: when a handler sees a node, all of the node's
+descendants have already been through every processor in the pipeline. Like
+the visit methods of ast.NodeTransformer, a handler returns the node, a
+replacement for it, None to remove it or, for nodes in a list, a list of
+nodes to put in its place. A replacement, or a node the handler changed in
+place, is then walked by the processors that come after the one that
+produced it, exactly as it would be if the processors ran one after another.
+
+A processor whose handlers depend on a later processor not having run on
+their descendants yet should set fusible to False; the pipeline then runs it
+as a stage of its own.
+
+Any processor can declare the node types it is interested in with a
+node_types attribute; a pipeline processor is assumed to be interested in
+the types it has handlers for. A pipeline skips a processor entirely for a
+tree that contains none of those types, and a fused traversal doesn't descend
+into subtrees that contain nothing its remaining processors handle.
+"""
+from timeit import default_timer
+
+from astkit import ast
+from astkit.util import shallow_key
+from astkit.walker import iter_child_nodes, walk
+
+_node_bits = {}
+
+def node_bit(node_class):
+    """ Get the bit that stands for a node class in node type masks """
+    try:
+        return _node_bits[node_class]
+    except KeyError:
+        bit = _node_bits[node_class] = 1 << len(_node_bits)
+        return bit
+
+# every bit set: matches any mask that has a node in it
+ALL_NODE_TYPES = -1
+
+def interest_mask(processor):
+    """ Get the mask of node types a processor is interested in or None if
+        it hasn't said
+    """
+    node_types = getattr(processor, 'node_types', None)
+    if node_types is None:
+        if not isinstance(processor, PipelineProcessor):
+            return None
+        node_types = []
+        for name in dir(processor):
+            if not name.startswith('handle_'):
+                continue
+            node_class = getattr(ast, name[len('handle_'):], None)
+            if not (isinstance(node_class, type) and
+                    issubclass(node_class, ast.AST)):
+                # a handler for a node type we don't know about
+                return ALL_NODE_TYPES
+            node_types.append(node_class)
+    mask = 0
+    for node_type in node_types:
+        mask |= _type_mask(node_type)
+    return mask
+
+_type_masks = {}
+
+def _type_mask(node_type):
+    """ Get the mask for a node type and, since abstract types such as
+        ast.expr stand for all of their subclasses, every subclass of it
+    """
+    try:
+        return _type_masks[node_type]
+    except KeyError:
+        pass
+    mask = node_bit(node_type)
+    for value in vars(ast).values():
+        if (isinstance(value, type) and value is not node_type and
+            issubclass(value, node_type)):
+            mask |= node_bit(value)
+    _type_masks[node_type] = mask
+    return mask
+
+def subtree_masks(tree):
+    """ Map the id of each node in a tree to a (node, mask) pair, where the
+        mask covers the types of the node and all of its descendants
+    """
+    masks = {}
+    stack = [(tree, None)]
+    while stack:
+        node, children = stack.pop()
+        if children is None:
+            children = list(iter_child_nodes(node))
+            stack.append((node, children))
+            stack.extend((child, None) for child in children)
+            continue
+        mask = node_bit(node.__class__)
+        for child in children:
+            mask |= masks[id(child)][1]
+        masks[id(node)] = (node, mask)
+    return masks
+
+class PipelineProcessor(object):
+    """ A processor made of per-node-type handlers that can share a traversal
+        with other pipeline processors
+    """
+
+    fusible = True
+
+    def process(self, tree):
+        return _FusedStage([self]).process(tree)
+
+class Pipeline(object):
+    """ Run a sequence of processors, fusing the traversals of consecutive
+        fusible pipeline processors
+    """
+
+    def __init__(self, processors):
+        self.processors = list(processors)
+        self._stages = []
+        fused = []
+        for processor in self.processors:
+            if (isinstance(processor, PipelineProcessor) and
+                processor.fusible):
+                fused.append(processor)
+                continue
+            if fused:
+                self._add_stage(_FusedStage(fused))
+                fused = []
+            self._add_stage(processor)
+        if fused:
+            self._add_stage(_FusedStage(fused))
+
+    def _add_stage(self, stage):
+        if isinstance(stage, _FusedStage):
+            interest = stage.interest
+        else:
+            interest = interest_mask(stage)
+        self._stages.append((stage, interest))
+
+    def process(self, tree, record=None, profile=None):
+        """ Run the processors over a tree
+
+            If record is given, it is called with a label and the time taken
+            for each stage that runs. If profile is given, it should be an
+            astkit.stats.ProcessorProfile to add the cost of each processor
+            to.
+        """
+        # masks are only worked out when a stage has declared its interests,
+        # and have to be worked out again once a stage has changed the tree
+        masks = None
+        for stage, interest in self._stages:
+            if interest is not None:
+                if masks is None:
+                    masks = subtree_masks(tree)
+                if not masks[id(tree)][1] & interest:
+                    continue
+            if record is not None:
+                start = default_timer()
+            if isinstance(stage, _FusedStage):
+                tree = stage.process(tree, masks, profile)
+            elif profile is not None:
+                tree = _profiled_process(stage, tree, profile)
+            else:
+                tree = stage.process(tree)
+            if record is not None:
+                record(stage_label(stage), default_timer() - start)
+            masks = None
+        return tree
+
+def _profiled_process(processor, tree, profile):
+    """ Run an opaque processor, working out what it changed by comparing the
+        tree before and after
+    """
+    before = {}
+    visited = 0
+    for node in walk(tree):
+        before[id(node)] = (node, shallow_key(node))
+        visited += 1
+    start = default_timer()
+    tree = processor.process(tree)
+    seconds = default_timer() - start
+    changed = 0
+    for node in walk(tree):
+        entry = before.get(id(node))
+        if entry is None or entry[0] is not node or \
+                entry[1] != shallow_key(node):
+            changed += 1
+    profile.record(processor, seconds, visited, changed)
+    return tree
+
+def stage_label(stage):
+    """ Name a pipeline stage after the processors in it """
+    if isinstance(stage, _FusedStage):
+        names = [processor.__class__.__name__
+                 for processor in stage.processors]
+        if len(names) == 1:
+            return names[0]
+        return 'pipeline(%s)' % ', '.join(names)
+    return stage.__class__.__name__
+
+class _Run(object):
+    """ The state of one traversal by a _FusedStage
+
+        A stage can be shared, by threads importing modules at the same time
+        among others, so anything that belongs to a single run lives here.
+    """
+
+    __slots__ = ('done', 'masks', 'costs')
+
+    def __init__(self, masks, costs):
+        # id -> (node, the first processor it has been through)
+        self.done = {}
+        self.masks = masks
+        # [seconds, visited, changed] for each processor, when profiling
+        self.costs = costs
+
+class _FusedStage(object):
+    """ A single traversal that applies the handlers of several processors """
+
+    def __init__(self, processors):
+        self.processors = processors
+        self._handler_table = {}
+        # the node types processors[start:] are interested in, by start
+        self._interests = [0] * (len(processors) + 1)
+        for position in range(len(processors) - 1, -1, -1):
+            self._interests[position] = (self._interests[position + 1] |
+                                         interest_mask(processors[position]))
+        self.interest = self._interests[0]
+
+    def process(self, tree, masks=None, profile=None):
+        costs = None
+        if profile is not None:
+            costs = [[0.0, 0, 0] for processor in self.processors]
+        run = _Run(masks, costs)
+        try:
+            return self._visit(run, tree, 0)
+        finally:
+            if profile is not None:
+                for processor, cost in zip(self.processors, costs):
+                    profile.record(processor, *cost)
+
+    def _handlers(self, node_class):
+        """ Get the (position, handler) pairs for a node class in processor
+            order
+        """
+        try:
+            return self._handler_table[node_class]
+        except KeyError:
+            pass
+        name = 'handle_' + node_class.__name__
+        handlers = []
+        for position, processor in enumerate(self.processors):
+            handler = getattr(processor, name, None)
+            if handler is not None:
+                handlers.append((position, handler))
+        # threads racing here build the same list
+        self._handler_table[node_class] = handlers
+        return handlers
+
+    def _visit(self, run, node, start):
+        """ Apply processors[start:] to a node and its descendants """
+        done = run.done.get(id(node))
+        if done is not None and done[1] <= start:
+            # a replacement can reuse nodes that have already been processed
+            return node
+        if run.masks is not None:
+            # nodes that a handler created aren't in the masks
+            entry = run.masks.get(id(node))
+            if (entry is not None and entry[0] is node and
+                not entry[1] & self._interests[start]):
+                return node
+        self._visit_children(run, node, start)
+
+        for position, handler in self._handlers(node.__class__):
+            if position < start:
+                continue
+            key = shallow_key(node)
+            if run.costs is None:
+                result = handler(node)
+            else:
+                result = self._profiled_handler(run.costs[position], handler,
+                                                node, key)
+            if result is not node:
+                return self._revisit(run, result, position + 1)
+            if (position + 1 < len(self.processors) and
+                shallow_key(node) != key):
+                # the handler changed the node in place; children it added
+                # still have to go through the processors after it
+                self._visit_children(run, node, position + 1)
+        run.done[id(node)] = (node, start)
+        return node
+
+    def _visit_children(self, run, node, start):
+        """ Apply processors[start:] to a node's descendants """
+        for field, old_value in ast.iter_fields(node):
+            if isinstance(old_value, list):
+                new_values = []
+                for value in old_value:
+                    if isinstance(value, ast.AST):
+                        value = self._visit(run, value, start)
+                        if value is None:
+                            continue
+                        elif not isinstance(value, ast.AST):
+                            new_values.extend(value)
+                            continue
+                    new_values.append(value)
+                old_value[:] = new_values
+            elif isinstance(old_value, ast.AST):
+                new_node = self._visit(run, old_value, start)
+                if new_node is None:
+                    delattr(node, field)
+                else:
+                    setattr(node, field, new_node)
+
+    def _profiled_handler(self, cost, handler, node, key):
+        start = default_timer()
+        result = handler(node)
+        cost[0] += default_timer() - start
+        cost[1] += 1
+        if result is not node or shallow_key(node) != key:
+            cost[2] += 1
+        return result
+
+    def _revisit(self, run, result, start):
+        """ Walk a handler's replacement with the processors after it """
+        if result is None or start == len(self.processors):
+            return result
+        if isinstance(result, ast.AST):
+            return self._visit(run, result, start)
+        new_values = []
+        for value in result:
+            value = self._visit(run, value, start)
+            if value is None:
+                continue
+            elif not isinstance(value, ast.AST):
+                new_values.extend(value)
+                continue
+            new_values.append(value)
+        return new_values
@@ -0,0 +1,139 @@
+""" precompile.py
+
+Process and compile every module in a directory tree ahead of time.
+
+Like compileall, but each module is run through the installed processors and
+the result is written to the code cache, so that the first real import of the
+module is a cache hit instead of paying for processing. Modules are compiled
+in a pool of worker processes.
+
+    python -m astkit.precompile [-j WORKERS] [--setup MODULE] [--cache-dir DIR]
+                                [--hash] [--prefix PACKAGE] directory ...
+
+The directory should be an entry of sys.path (or, with --prefix, the
+directory of the named package) so that modules get the names they will be
+imported under. Processors are installed by importing the --setup modules,
+which would normally be the ones that call install_processor at startup.
+"""
+import multiprocessing
+import optparse
+import os
+import sys
+
+from astkit.processor import _ModuleLoader, _processor_manager
+from astkit.processor import enable_code_cache
+
+def find_modules(directory, prefix=None):
+    """ Generate (fullname, path) pairs for the modules in a directory tree
+
+        Subdirectories are only entered if they are packages.
+    """
+    directory = os.path.abspath(directory)
+    for dirpath, dirnames, filenames in os.walk(directory):
+        relative = os.path.relpath(dirpath, directory)
+        parts = [] if relative == os.curdir else relative.split(os.sep)
+        if prefix:
+            parts = prefix.split('.') + parts
+        dirnames[:] = sorted(name for name in dirnames
+                             if os.path.isfile(os.path.join(dirpath, name,
+                                                            '__init__.py')))
+        for filename in sorted(filenames):
+            name, extension = os.path.splitext(filename)
+            if extension != '.py':
+                continue
+            if name == '__init__':
+                if not parts:
+                    continue
+                fullname = '.'.join(parts)
+            else:
+                fullname = '.'.join(parts + [name])
+            yield fullname, os.path.join(dirpath, filename)
+
+def precompile(directories, workers=None, manager=None, prefix=None):
+    """ Process, compile and cache the modules found in some directories
+
+        Returns a list of (fullname, path, error) tuples for the modules that
+        couldn't be compiled. Modules no processor is interested in are left
+        alone. workers is the number of processes to use and defaults to the
+        number of CPUs; with a single worker everything happens in this
+        process.
+    """
+    if manager is None:
+        manager = _processor_manager
+    if manager.code_cache is None:
+        raise ValueError("the code cache must be enabled to precompile")
+    if isinstance(directories, str):
+        directories = [directories]
+    modules = [(fullname, path)
+               for directory in directories
+               for fullname, path in find_modules(directory, prefix)
+               if manager.wants(fullname, path)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(modules) <= 1:
+        _init_worker(manager)
+        results = [_compile_module(module) for module in modules]
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker, (manager,))
+        try:
+            chunksize = max(1, len(modules) // (workers * 4))
+            results = list(pool.imap_unordered(_compile_module, modules,
+                                               chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    return [result for result in results if result[2] is not None]
+
+_worker_manager = None
+
+def _init_worker(manager):
+    global _worker_manager
+    _worker_manager = manager
+
+def _compile_module(module):
+    fullname, path = module
+    loader = _ModuleLoader(path, _worker_manager)
+    try:
+        loader._get_code(fullname)
+    except Exception:
+        error = sys.exc_info()[1]
+        return (fullname, path, "%s: %s" % (error.__class__.__name__, error))
+    return (fullname, path, None)
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage="%prog [options] directory [directory ...]")
+    parser.add_option('-j', '--workers', type='int', default=None,
+                      help="number of worker processes (default: CPU count)")
+    parser.add_option('--setup', action='append', default=[],
+                      metavar='MODULE',
+                      help="import MODULE to install processors")
+    parser.add_option('--cache-dir', default=None,
+                      help="keep cache entries in this directory instead of "
+                           "__pycache__ directories")
+    parser.add_option('--hash', action='store_true', default=False,
+                      help="validate cache entries by source hash")
+    parser.add_option('--prefix', default=None, metavar='PACKAGE',
+                      help="name of the package the directories belong to")
+    options, directories = parser.parse_args(argv)
+    if not directories:
+        parser.error("no directories given")
+
+    for module in options.setup:
+        __import__(module)
+    if _processor_manager.code_cache is None:
+        enable_code_cache(options.cache_dir,
+                          'hash' if options.hash else 'mtime')
+    elif options.cache_dir is not None or options.hash:
+        # replacing the cache would lose the directory and bounds it was
+        # set up with
+        parser.error("--cache-dir and --hash can't be used when a --setup "
+                     "module enables the code cache")
+
+    failures = precompile(directories, options.workers, prefix=options.prefix)
+    for fullname, path, error in failures:
+        sys.stderr.write("%s (%s): %s\n" % (fullname, path, error))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
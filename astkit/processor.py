@@ -5,15 +5,39 @@ A collection of tools for the installation and use of generic AST processors.
 More specifically, we need an import hook and a way to pipeline AST transformers
 and visitors.
 """
-import imp
+import fnmatch
 import logging
 import os
+import re
 import sys
+import threading
+import types
+from collections import OrderedDict
+from timeit import default_timer
+
+try:
+    from importlib.machinery import ModuleSpec, PathFinder
+    from importlib.machinery import EXTENSION_SUFFIXES
+except ImportError:
+    import imp
+    ModuleSpec = PathFinder = None
+    EXTENSION_SUFFIXES = [suffix for suffix, mode, kind in imp.get_suffixes()
+                          if kind == imp.C_EXTENSION]
+
+try:
+    # the locks importlib takes around each import, so that loading a module
+    # directly is serialized with importing it
+    from importlib._bootstrap import _ModuleLockManager as _module_lock
+except ImportError:
+    _module_lock = None
 
 log = logging.getLogger(__name__)
 
 from astkit import ast
+from astkit.cache import CodeCache, processor_fingerprint
+from astkit.pipeline import Pipeline
 from astkit.render import SourceCodeRenderer
+from astkit.stats import ImportStats, ProcessorProfile, timed
 
 major = sys.version_info[0]
 if major == 2:
@@ -24,14 +48,105 @@ else:
     raise RuntimeError("Couldn't find a compatible 'exec_f' for version %r",
                        major)
 
+class ModuleFilter(object):
+    """ Decide which modules should be processed
+        
+        Rules come in three forms:
+        
+          * a dotted name such as 'myapp.models', which matches that module
+            and everything inside it
+          * a glob over dotted names such as 'myapp.*.views'
+          * a path, recognized by containing a path separator, which matches
+            modules whose file is at or below it; it may also be a glob
+        
+        A module is accepted if it matches at least one include rule (or
+        there are none) and no exclude rule. Name rules can be checked before
+        the module has been found on disk, so modules they reject cost the
+        import system almost nothing.
+    """
+    
+    def __init__(self, include=None, exclude=None):
+        self.include = _Rules(include or ())
+        self.exclude = _Rules(exclude or ())
+    
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+    __nonzero__ = __bool__
+    
+    def might_accept(self, fullname):
+        """ Check a module before its path is known """
+        if self.exclude.match_name(fullname):
+            return False
+        if self.include and not self.include.paths:
+            return self.include.match_name(fullname)
+        return True
+    
+    def accepts(self, fullname, path):
+        if self.exclude.match_name(fullname) or self.exclude.match_path(path):
+            return False
+        if self.include:
+            return (self.include.match_name(fullname) or
+                    self.include.match_path(path))
+        return True
+
+class _Rules(object):
+    """ A compiled set of module filter rules """
+    
+    def __init__(self, rules):
+        names = []
+        name_globs = []
+        self.paths = []
+        for rule in rules:
+            if os.sep in rule or (os.altsep and os.altsep in rule):
+                self.paths.append(_normalize_path(rule))
+            elif _is_glob(rule):
+                name_globs.append(fnmatch.translate(rule))
+            else:
+                names.append(rule)
+        self._names = frozenset(names)
+        self._prefixes = tuple(name + '.' for name in names)
+        self._name_glob = None
+        if name_globs:
+            self._name_glob = re.compile('|'.join(name_globs))
+    
+    def __bool__(self):
+        return bool(self._names or self._name_glob or self.paths)
+    __nonzero__ = __bool__
+    
+    def match_name(self, fullname):
+        if fullname in self._names or fullname.startswith(self._prefixes):
+            return True
+        return (self._name_glob is not None and
+                self._name_glob.match(fullname) is not None)
+    
+    def match_path(self, path):
+        if not self.paths:
+            return False
+        path = _normalize_path(path)
+        for rule in self.paths:
+            if _is_glob(rule):
+                if fnmatch.fnmatchcase(path, rule):
+                    return True
+            elif path == rule or path.startswith(rule.rstrip(os.sep) + os.sep):
+                return True
+        return False
+
+def _is_glob(rule):
+    return '*' in rule or '?' in rule or '[' in rule
+
+def _normalize_path(path):
+    return os.path.normcase(os.path.abspath(path))
+
 class _ModuleLoader(object):
     
-    def __init__(self, fullpath):
+    def __init__(self, fullpath, manager=None):
         self.fullpath = fullpath
+        self.manager = manager
     
     def _get_source(self, path):
         """ Get the source code from a file path """
-        with open(path, 'r') as f:
+        # read bytes so that the parser honors the module's coding declaration
+        with open(path, 'rb') as f:
             source = f.read()
         return source
     
@@ -43,85 +158,558 @@ class _ModuleLoader(object):
         """
         # packages are loaded from __init__.py files
         ispkg = self.fullpath.endswith('__init__.py')
-        code_str = self._get_source(self.fullpath)
-        code_tree = ast.parse(code_str)
-        new_code_tree = _processor_manager.process(code_tree)
-        log.debug(SourceCodeRenderer.render(new_code_tree))
-        code = compile(new_code_tree, self.fullpath, 'exec')
+        manager = self.manager
+        if manager is None:
+            manager = _processor_manager
+        stats = manager.import_stats
+        cache = manager.code_cache
+        if cache is not None:
+            fingerprint = manager.fingerprint(fullname, self.fullpath)
+            key = cache.source_key(self.fullpath)
+            code = timed(stats, fullname, 'cache',
+                         cache.load, self.fullpath, fingerprint, key)
+            if code is not None:
+                if manager.reload_sources is not None:
+                    manager.reload_sources[fullname] = \
+                        self._get_source(self.fullpath)
+                return (ispkg, code)
+        code_str = timed(stats, fullname, 'read',
+                         self._get_source, self.fullpath)
+        if manager.reload_sources is not None:
+            # astkit.reload compares against this to find what has changed
+            manager.reload_sources[fullname] = code_str
+        code_tree = timed(stats, fullname, 'parse',
+                          ast.parse, code_str, self.fullpath)
+        new_code_tree = manager.process(code_tree, fullname, self.fullpath)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(timed(stats, fullname, 'render',
+                            SourceCodeRenderer.render, new_code_tree))
+        if manager.dump_directory is not None:
+            timed(stats, fullname, 'render',
+                  manager.dump_source, fullname, new_code_tree)
+        code = timed(stats, fullname, 'compile',
+                     compile, new_code_tree, self.fullpath, 'exec')
+        if cache is not None:
+            timed(stats, fullname, 'cache',
+                  cache.store, self.fullpath, fingerprint, key, code)
         return (ispkg, code)
     
-    def load_module(self, fullname):
+    def _exec(self, fullname, code, namespace):
+        manager = self.manager
+        if manager is None:
+            manager = _processor_manager
+        stats = manager.import_stats
+        if stats is None:
+            exec_f(code, namespace)
+            return
+        stats.begin_exec(fullname)
+        start = default_timer()
+        try:
+            exec_f(code, namespace)
+        finally:
+            stats.end_exec(fullname, default_timer() - start)
+    
+    def is_package(self, fullname):
+        return self.fullpath.endswith('__init__.py')
+    
+    def create_module(self, spec):
+        # use the default module creation semantics
+        return None
+    
+    def exec_module(self, module):
+        fullname = module.__name__
         ispkg, code = self._get_code(fullname)
-        mod = sys.modules.setdefault(fullname, imp.new_module(fullname))
-        mod.__file__ = self.fullpath
-        mod.__loader__ = self
-        if ispkg:
-            mod.__path__ = [os.path.dirname(self.fullpath)]
-        exec_f(code, mod.__dict__)
-        return mod
+        # importlib already holds this lock; taking it again keeps the
+        # bookkeeping load_module relies on consistent for direct callers
+        with module_lock(fullname):
+            _loading.add(fullname)
+            try:
+                self._exec(fullname, code, module.__dict__)
+            finally:
+                _loading.discard(fullname)
+            _load_generations[fullname] = \
+                _load_generations.get(fullname, 0) + 1
+    
+    def load_module(self, fullname):
+        """ Load a module with the pre-PEP 451 protocol used by Python 2
+            
+            Concurrent loads of the same module are serialized, and a thread
+            that finds the module was loaded while it waited gets that module
+            instead of processing and executing it again. Loading a module
+            that was already fully loaded reloads it.
+        """
+        # read before waiting for the lock: if a load finishes while this
+        # thread waits, the module it finds wasn't a reason to reload
+        generation = _load_generations.get(fullname, 0)
+        existing = sys.modules.get(fullname)
+        with module_lock(fullname):
+            mod = sys.modules.get(fullname)
+            if fullname in _loading:
+                # this thread is executing the module already; like
+                # importlib, hand back the partly initialised module
+                return mod
+            if mod is not None and (
+                    mod is not existing or
+                    _load_generations.get(fullname, 0) != generation):
+                # another thread loaded it while this one waited
+                return mod
+            ispkg, code = self._get_code(fullname)
+            mod = sys.modules.setdefault(fullname, types.ModuleType(fullname))
+            mod.__file__ = self.fullpath
+            mod.__loader__ = self
+            if ispkg:
+                mod.__path__ = [os.path.dirname(self.fullpath)]
+            _loading.add(fullname)
+            try:
+                self._exec(fullname, code, mod.__dict__)
+            except BaseException:
+                # a module that failed to load mustn't be found by later
+                # imports, unless it was already there before (a reload)
+                if existing is None:
+                    sys.modules.pop(fullname, None)
+                raise
+            finally:
+                _loading.discard(fullname)
+            _load_generations[fullname] = \
+                _load_generations.get(fullname, 0) + 1
+            return mod
+
+# the modules being executed, and how many times exec_module or load_module
+# has finished loading each module; both are only changed under the module's
+# lock
+_loading = set()
+_load_generations = {}
+
+class _NamedLocks(object):
+    """ Reentrant locks created on demand for each module name
+        
+        Used where importlib's own module locks aren't available. On Python 2
+        an import already holds the global import lock, so these only matter
+        for loads made outside of an import statement.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+    
+    def __call__(self, fullname):
+        with self._lock:
+            lock = self._locks.get(fullname)
+            if lock is None:
+                lock = self._locks[fullname] = threading.RLock()
+            return lock
+
+if _module_lock is not None:
+    module_lock = _module_lock
+else:
+    module_lock = _NamedLocks()
 
 class _NullLoader(object):
     
     def load_module(self, fullname):
         return sys.modules[fullname]
 
+class _DirectoryListing(object):
+    """ The cached contents of a directory on the import path
+        
+        The contents are listed again only when the directory's mtime changes,
+        so each lookup costs a single stat instead of one per candidate file.
+    """
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self._mtime = None
+        self._contents = frozenset()
+    
+    def contents(self):
+        try:
+            mtime = os.stat(self.directory or os.curdir).st_mtime
+        except OSError:
+            return frozenset()
+        if mtime != self._mtime:
+            try:
+                contents = frozenset(os.listdir(self.directory or os.curdir))
+            except OSError:
+                # not a directory; zip files and the like aren't our concern
+                contents = frozenset()
+            self._contents = contents
+            self._mtime = mtime
+        return self._contents
+
+# returned by _ImportHook._loader_for_path for modules that aren't source
+_EXTENSION = object()
+
+class _MissCache(object):
+    """ A bounded record of (fullname, search path) lookups that found nothing
+        
+        Each entry remembers how many stat calls the failed search made, so
+        the counters can report how many calls the cache has saved. Entries
+        are dropped oldest first once there are more than maxsize of them.
+    """
+    
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.evictions = 0
+        self.stats_saved = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def hit(self, fullname, path):
+        """ Check whether a lookup is known to fail, counting it if it is """
+        key = (fullname, path)
+        with self._lock:
+            cost = self._entries.pop(key, None)
+            if cost is None:
+                return False
+            self._entries[key] = cost
+            self.hits += 1
+            self.stats_saved += cost
+        return True
+    
+    def add(self, fullname, path, cost):
+        with self._lock:
+            self._entries[(fullname, path)] = cost
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        return {'entries': len(self._entries),
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'stats_saved': self.stats_saved,
+                }
+
 class _ImportHook(object):
-    """ An implementation of an import hook per PEP 302
+    """ An implementation of an import hook per PEP 302 and PEP 451
+        
+        Searches that find nothing are remembered for the search path they
+        were made over until importlib.invalidate_caches() is called, as the
+        standard finders' caches are; a module created after a failed import
+        of the same name won't be found before then.
+        
+        A hook that belongs to a processor manager only claims the modules
+        that one of the manager's processors is interested in; the rest are
+        left to the normal import system.
     """
     
+    def __init__(self, manager=None):
+        self.manager = manager
+        self._listings = {}
+        self.miss_cache = _MissCache()
+    
+    def find_spec(self, fullname, path=None, target=None):
+        loader = self._find_loader(fullname, path)
+        if loader is None:
+            return None
+        spec = ModuleSpec(fullname, loader, origin=loader.fullpath,
+                          is_package=loader.is_package(fullname))
+        if spec.submodule_search_locations is not None:
+            spec.submodule_search_locations.append(
+                os.path.dirname(loader.fullpath))
+        spec.has_location = True
+        return spec
+    
     def find_module(self, fullname, path=[]):
         log.debug("find_module('%s', path=%r)",fullname, path)
         
-        log.debug(sys.modules.get(fullname))
         if fullname in sys.modules:
             return _NullLoader()
+        return self._find_loader(fullname, path)
+    
+    def invalidate_caches(self):
+        """ Forget all directory listings; called by
+            importlib.invalidate_caches()
+        """
+        self._listings.clear()
+        self.miss_cache.clear()
+    
+    def _find_loader(self, fullname, path):
+        manager = self.manager
+        if manager is not None and not manager.wants(fullname):
+            return None
         
+        stats = manager.import_stats if manager is not None else None
+        if stats is None:
+            return self._search(fullname, path)
+        start = default_timer()
+        loader = self._search(fullname, path)
+        if loader is None:
+            stats.record_miss(default_timer() - start)
+        else:
+            stats.record(fullname, 'find', default_timer() - start)
+        return loader
+    
+    def _search(self, fullname, path):
+        manager = self.manager
         if not path:
             path = sys.path
+        path = tuple(path)
+        if self.miss_cache.hit(fullname, path):
+            return None
         
         for directory in path:
             loader = self._loader_for_path(directory, fullname)
+            if loader is _EXTENSION:
+                # the standard path finder would import this; so should we
+                break
             if loader:
+                if (manager is not None and
+                    not manager.wants(fullname, loader.fullpath)):
+                    return None
                 return loader
+        # every path entry searched was stat'ed at least once
+        self.miss_cache.add(fullname, path, len(path))
+    
+    def _contents(self, directory):
+        listing = self._listings.get(directory)
+        if listing is None:
+            listing = self._listings.setdefault(directory,
+                                                _DirectoryListing(directory))
+        return listing.contents()
+    
+    def _module_file(self, contents, name):
+        """ Pick the file a module would be imported from out of a
+            directory's contents, trying extension modules before source as
+            the standard path finder does
+        """
+        for suffix in EXTENSION_SUFFIXES:
+            if name + suffix in contents:
+                return _EXTENSION
+        if name + '.py' in contents:
+            return name + '.py'
+        return None
     
     def _loader_for_path(self, directory, fullname):
-        log.debug("[loader for path] directory: %s; fullname: %s",
-                  directory, fullname)
-        module_path = os.path.join(directory, fullname.split('.')[-1]) + ".py"
-        if os.path.exists(module_path):
-            log.debug("loading module from %s", module_path)
-            loader = _ModuleLoader(module_path)
-            return loader
+        """ Find a loader for a module in a path entry
+            
+            Like the standard path finder, a package wins over a module of
+            the same name. Returns _EXTENSION if the module would be imported
+            from an extension module, which the hook leaves alone.
+        """
+        contents = self._contents(directory)
+        name = fullname.rpartition('.')[2]
         
-        package_path = os.path.join(directory, fullname.split('.')[-1], '__init__.py')
-        if os.path.exists(package_path):
-            loader = _ModuleLoader(package_path)
-            return loader
+        if name in contents:
+            package_directory = os.path.join(directory, name)
+            found = self._module_file(self._contents(package_directory),
+                                      '__init__')
+            if found is _EXTENSION:
+                return found
+            if found is not None:
+                package_path = os.path.join(package_directory, found)
+                return _ModuleLoader(package_path, self.manager)
+        found = self._module_file(contents, name)
+        if found is _EXTENSION:
+            return found
+        if found is not None:
+            module_path = os.path.join(directory, found)
+            log.debug("loading module from %s", module_path)
+            return _ModuleLoader(module_path, self.manager)
 
 class _ProcessorManager(object):
     
     def __init__(self):
         self._processors = []
-        self.import_hook = _ImportHook()
+        # module filters keyed by the id of the processor they belong to
+        self._filters = {}
+        # pipelines keyed by the ids of the processors they run, which they
+        # keep alive; filters mean different modules can need different ones
+        self._pipelines = {}
+        self.module_filter = ModuleFilter()
+        self.import_hook = _ImportHook(self)
+        self.dump_directory = None
+        self.code_cache = None
+        self.import_stats = None
+        self.processor_profile = None
+        self.reload_sources = None
     
-    def add_processor(self, processor):
+    def add_processor(self, processor, include=None, exclude=None):
         if not self._processors:
             self._install_import_hook()
         self._processors.append(processor)
+        self._pipelines.clear()
+        if include or exclude:
+            self._filters[id(processor)] = ModuleFilter(include, exclude)
+    
+    def __getstate__(self):
+        # filters are keyed by id, which doesn't survive pickling, and the
+        # import hook belongs to the process it was installed in
+        state = self.__dict__.copy()
+        state['_processors'] = [(processor, self._filters.get(id(processor)))
+                                for processor in self._processors]
+        del state['_filters']
+        del state['_pipelines']
+        del state['import_hook']
+        # timings are only collected in the process that asked for them
+        state['import_stats'] = None
+        state['processor_profile'] = None
+        return state
+    
+    def __setstate__(self, state):
+        processors = state.pop('_processors')
+        self.__dict__.update(state)
+        self._processors = [processor for processor, _ in processors]
+        self._filters = dict((id(processor), module_filter)
+                             for processor, module_filter in processors
+                             if module_filter is not None)
+        self._pipelines = {}
+        self.import_hook = _ImportHook(self)
     
     def _install_import_hook(self):
-        import sys
-        sys.meta_path.append(self.import_hook)
+        # the hook has to come before the standard path finder or it would
+        # never see the modules it is meant to process
+        position = len(sys.meta_path)
+        if PathFinder in sys.meta_path:
+            position = sys.meta_path.index(PathFinder)
+        sys.meta_path.insert(position, self.import_hook)
     
     def _remove_import_hook(self):
-        import sys
         sys.meta_path.remove(self.import_hook)
     
-    def process(self, ast):
+    def wants(self, fullname, path=None):
+        """ Check whether any processor is interested in a module
+            
+            Without a path only the rules that depend on the module's name can
+            be checked, so the answer may still change once it is found.
+        """
+        if path is None:
+            if not self.module_filter.might_accept(fullname):
+                return False
+            for processor in self._processors:
+                module_filter = self._filters.get(id(processor))
+                if (module_filter is None or
+                    module_filter.might_accept(fullname)):
+                    return True
+            return False
+        if (self.module_filter and
+            not self.module_filter.accepts(fullname, path)):
+            return False
+        return bool(self.processors_for(fullname, path))
+    
+    def processors_for(self, fullname, path):
+        """ Get the processors that apply to a module """
+        if not self._filters:
+            return self._processors
+        processors = []
         for processor in self._processors:
-            ast = processor.process(ast)
-        return ast
+            module_filter = self._filters.get(id(processor))
+            if module_filter is None or module_filter.accepts(fullname, path):
+                processors.append(processor)
+        return processors
+    
+    def process(self, ast, fullname=None, path=None):
+        """ Run the processors over a tree; consecutive pipeline processors
+            share a single traversal
+        """
+        processors = self._processors
+        if fullname is not None:
+            processors = self.processors_for(fullname, path)
+        record = None
+        if self.import_stats is not None and fullname is not None:
+            stats = self.import_stats
+            record = lambda label, seconds: stats.record(fullname, label,
+                                                         seconds)
+        return self._pipeline(processors).process(ast, record,
+                                                  self.processor_profile)
+    
+    def _pipeline(self, processors):
+        key = tuple([id(processor) for processor in processors])
+        pipeline = self._pipelines.get(key)
+        if pipeline is None:
+            pipeline = self._pipelines[key] = Pipeline(processors)
+        return pipeline
+    
+    def fingerprint(self, fullname=None, path=None):
+        """ Get a digest identifying the processors that apply to a module
+        """
+        processors = self._processors
+        if fullname is not None:
+            processors = self.processors_for(fullname, path)
+        return processor_fingerprint(processors)
+    
+    def dump_source(self, fullname, tree):
+        """ Write the rendered source of a processed module to the dump
+            directory as <fullname>.py
+            
+            This is a debugging aid, so a module that can't be rendered is
+            logged and skipped rather than failing the import.
+        """
+        path = os.path.join(self.dump_directory, fullname + '.py')
+        try:
+            with open(path, 'w') as f:
+                SourceCodeRenderer.render_to(tree, f)
+        except Exception:
+            log.warning("couldn't dump processed source of %s to %s",
+                        fullname, path, exc_info=True)
 
 _processor_manager = _ProcessorManager()
-def install_processor(processor):
-    _processor_manager.add_processor(processor)
+def install_processor(processor, include=None, exclude=None):
+    """ Process every module imported from now on with the given processor
+        
+        include and exclude are sequences of ModuleFilter rules limiting the
+        modules the processor applies to.
+    """
+    _processor_manager.add_processor(processor, include, exclude)
+
+def filter_modules(include=None, exclude=None):
+    """ Limit the modules any processor applies to with ModuleFilter rules
+    """
+    _processor_manager.module_filter = ModuleFilter(include, exclude)
+
+def dump_processed_source(directory):
+    """ Write the rendered source of every module processed from now on to
+        the given directory. Pass None to stop dumping.
+    """
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _processor_manager.dump_directory = directory
+
+def enable_code_cache(directory=None, validation='mtime', max_size=None,
+                      max_entries=None):
+    """ Cache the code of processed modules on disk
+        
+        See astkit.cache.CodeCache for the meaning of the arguments.
+    """
+    _processor_manager.code_cache = CodeCache(directory, validation,
+                                              max_size, max_entries)
+    return _processor_manager.code_cache
+
+def disable_code_cache():
+    _processor_manager.code_cache = None
+
+def enable_import_stats(report_at_exit=False, stream=None, sort='cumulative'):
+    """ Time each phase of every import handled by the processor hook
+        
+        Returns the astkit.stats.ImportStats collecting the timings. With
+        report_at_exit, a report is written to stream (stderr by default)
+        when the interpreter exits.
+    """
+    stats = _processor_manager.import_stats = ImportStats()
+    if report_at_exit:
+        import atexit
+        atexit.register(stats.dump, stream, sort)
+    return stats
+
+def disable_import_stats():
+    _processor_manager.import_stats = None
+
+def enable_processor_profile():
+    """ Record the cost of each installed processor over all the modules
+        processed from now on
+        
+        Returns the astkit.stats.ProcessorProfile holding the figures.
+    """
+    profile = _processor_manager.processor_profile = ProcessorProfile()
+    return profile
+
+def disable_processor_profile():
+    _processor_manager.processor_profile = None
@@ -0,0 +1,169 @@
+""" reload.py
+
+Reload processed modules incrementally.
+
+Reloading a module normally means processing and executing all of it again.
+With hot reload enabled, the processor import hook remembers the source of
+each module it loads. reload then compares the module's current source with
+that one statement by statement at the top level. Only the statements that
+were added or changed are processed and executed, in the module's existing
+namespace. Statements that haven't changed keep the objects they created.
+
+Where a changed function or class can be updated in place, it is: the old
+function gets the new code object, and the old class gets the new methods.
+Existing references to them, such as instances and callbacks, then see the
+new behavior. Definitions with decorators, or with functions that close over
+variables, are simply rebound, since their old objects can't be safely
+patched.
+
+Processors only see the changed statements, so a processor that needs the
+whole module to do its work should not be used with incremental reloads.
+Functions that weren't changed keep the line numbers they were compiled with
+until the module is fully reloaded.
+"""
+import types
+
+try:
+    from importlib import reload as _reload_module
+except ImportError:
+    from __builtin__ import reload as _reload_module
+
+from astkit import ast
+from astkit.processor import _ModuleLoader, _processor_manager, exec_f
+from astkit.processor import module_lock
+
+_DEFINITIONS = tuple(getattr(ast, name) for name in ('FunctionDef',
+                                                     'AsyncFunctionDef',
+                                                     'ClassDef')
+                     if hasattr(ast, name))
+
+def enable_hot_reload(manager=None):
+    """ Remember the source of each module the import hook loads from now on
+        so that it can be reloaded incrementally
+    """
+    if manager is None:
+        manager = _processor_manager
+    if manager.reload_sources is None:
+        manager.reload_sources = {}
+
+def disable_hot_reload(manager=None):
+    if manager is None:
+        manager = _processor_manager
+    manager.reload_sources = None
+
+def reload(module):
+    """ Bring a module up to date with its source
+
+        Returns a dict with the numbers of 'changed' and 'unchanged'
+        top-level statements, the names of the definitions 'patched' in place
+        and whether a 'full' reload was needed because the module's previous
+        source wasn't known.
+    """
+    fullname = module.__name__
+    loader = getattr(module, '__loader__', None)
+    manager = getattr(loader, 'manager', None)
+    if manager is None:
+        manager = _processor_manager
+    sources = manager.reload_sources
+    if (not isinstance(loader, _ModuleLoader) or sources is None or
+        fullname not in sources):
+        _reload_module(module)
+        return {'changed': None, 'unchanged': None, 'patched': [],
+                'full': True}
+
+    with module_lock(fullname):
+        path = loader.fullpath
+        new_source = loader._get_source(path)
+        old_tree = ast.parse(sources[fullname], path)
+        new_tree = ast.parse(new_source, path)
+        changed = changed_statements(old_tree.body, new_tree.body)
+        patched = []
+        if changed:
+            patched = _execute(module, manager, path, changed)
+        sources[fullname] = new_source
+    return {'changed': len(changed),
+            'unchanged': len(new_tree.body) - len(changed),
+            'patched': patched,
+            'full': False,
+            }
+
+def changed_statements(old_statements, new_statements):
+    """ Get the new statements that don't appear among the old ones
+
+        Statements are compared by structure, ignoring their positions, so
+        moving a statement doesn't count as changing it.
+    """
+    remaining = {}
+    for statement in old_statements:
+        key = ast.dump(statement)
+        remaining[key] = remaining.get(key, 0) + 1
+    changed = []
+    for statement in new_statements:
+        key = ast.dump(statement)
+        if remaining.get(key):
+            remaining[key] -= 1
+        else:
+            changed.append(statement)
+    return changed
+
+def _execute(module, manager, path, statements):
+    tree = ast.Module(body=statements)
+    if 'type_ignores' in tree._fields:
+        tree.type_ignores = []
+    tree = manager.process(tree, module.__name__, path)
+    code = compile(tree, path, 'exec')
+    namespace = module.__dict__
+    previous = {}
+    for statement in statements:
+        if isinstance(statement, _DEFINITIONS) and \
+                statement.name in namespace:
+            previous[statement.name] = (statement, namespace[statement.name])
+    exec_f(code, namespace)
+    patched = []
+    for name, (statement, old) in previous.items():
+        new = namespace.get(name)
+        if new is old or getattr(statement, 'decorator_list', None):
+            continue
+        if _patch(old, new):
+            namespace[name] = old
+            patched.append(name)
+    return sorted(patched)
+
+def _patchable_function(value):
+    return (isinstance(value, types.FunctionType) and
+            value.__closure__ is None)
+
+def _patch(old, new):
+    """ Make an old function or class behave like its new version """
+    if _patchable_function(old) and _patchable_function(new):
+        _patch_function(old, new)
+        return True
+    if isinstance(old, type) and isinstance(new, type):
+        return _patch_class(old, new)
+    return False
+
+def _patch_function(old, new):
+    old.__code__ = new.__code__
+    old.__defaults__ = new.__defaults__
+    if hasattr(new, '__kwdefaults__'):
+        old.__kwdefaults__ = new.__kwdefaults__
+    old.__doc__ = new.__doc__
+    old.__dict__.update(new.__dict__)
+
+def _patch_class(old, new):
+    if old.__bases__ != new.__bases__ or type(old) is not type(new):
+        return False
+    attributes = dict((name, value) for name, value in vars(new).items()
+                      if name not in ('__dict__', '__weakref__', '__doc__',
+                                      '__module__', '__qualname__'))
+    for value in attributes.values():
+        if isinstance(value, types.FunctionType) and value.__closure__:
+            # methods using super() or __class__ are tied to the new class
+            return False
+    for name, value in attributes.items():
+        current = old.__dict__.get(name)
+        if _patchable_function(current) and _patchable_function(value):
+            _patch_function(current, value)
+        else:
+            setattr(old, name, value)
+    return True
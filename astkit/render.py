@@ -18,44 +18,401 @@
 import copy
 import logging
 import sys
+import weakref
 
 from astkit import ast
+from astkit.util import nodes_equal, shallow_key
+from astkit.walker import walk
 
 log = logging.getLogger(__name__)
 
 DEFAULT_INDENTATION = 4
+MAX_RECURSION_DEPTH = 64
 
 class BlankLine():
     pass
 
+# Rendering one of these emits lines rather than returning a string
+_SOURCE_NODE_TYPES = tuple([getattr(ast, name)
+                            for name in ['stmt', 'excepthandler', 'Module',
+                                         'Expression', 'Suite']
+                            if hasattr(ast, name)])
+
+def _emits_source(node):
+    """ Does rendering this node emit lines rather than return a string? """
+    return isinstance(node, _SOURCE_NODE_TYPES)
+
+# Expression precedence, from the most loosely to the most tightly binding
+(_YIELD, _LAMBDA, _IFEXP, _OR, _AND, _NOT, _COMPARE, _BITOR, _BITXOR, _BITAND,
+ _SHIFT, _ARITH, _TERM, _UNARY, _POWER, _AWAIT, _ATOM) = range(17)
+
+# Keyed by node class name; operator nodes are looked up by their operator.
+# Anything not listed is an atom (tuples are always parenthesized).
+_PRECEDENCE = {
+    'Yield': _YIELD, 'YieldFrom': _YIELD,
+    'Lambda': _LAMBDA,
+    'IfExp': _IFEXP,
+    'Or': _OR,
+    'And': _AND,
+    'Not': _NOT,
+    'Compare': _COMPARE, 'Eq': _COMPARE, 'NotEq': _COMPARE, 'Lt': _COMPARE,
+    'LtE': _COMPARE, 'Gt': _COMPARE, 'GtE': _COMPARE, 'Is': _COMPARE,
+    'IsNot': _COMPARE, 'In': _COMPARE, 'NotIn': _COMPARE,
+    'BitOr': _BITOR,
+    'BitXor': _BITXOR,
+    'BitAnd': _BITAND,
+    'LShift': _SHIFT, 'RShift': _SHIFT,
+    'Add': _ARITH, 'Sub': _ARITH,
+    'Mult': _TERM, 'MatMult': _TERM, 'Div': _TERM, 'FloorDiv': _TERM,
+    'Mod': _TERM,
+    'UAdd': _UNARY, 'USub': _UNARY, 'Invert': _UNARY,
+    'Pow': _POWER,
+    'Await': _AWAIT,
+    }
+
+if sys.version_info[0] < 3:
+    _NUMBER_TYPES = (int, long, float)
+else:
+    _NUMBER_TYPES = (int, float)
+
+def _number(node):
+    """ The value of a numeric literal node, or None """
+    name = node.__class__.__name__
+    if name == 'Num':
+        value = node.n
+    elif name == 'Constant':
+        value = node.value
+    else:
+        return None
+    if isinstance(value, _NUMBER_TYPES) and not isinstance(value, bool):
+        return value
+
+def _is_int_literal(node):
+    value = _number(node)
+    return value is not None and not isinstance(value, float)
+
+def _precedence(node):
+    name = node.__class__.__name__
+    if name in ('BinOp', 'BoolOp', 'UnaryOp'):
+        name = node.op.__class__.__name__
+    elif name in ('Num', 'Constant'):
+        value = _number(node)
+        if value is not None and value < 0:
+            # a folded negative constant renders as '-1'
+            return _UNARY
+    return _PRECEDENCE.get(name, _ATOM)
+
+class _RenderFailure(object):
+    """ The exception raised while prerendering a node """
+    
+    def __init__(self, exc):
+        self.exc = exc
+
+class RenderCache(object):
+    """ Rendered statements kept between renders of the same tree
+        
+        Pass a RenderCache as the cache argument to SourceCodeRenderer.render
+        (or render_to/iter_render) to reuse the source of every statement
+        that has not changed since the last render. A cached statement is
+        re-rendered when its own fields have been reassigned (a child
+        replaced, a body list edited) or when invalidate() was called with
+        any node inside it; changes deeper inside a statement are only seen
+        through invalidate(). Only the statements on the path from a changed
+        node to the root are rendered again.
+        
+        Nodes are held weakly, so the entries of statements that have been
+        removed from the tree go away with them.
+    """
+    
+    def __init__(self):
+        # node -> (shallow key, lines)
+        self._entries = weakref.WeakKeyDictionary()
+        # node -> weak reference to its parent
+        self._parents = weakref.WeakKeyDictionary()
+        self._owner = None
+    
+    def bind(self, renderer_class, indentation):
+        """ Drop entries rendered by a different renderer or indentation """
+        owner = (renderer_class, indentation)
+        if owner != self._owner:
+            self.clear()
+            self._owner = owner
+    
+    def clear(self):
+        self._entries.clear()
+        self._parents.clear()
+    
+    def invalidate(self, node):
+        """ Forget the source of node and of every statement containing it
+            
+            node must be part of the tree as it was last rendered; when a
+            node is replaced, invalidate the old node or its parent.
+        """
+        while node is not None:
+            self._entries.pop(node, None)
+            parent = self._parents.get(node)
+            node = parent() if parent is not None else None
+    
+    def lookup(self, node):
+        entry = self._entries.get(node)
+        if entry is not None and entry[0] == shallow_key(node):
+            return entry[1]
+    
+    def store(self, node, lines):
+        self._entries[node] = (shallow_key(node), lines)
+    
+    def record_parents(self, node):
+        """ Remember the parent of every node in a statement's own subtree
+            
+            Nested statements are recorded when they are rendered themselves.
+        """
+        parents = self._parents
+        stack = [node]
+        while stack:
+            parent = stack.pop()
+            parent_ref = weakref.ref(parent)
+            for field in parent._fields:
+                value = getattr(parent, field, None)
+                if isinstance(value, ast.AST):
+                    children = [value]
+                elif isinstance(value, list):
+                    children = value
+                else:
+                    continue
+                for child in children:
+                    if isinstance(child, ast.AST):
+                        parents[child] = parent_ref
+                        if not isinstance(child, _SOURCE_NODE_TYPES):
+                            stack.append(child)
+
 class SourceCodeRenderer(ast.NodeVisitor):
     
+    # Render methods call each other recursively up to this depth; deeper
+    # subtrees are rendered from an explicit stack (see _prerender) so that
+    # arbitrarily deep trees never exhaust the interpreter's stack.
+    _max_depth = MAX_RECURSION_DEPTH
+    
     @classmethod
-    def render(cls, node, indentation=DEFAULT_INDENTATION):
-        renderer = cls(indentation)
-        if isinstance(node, ast.stmt) or \
-                isinstance(node, ast.excepthandler) or \
-                isinstance(node, ast.Module) or \
-                isinstance(node, ast.Expression) or \
-                isinstance(node, ast.Suite):
+    def render(cls, node, indentation=DEFAULT_INDENTATION, cache=None):
+        renderer = cls(indentation, cache=cache)
+        if _emits_source(node):
             renderer.visit(node)
             return ''.join(renderer._sourcelines)
         else:
             return renderer._render(node)
     
+    @classmethod
+    def render_to(cls, node, fp, indentation=DEFAULT_INDENTATION, cache=None):
+        """ Render a node, writing its source to a file-like object
+            
+            Lines are handed to fp.write as soon as they are emitted so the
+            rendered source is never held in memory as a whole.
+        """
+        renderer = cls(indentation, write=fp.write, cache=cache)
+        if _emits_source(node):
+            renderer.visit(node)
+        else:
+            fp.write(renderer._render(node))
+    
+    @classmethod
+    def iter_render(cls, node, indentation=DEFAULT_INDENTATION, cache=None):
+        """ Render a node lazily, yielding its source line by line
+            
+            A module is rendered one top-level statement at a time, so only
+            the lines of the statement being rendered are kept in memory.
+        """
+        renderer = cls(indentation, cache=cache)
+        if not _emits_source(node):
+            yield renderer._render(node)
+            return
+        sourcelines = renderer._sourcelines
+        if isinstance(node, ast.Module):
+            statements = [None] + renderer._module_statements(node)
+        else:
+            statements = [node]
+        for stmt in statements:
+            if stmt is not None:
+                renderer._render(stmt)
+            for sourceline in sourcelines:
+                yield sourceline
+            del sourcelines[:]
+    
+    @classmethod
+    def _dispatch_table(cls):
+        """ Return the node class -> render method table for this class
+            
+            Each renderer class gets its own table (looked up in the class's
+            own __dict__) so that subclasses overriding render methods never
+            share entries with their parents. Tables are filled lazily as new
+            node classes are seen.
+        """
+        table = cls.__dict__.get('_dispatch')
+        if table is None:
+            table = {}
+            cls._dispatch = table
+        return table
+    
+    def _resolve_render_method(self, node_class):
+        render_method = getattr(self.__class__,
+                                'render_%s' % node_class.__name__)
+        self._dispatch[node_class] = render_method
+        return render_method
+    
+    def _render_method(self, node_class):
+        try:
+            return self._dispatch[node_class]
+        except KeyError:
+            return self._resolve_render_method(node_class)
+    
     def _render(self, node):
-        render_method = getattr(self, 'render_%s' % node.__class__.__name__)
-        return render_method(node)
+        depth = self._depth
+        if depth >= self._max_depth and isinstance(node, ast.AST):
+            return self._replay(self._prerender(node))
+        try:
+            render_method = self._dispatch[node.__class__]
+        except KeyError:
+            render_method = self._resolve_render_method(node.__class__)
+        # No try/finally here: it is measurably slow on this hot path, and a
+        # depth left too high by an exception only makes _prerender take
+        # over sooner, which produces the same source.
+        self._depth = depth + 1
+        rendered = render_method(self, node)
+        self._depth = depth
+        return rendered
+    
+    def _render_with_state(self, node):
+        """ Render a node, taking prerendered results and cached statements
+            into account
+            
+            This stands in for _render only while there is a cache or
+            prerendered results to consult (see _use_state), so that
+            rendering without either pays nothing for them.
+        """
+        if self._prerendered:
+            rendered = self._prerendered.pop(id(node), None)
+            if rendered is not None:
+                return self._replay(rendered)
+        if self._cache is not None and self._depth < self._max_depth \
+                and isinstance(node, _SOURCE_NODE_TYPES):
+            return self._render_cached(node)
+        return self._render_plain(node)
+    
+    def _use_state(self):
+        """ Switch _render between the plain and the stateful path """
+        if self._cache is not None or self._prerendering:
+            self._render = self._render_with_state
+        else:
+            self._render = self._render_plain
+    
+    def _prerender(self, root):
+        """ Render a subtree bottom-up using an explicit stack
+            
+            Every node below root is rendered before its parent and its
+            result is kept until the parent's render method asks for it, so
+            that request is answered without recursing. Statements are
+            rendered at block level 0 and their lines are re-indented when
+            they are replayed into their parent. A node that fails to render
+            only raises once something actually needs its source.
+        """
+        prerendered = self._prerendered
+        nodes = list(walk(root))
+        
+        self._prerendering += 1
+        self._use_state()
+        try:
+            for node in reversed(nodes):
+                try:
+                    render_method = self._render_method(node.__class__)
+                except AttributeError as exc:
+                    prerendered[id(node)] = _RenderFailure(exc)
+                    continue
+                if isinstance(node, _SOURCE_NODE_TYPES):
+                    lines = []
+                    write, blocklevel = self._write, self._blocklevel
+                    self._write, self._blocklevel = lines.append, 0
+                else:
+                    lines = None
+                depth = self._depth
+                try:
+                    value = render_method(self, node)
+                except Exception as exc:
+                    self._depth = depth
+                    prerendered[id(node)] = _RenderFailure(exc)
+                else:
+                    prerendered[id(node)] = (value, lines)
+                finally:
+                    if lines is not None:
+                        self._write, self._blocklevel = write, blocklevel
+            return prerendered.pop(id(root))
+        finally:
+            self._prerendering -= 1
+            if not self._prerendering:
+                prerendered.clear()
+                self._use_state()
+    
+    def _render_cached(self, node):
+        """ Emit a statement's lines from the cache, rendering it on a miss """
+        cache = self._cache
+        lines = cache.lookup(node)
+        if lines is None:
+            render_method = self._render_method(node.__class__)
+            cache.record_parents(node)
+            lines = []
+            write, blocklevel = self._write, self._blocklevel
+            self._write, self._blocklevel = lines.append, 0
+            self._depth += 1
+            try:
+                render_method(self, node)
+            finally:
+                self._depth -= 1
+                self._write, self._blocklevel = write, blocklevel
+            cache.store(node, lines)
+        return self._replay((None, lines))
+    
+    def _replay(self, rendered):
+        """ Emit the lines of a prerendered node and return its value """
+        if isinstance(rendered, _RenderFailure):
+            raise rendered.exc
+        value, lines = rendered
+        if lines:
+            write = self._write
+            indent = self._indent
+            for line in lines:
+                if line == "\n":
+                    write(line)
+                else:
+                    write(indent + line)
+        return value
         
-    def __init__(self, indentation=DEFAULT_INDENTATION):
+    def __init__(self, indentation=DEFAULT_INDENTATION, write=None,
+                 cache=None):
+        self._dispatch = self._dispatch_table()
         self._sourcelines = []
+        if write is None:
+            write = self._sourcelines.append
+        self._write = write
         self._blocklevel = 0
         self._indentation = indentation
+        self._depth = 0
+        self._prerendering = 0
+        self._prerendered = {}
+        if cache is not None:
+            cache.bind(self.__class__, indentation)
+        self._cache = cache
+        # _render runs for every node, so it is bound once here rather than
+        # on every call, and swapped for _render_with_state when needed
+        self._render_plain = self._render
+        self._use_state()
     
     def emit(self, source):
+        write = self._write
+        indent = self._indent
         for sourceline in source.splitlines(False):
-            self._sourcelines.append("%s%s\n" % (self._indent,
-                                                 sourceline.lstrip()))
+            sourceline = sourceline.lstrip()
+            if sourceline:
+                write("%s%s\n" % (indent, sourceline))
+            else:
+                write("\n")
     
     def start_block(self):
         self._blocklevel += 1
@@ -70,6 +427,15 @@ class SourceCodeRenderer(ast.NodeVisitor):
     def visit(self, node):
         self._render(node)
     
+    def _render_operand(self, node, precedence):
+        """ Render an expression, parenthesized if it binds more loosely
+            than the given precedence requires
+        """
+        source = self._render(node)
+        if _precedence(node) < precedence:
+            return "(%s)" % source
+        return source
+    
     def _render_statements(self, statements):
         for stmt in statements:
             self._render(stmt)
@@ -106,7 +472,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
             arg_part = \
                 self._render(node.args[i]) + \
                 "=" + \
-                self._render(node.defaults[i-arg_count])
+                self._render_operand(node.defaults[i-arg_count], _LAMBDA)
             arg_parts.append(arg_part)
         if node.vararg:
             arg_parts.append("*%s" % node.vararg)
@@ -121,9 +487,9 @@ class SourceCodeRenderer(ast.NodeVisitor):
         return alias
     
     def render_Assert(self, node):
-        source = "assert " + self._render(node.test)
+        source = "assert " + self._render_operand(node.test, _LAMBDA)
         if node.msg:
-            source += ", " + self._render(node.msg)
+            source += ", " + self._render_operand(node.msg, _LAMBDA)
         self.emit(source)
     
     def render_Assign(self, node):
@@ -133,7 +499,11 @@ class SourceCodeRenderer(ast.NodeVisitor):
         self.emit(source)
     
     def render_Attribute(self, node):
-        return self._render(node.value) + '.' + node.attr
+        value = self._render_operand(node.value, _ATOM)
+        if _is_int_literal(node.value):
+            # '1.real' would be read as a float
+            value = "(%s)" % value
+        return value + '.' + node.attr
     
     def render_AugAssign(self, node):
         source = "%s %s= %s" % (self._render(node.target),
@@ -142,9 +512,16 @@ class SourceCodeRenderer(ast.NodeVisitor):
         self.emit(source)
     
     def render_BinOp(self, node):
-        return "(%s %s %s)" % (self._render(node.left),
-                               self._render(node.op),
-                               self._render(node.right))
+        precedence = _precedence(node)
+        if precedence == _POWER:
+            # right associative, and binds tighter than a unary operator on
+            # its left but not on its right: (-a) ** b, a ** -b
+            left = self._render_operand(node.left, _POWER + 1)
+            right = self._render_operand(node.right, _UNARY)
+        else:
+            left = self._render_operand(node.left, precedence)
+            right = self._render_operand(node.right, precedence + 1)
+        return "%s %s %s" % (left, self._render(node.op), right)
     
     def render_BitAnd(self, node):
         return "&"
@@ -163,17 +540,21 @@ class SourceCodeRenderer(ast.NodeVisitor):
 
     def render_BoolOp(self, node):
         op = self._render(node.op)
-        return "(" + (" " + op + " ").join([self._render(value)
-                                            for value in node.values]) + ")"
+        # a nested BoolOp of the same kind keeps its parentheses so that it
+        # isn't flattened into this one when parsed
+        precedence = _precedence(node) + 1
+        return (" " + op + " ").join([self._render_operand(value, precedence)
+                                      for value in node.values])
     
     def render_Bytes(self, node):
         return "b'%s'" % str(node.s)
         
     def render_Call(self, node):
-        name = self._render(node.func)
+        name = self._render_operand(node.func, _ATOM)
         acc = "%s(" % (name)
         if node.args:
-            acc += self._render(node.args)
+            acc += ", ".join([self._render_operand(arg, _LAMBDA)
+                              for arg in node.args])
         if node.keywords:
             if acc[-1] != "(":
                 acc += ", "
@@ -181,11 +562,11 @@ class SourceCodeRenderer(ast.NodeVisitor):
         if hasattr(node, 'starargs') and node.starargs:
             if acc[-1] != "(":
                 acc += ", "
-            acc += "*" + self._render(node.starargs)
+            acc += "*" + self._render_operand(node.starargs, _BITOR)
         if hasattr(node, 'kwargs') and node.kwargs:
             if acc[-1] != "(":
                 acc += ", "
-            acc += "**" + self._render(node.kwargs)
+            acc += "**" + self._render_operand(node.kwargs, _BITOR)
         return acc + ")"
     
     def render_ClassDef(self, node):
@@ -207,17 +588,19 @@ class SourceCodeRenderer(ast.NodeVisitor):
     def render_Compare(self, node):
         ops_and_comparators = zip(node.ops, node.comparators)
         rendered_ops_and_comparators = \
-            " ".join(["%s %s" % (self._render(op), self._render(comparator))
+            " ".join(["%s %s" % (self._render(op),
+                                 self._render_operand(comparator,
+                                                      _COMPARE + 1))
                       for op, comparator in ops_and_comparators])
         
-        return "(%s %s)" % (self._render(node.left),
-                            rendered_ops_and_comparators)
+        return "%s %s" % (self._render_operand(node.left, _COMPARE + 1),
+                          rendered_ops_and_comparators)
     
     def render_comprehension(self, node):
         source = "  for %s in %s" % (self._render(node.target),
-                                self._render(node.iter))
+                                self._render_operand(node.iter, _OR))
         for if_ in node.ifs:
-            source += "\n" + "  if " + self._render(if_)
+            source += "\n" + "  if " + self._render_operand(if_, _OR)
         return source
     
     def render_Continue(self, node):
@@ -225,8 +608,8 @@ class SourceCodeRenderer(ast.NodeVisitor):
 
     def render_Dict(self, node):
         acc = "{"
-        acc +=  ", ".join(["%s: %s" % (self._render(key),
-                                         self._render(value))
+        acc +=  ", ".join(["%s: %s" % (self._render_operand(key, _IFEXP),
+                                         self._render_operand(value, _LAMBDA))
                            for key, value in zip(node.keys, node.values)])
         return acc + "}"
     
@@ -237,8 +620,8 @@ class SourceCodeRenderer(ast.NodeVisitor):
         self.emit("del " + self._render(node.targets))
     
     def render_DictComp(self, node):
-        acc = "{%s: %s\n" % (self._render(node.key),
-                           self._render(node.value))
+        acc = "{%s: %s\n" % (self._render_operand(node.key, _IFEXP),
+                           self._render_operand(node.value, _LAMBDA))
         acc += "\n".join([self._render(generator)
                           for generator in node.generators])
         return acc
@@ -303,7 +686,8 @@ class SourceCodeRenderer(ast.NodeVisitor):
     
     def render_For(self, node):
         source = ("for %s in %s:\n" % (self._render(node.target),
-                                       self._render(node.iter)))
+                                       self._render_operand(node.iter,
+                                                            _LAMBDA)))
         self.emit(source)
         self.start_block()
         self._render_statements(node.body)
@@ -337,7 +721,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
         self.end_block()
     
     def render_GeneratorExp(self, node):
-        source = "( " + self._render(node.elt) + "\n"
+        source = "( " + self._render_operand(node.elt, _LAMBDA) + "\n"
         source += "\n".join(self._render(generator)
                             for generator in node.generators)
         return source + " )"
@@ -352,7 +736,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
         return ">="
     
     def render_If(self, node):
-        source = "if %s:\n" % self._render(node.test)
+        source = "if %s:\n" % self._render_operand(node.test, _LAMBDA)
         self.emit(source)
         self.start_block()
         self._render_statements(node.body)
@@ -364,11 +748,11 @@ class SourceCodeRenderer(ast.NodeVisitor):
             self.end_block()
         
     def render_IfExp(self, node):
-        source = "( %s if %s" % (self._render(node.body),
-                            self._render(node.test))
+        source = "%s if %s" % (self._render_operand(node.body, _OR),
+                               self._render_operand(node.test, _OR))
         if node.orelse:
-            source += " else " + self._render(node.orelse)
-        return source + " )"
+            source += " else " + self._render_operand(node.orelse, _LAMBDA)
+        return source
     
     def render_Import(self, node):
         self.emit("import %s" % self._render(node.names))
@@ -389,7 +773,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
         return "~"
     
     def render_Index(self, node):
-        return self._render(node.value)
+        return self._render_operand(node.value, _LAMBDA)
     
     def render_Interactive(self, node):
         self.emit(node.body())
@@ -401,22 +785,23 @@ class SourceCodeRenderer(ast.NodeVisitor):
         return "is not"
     
     def render_keyword(self, node):
-        return "%s=%s" % (node.arg, self._render(node.value))
+        return "%s=%s" % (node.arg, self._render_operand(node.value, _LAMBDA))
     
     def render_Lambda(self, node):
         source = "lambda"
         if node.args:
             source += " " + self._render(node.args)
-        return source + ": %s" % self._render(node.body)
+        return source + ": %s" % self._render_operand(node.body, _LAMBDA)
     
     def render_list(self, elts, separator=", "):
         return separator.join([self._render(elt) for elt in elts])
     
     def render_List(self, node):
-        return "[%s]" % ", ".join([self._render(elt) for elt in node.elts])
+        return "[%s]" % ", ".join([self._render_operand(elt, _LAMBDA)
+                                   for elt in node.elts])
     
     def render_ListComp(self, node):
-        source = "[ " + self._render(node.elt) + "\n"
+        source = "[ " + self._render_operand(node.elt, _LAMBDA) + "\n"
         source += "\n".join([self._render(generator)
                              for generator in node.generators])
         return source + " ]"
@@ -433,11 +818,14 @@ class SourceCodeRenderer(ast.NodeVisitor):
     def render_Mod(self, node):
         return '%'
     
-    def render_Module(self, node):
+    def _module_statements(self, node):
+        """ Render the module's docstring and return the remaining body """
         if self._maybe_render_docstring(node):
-            self._render_statements(node.body[1:])
-        else:
-            self._render_statements(node.body)
+            return node.body[1:]
+        return node.body
+    
+    def render_Module(self, node):
+        self._render_statements(self._module_statements(node))
     
     def render_Mult(self, node):
         return "*"
@@ -495,7 +883,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
     def render_Return(self, node):
         source = "return"
         if node.value:
-            source += " " + self._render(node.value)
+            source += " " + self._render_operand(node.value, _LAMBDA)
         source += "\n"
         self.emit(source)
     
@@ -503,11 +891,12 @@ class SourceCodeRenderer(ast.NodeVisitor):
         return ">>"
     
     def render_Set(self, node):
-        acc = "{%s}" % ", ".join(self._render(elt) for elt in node.elts)
+        acc = "{%s}" % ", ".join(self._render_operand(elt, _LAMBDA)
+                                 for elt in node.elts)
         return acc
     
     def render_SetComp(self, node):
-        source = "{ " + self._render(node.elt) + "\n"
+        source = "{ " + self._render_operand(node.elt, _LAMBDA) + "\n"
         source += "\n".join([self._render(generator)
                              for generator in node.generators])
         return source + " }"
@@ -516,7 +905,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
         parts = [getattr(node, part) for part in ['lower', 'upper', 'step']
                  if hasattr(node, part)]
         if parts:
-            lower_str, upper_str, step_str = [self._render(part) if part else '' for part in parts]
+            lower_str, upper_str, step_str = [self._render_operand(part, _IFEXP) if part else '' for part in parts]
         else:
             lower_str, upper_str, step_str = ["", "", ""]
         slice_str = "%s:%s" % (lower_str, upper_str)
@@ -525,7 +914,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
         return slice_str
     
     def render_Starred(self, node):
-        return "*%s" % self._render(node.value)
+        return "*%s" % self._render_operand(node.value, _BITOR)
     
     def render_Str(self, node):
         return repr(node.s)
@@ -537,7 +926,8 @@ class SourceCodeRenderer(ast.NodeVisitor):
         return "-"
     
     def render_Subscript(self, node):
-        return "%s[%s]" % (self._render(node.value), self._render(node.slice))
+        return "%s[%s]" % (self._render_operand(node.value, _ATOM),
+                           self._render_operand(node.slice, _LAMBDA))
     
     def render_Suite(self, node):
         self._render(node.body)
@@ -584,20 +974,26 @@ class SourceCodeRenderer(ast.NodeVisitor):
         self.end_block()
     
     def render_Tuple(self, node):
-        return "(%s)" % \
-            ("".join([(self._render(elt) + ", ") for elt in node.elts]))
+        elts = [self._render_operand(elt, _LAMBDA) for elt in node.elts]
+        if len(elts) == 1:
+            return "(%s,)" % elts[0]
+        return "(%s)" % ", ".join(elts)
     
     def render_UAdd(self, node):
         return "+"
     
     def render_UnaryOp(self, node):
-        return self._render(node.op) + " " + self._render(node.operand)
+        precedence = _precedence(node)
+        operand = self._render_operand(node.operand, precedence)
+        if precedence == _NOT:
+            return "not " + operand
+        return self._render(node.op) + operand
     
     def render_USub(self, node):
         return "-"
     
     def render_While(self, node):
-        self.emit("while %s:\n" % (self._render(node.test)))
+        self.emit("while %s:\n" % (self._render_operand(node.test, _LAMBDA)))
         self.start_block()
         self._render_statements(node.body)
         self.end_block()
@@ -609,7 +1005,8 @@ class SourceCodeRenderer(ast.NodeVisitor):
     
     if sys.version_info[:2] < (3, 0):
         def render_With(self, node):
-            source = "with %s" % (self._render(node.context_expr))
+            source = "with %s" % (self._render_operand(node.context_expr,
+                                                       _LAMBDA))
             if node.optional_vars:
                 source += ' as ' + self._render(node.optional_vars)
             source += ":\n"
@@ -628,7 +1025,7 @@ class SourceCodeRenderer(ast.NodeVisitor):
             self.end_block()
         
         def render_withitem(self, node):
-            source = "%s" % (self._render(node.context_expr))
+            source = "%s" % (self._render_operand(node.context_expr, _LAMBDA))
             if node.optional_vars:
                 source += ' as ' + self._render(node.optional_vars)
             return source
@@ -636,14 +1033,14 @@ class SourceCodeRenderer(ast.NodeVisitor):
     def render_Yield(self, node):
         source = "yield"
         if node.value:
-            source += " " + self._render(node.value)
+            source += " " + self._render_operand(node.value, _LAMBDA)
         if isinstance(node, ast.stmt):
             self.emit(source)
         else:
             return source
     
     def render_YieldFrom(self, node):
-        source = "yield from %s" % self._render(node.value)
+        source = "yield from %s" % self._render_operand(node.value, _LAMBDA)
         return source
     
     def render_invisible_node(self, node):
@@ -654,3 +1051,213 @@ class SourceCodeRenderer(ast.NodeVisitor):
     render_AugLoad = render_invisible_node
     render_AugStore = render_invisible_node
     render_Param = render_invisible_node
+
+
+# Statement end positions (and so splicing) arrived in Python 3.8
+_HAS_END_POSITIONS = sys.version_info[:2] >= (3, 8)
+
+def _is_filler(line):
+    """ Is this source line blank or only a comment? """
+    stripped = line.strip()
+    return not stripped or stripped.startswith('#')
+
+class SpliceRenderer(SourceCodeRenderer):
+    """ A renderer that copies unchanged statements from the original source
+        
+        Given the source a tree was parsed from, every statement that still
+        sits at its original position and is structurally identical to the
+        statement parsed there is copied from that source instead of being
+        rendered, together with its comments and formatting. Blank and
+        comment lines between copied statements are kept too, so rendering a
+        lightly transformed module produces a minimal diff against the
+        original. Only changed statements go through the normal renderer.
+        
+        Splicing relies on end positions, which are only recorded by Python
+        3.8 and later; elsewhere everything is rendered.
+    """
+    
+    @classmethod
+    def render(cls, node, source, indentation=DEFAULT_INDENTATION):
+        renderer = cls(source, indentation)
+        if _emits_source(node):
+            renderer.visit(node)
+            return ''.join(renderer._sourcelines)
+        else:
+            return renderer._render(node)
+    
+    @classmethod
+    def render_to(cls, node, fp, source, indentation=DEFAULT_INDENTATION):
+        renderer = cls(source, indentation, write=fp.write)
+        if _emits_source(node):
+            renderer.visit(node)
+        else:
+            fp.write(renderer._render(node))
+    
+    def __init__(self, source, indentation=DEFAULT_INDENTATION, write=None,
+                 cache=None):
+        super(SpliceRenderer, self).__init__(indentation, write, cache)
+        self._lines = source.split('\n')
+        self._originals = {}
+        if _HAS_END_POSITIONS:
+            self._index_statements(ast.parse(source))
+        # The last source line the output has caught up with, if known;
+        # filler lines after it are copied along with the next statement
+        self._last_line = None
+    
+    def _index_statements(self, tree):
+        """ Index the original statements by position
+            
+            Only statement lists are followed; expressions never contain
+            statements.
+        """
+        originals = self._originals
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            for field in node._fields:
+                value = getattr(node, field, None)
+                if not isinstance(value, list):
+                    continue
+                for item in value:
+                    if isinstance(item, ast.stmt):
+                        originals[self._position(item)] = item
+                        stack.append(item)
+                    elif isinstance(item, ast.AST) \
+                            and not isinstance(item, ast.expr):
+                        # exception handlers, match cases
+                        stack.append(item)
+    
+    def _position(self, node):
+        return (node.__class__, node.lineno, node.col_offset,
+                getattr(node, 'end_lineno', None),
+                getattr(node, 'end_col_offset', None))
+    
+    def _column(self, line, col_offset):
+        """ Convert a UTF-8 byte offset into a character offset """
+        if line.isascii():
+            return col_offset
+        return len(line.encode('utf-8')[:col_offset].decode('utf-8'))
+    
+    def _first_line(self, stmt):
+        decorators = getattr(stmt, 'decorator_list', None)
+        if decorators:
+            return decorators[0].lineno
+        return stmt.lineno
+    
+    def _copy_lines(self, start, end, column=0):
+        """ Copy source lines [start, end) if they are blank or comments
+            
+            Comments indented at least as far as column, the original
+            indentation of the block they are in, are moved to the block's
+            current indentation.
+        """
+        lines = self._lines[start:end]
+        if all([_is_filler(line) for line in lines]):
+            write = self._write
+            indent = self._indent
+            for line in lines:
+                line = line.rstrip()
+                if not line:
+                    write("\n")
+                elif line[:column].strip():
+                    write(line + "\n")
+                else:
+                    write(indent + line[column:] + "\n")
+    
+    def _splice(self, stmt):
+        """ Copy an unchanged statement from the source
+            
+            Returns True if the statement was copied.
+        """
+        if getattr(stmt, 'end_lineno', None) is None:
+            return False
+        original = self._originals.get(self._position(stmt))
+        if original is None or not nodes_equal(stmt, original):
+            return False
+        
+        lines = self._lines
+        first, last = self._first_line(stmt), stmt.end_lineno
+        head = lines[first - 1]
+        start = self._column(head, stmt.col_offset)
+        tail = lines[last - 1]
+        end = self._column(tail, stmt.end_col_offset)
+        trailer = tail[end:].strip()
+        if trailer.startswith('#'):
+            end = len(tail.rstrip())
+        indent = self._indent
+        
+        if first == last:
+            segment = [indent + head[start:end]]
+        elif head[:start] != indent:
+            # Re-indenting could change multi-line strings; render instead
+            return False
+        else:
+            segment = [head.rstrip('\r')]
+            segment.extend([line.rstrip('\r') for line in lines[first:last - 1]])
+            segment.append(tail[:end])
+        
+        if self._last_line is not None and first > self._last_line:
+            self._copy_lines(self._last_line, first - 1, start)
+        write = self._write
+        for line in segment:
+            write(line + "\n")
+        self._last_line = last
+        return True
+    
+    def _start_block(self, stmt):
+        """ Catch up with the source just before the first statement of a
+            block
+            
+            If the statement is still at its original position, the blank
+            lines and comments in front of it follow the last line before
+            them that isn't filler, which is the end of the block's header,
+            so they are kept whether the header was copied or rendered.
+        """
+        if getattr(stmt, 'end_lineno', None) is None \
+                or self._position(stmt) not in self._originals:
+            return
+        line = self._first_line(stmt) - 1
+        while line > 0 and _is_filler(self._lines[line - 1]):
+            line -= 1
+        self._last_line = line
+    
+    def _render_statements(self, statements):
+        if statements:
+            self._start_block(statements[0])
+        for stmt in statements:
+            if self._splice(stmt):
+                continue
+            last_line = self._last_line
+            if last_line is not None \
+                    and getattr(stmt, 'end_lineno', None) is not None \
+                    and self._first_line(stmt) > last_line:
+                # A changed statement still in its original place: keep the
+                # blank lines and comments in front of it and behind it
+                head = self._lines[self._first_line(stmt) - 1]
+                self._copy_lines(last_line, self._first_line(stmt) - 1,
+                                 self._column(head, stmt.col_offset))
+                self._last_line = None
+                self._render(stmt)
+                self._last_line = stmt.end_lineno
+            else:
+                self._last_line = None
+                self._render(stmt)
+                self._last_line = last_line
+    
+    def _maybe_render_docstring(self, node):
+        if not ast.get_docstring(node):
+            return False
+        self._start_block(node.body[0])
+        if self._splice(node.body[0]):
+            return True
+        self._last_line = None
+        return super(SpliceRenderer, self)._maybe_render_docstring(node)
+    
+    def render_Module(self, node):
+        self._last_line = 0
+        self._render_statements(node.body)
+        if self._last_line is not None:
+            lines = self._lines
+            if lines and not lines[-1]:
+                lines = lines[:-1]
+            self._copy_lines(self._last_line, len(lines))
@@ -0,0 +1,393 @@
+""" selector.py
+
+Find nodes in a tree with CSS-like selectors.
+
+    >>> from astkit.selector import select
+    >>> for call in select('FunctionDef > body Call[func.id=open]', tree):
+    ...     print(call.lineno)
+
+A selector is a chain of steps. A step is either a node type, optionally
+followed by attribute conditions, or the name of a field:
+
+    Call                    every Call
+    expr                    every expression, whatever its class
+    *                       every node
+    Call[func.id=open]      calls of a name 'open'
+    Call[func.attr^=get]    calls of an attribute whose name starts with 'get'
+    FunctionDef[returns]    functions with a return annotation
+    FunctionDef body Call   calls in the body of a function (at any depth)
+    FunctionDef > body      the statements directly in a function's body
+    ClassDef > FunctionDef  methods
+    Call, Attribute         calls and attributes
+
+Steps are separated by a space, meaning the next step may match at any depth
+below the previous one, or by '>', meaning directly below it. A lowercase
+name is a field if any node type has a field of that name (so slice and
+pattern are fields), and a node type (such as expr, stmt or arg) otherwise.
+Condition values may be quoted; unquoted integers, None, True and False are
+converted. Besides '=', conditions can use '!=', '^=' (starts with), '$='
+(ends with) and '*=' (contains), and a condition with just a dotted
+attribute holds if the attribute is set to something other than None or an
+empty list.
+
+Selectors are compiled into a table of steps once, and matched while walking
+the tree a single time. Results are produced lazily in document order. Use
+compile_selector to keep a compiled selector for reuse on many trees.
+"""
+import re
+
+from astkit import ast
+from astkit.util import ast_class_tree
+
+def _all_field_names():
+    names = set()
+    for name in dir(ast):
+        cls = getattr(ast, name)
+        if isinstance(cls, type) and issubclass(cls, ast.AST):
+            names.update(cls._fields)
+    return frozenset(names)
+
+# the arg fields of keyword and arg hold names rather than nodes, so 'arg' is
+# left to mean ast.arg
+_FIELD_NAMES = _all_field_names() - frozenset(['arg'])
+
+_TOKENS = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<child>>)
+  | (?P<comma>,)
+  | (?P<name>\*|[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<condition>\[(?:[^\]"']|"[^"]*"|'[^']*')*\])
+""", re.VERBOSE)
+
+_CONDITION = re.compile(r"""
+    ^\[\s*(?P<path>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)\s*
+    (?:(?P<op>!=|\^=|\$=|\*=|=)\s*(?P<value>"[^"]*"|'[^']*'|[^\s\]]+)\s*)?\]$
+""", re.VERBOSE)
+
+_CONSTANTS = {'None': None, 'True': True, 'False': False}
+
+_MISSING = object()
+
+def _resolve(node, path):
+    value = node
+    for name in path:
+        value = getattr(value, name, _MISSING)
+        if value is _MISSING:
+            break
+    return value
+
+def _parse_value(text):
+    if text[0] in '"\'':
+        return text[1:-1]
+    if text in _CONSTANTS:
+        return _CONSTANTS[text]
+    if re.match(r'^-?\d+$', text):
+        return int(text)
+    return text
+
+class _Condition(object):
+
+    def __init__(self, text):
+        match = _CONDITION.match(text)
+        if match is None:
+            raise ValueError("invalid condition %s" % (text,))
+        self.path = tuple(match.group('path').split('.'))
+        self.op = match.group('op')
+        if self.op is not None:
+            self.value = _parse_value(match.group('value'))
+
+    def __call__(self, node):
+        actual = _resolve(node, self.path)
+        op = self.op
+        if op is None:
+            return actual is not _MISSING and actual is not None and \
+                actual != []
+        if op == '=':
+            return actual == self.value
+        if op == '!=':
+            return actual != self.value
+        if not isinstance(actual, str):
+            return False
+        expected = str(self.value)
+        if op == '^=':
+            return actual.startswith(expected)
+        if op == '$=':
+            return actual.endswith(expected)
+        return expected in actual
+
+class _Step(object):
+    """ One step of a compiled selector
+
+        A step tests either a node (classes is None for any node) or a field.
+        child is True if the step must match directly below the previous one.
+        following is the index of the next step, or None for the last.
+    """
+
+    def __init__(self, name, conditions, child):
+        self.child = child
+        self.following = None
+        self.conditions = conditions
+        self.field = None
+        self.classes = None
+        if name == '*':
+            return
+        cls = getattr(ast, name, None)
+        is_class = isinstance(cls, type) and issubclass(cls, ast.AST)
+        if (name in _FIELD_NAMES and name[0].islower()) or not is_class:
+            if name not in _FIELD_NAMES:
+                raise ValueError("%s is neither a node type nor a field"
+                                 % (name,))
+            if conditions:
+                raise ValueError("field %s can't have conditions" % (name,))
+            self.field = name
+            return
+        classes = set([cls])
+        class_tree = ast_class_tree()
+        if class_tree.contains(cls):
+            classes.update(class_tree.descendants(cls))
+        self.classes = frozenset(classes)
+
+    def accepts(self, cls):
+        return self.field is None and (self.classes is None or
+                                       cls in self.classes)
+
+def _tokenize(text):
+    position = 0
+    while position < len(text):
+        match = _TOKENS.match(text, position)
+        if match is None:
+            raise ValueError("invalid selector %r at position %d"
+                             % (text, position))
+        position = match.end()
+        yield match.lastgroup, match.group()
+
+def _parse(text):
+    """ Parse a selector into a list of chains of _Steps """
+    chains = [[]]
+    combinator = None
+    name = None
+    conditions = []
+
+    def finish_step():
+        chain = chains[-1]
+        if combinator is None and chain:
+            raise ValueError("missing combinator in %r" % (text,))
+        chain.append(_Step(name or '*', list(conditions),
+                           combinator == 'child'))
+
+    for kind, token in _tokenize(text.strip()):
+        if kind == 'name':
+            if name is not None:
+                raise ValueError("unexpected %r in %r" % (token, text))
+            name = token
+        elif kind == 'condition':
+            if name is None:
+                name = '*'
+            conditions.append(_Condition(token))
+        else:
+            if name is not None:
+                finish_step()
+                name = None
+                conditions = []
+                combinator = 'descendant'
+            if kind == 'child':
+                if not chains[-1] or combinator == 'child':
+                    raise ValueError("misplaced '>' in %r" % (text,))
+                combinator = 'child'
+            elif kind == 'comma':
+                if not chains[-1] or combinator == 'child':
+                    raise ValueError("misplaced ',' in %r" % (text,))
+                chains.append([])
+                combinator = None
+    if name is not None:
+        finish_step()
+    elif combinator == 'child' or not chains[-1]:
+        raise ValueError("incomplete selector %r" % (text,))
+    for chain in chains:
+        chain[0].child = False
+        if chain[-1].field is not None:
+            # a selector ending in a field selects the nodes in that field
+            chain.append(_Step('*', [], True))
+    return chains
+
+class _State(object):
+    """ The steps that may match a node: those that may match anywhere below
+        an earlier match (descendant) and those that must match directly
+        below one (child)
+
+        What happens to a node in a given state depends only on the state and
+        the node's class, and the state of the nodes in a field depends only
+        on the state after their parent and the field, so both are memoized
+        here.
+    """
+
+    __slots__ = ('descendant', 'child', 'plans', 'fields')
+
+    def __init__(self, descendant, child):
+        self.descendant = descendant
+        self.child = child
+        # node class -> (matched, state after the node), or (None, steps
+        # with conditions, matched without conditions)
+        self.plans = {}
+        # field name -> state of the nodes in that field
+        self.fields = {}
+
+class Selector(object):
+    """ A compiled selector
+
+        Matching walks the tree once, carrying a _State for each node. Only
+        steps with conditions need to be evaluated for each node; everything
+        else is decided by looking up the node's class in the state.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._steps = []
+        starts = []
+        for chain in _parse(text):
+            starts.append(len(self._steps))
+            for step in chain:
+                if self._steps and len(self._steps) > starts[-1]:
+                    self._steps[-1].following = len(self._steps)
+                self._steps.append(step)
+        self._states = {}
+        self._after = {}
+        self._start = self._state(frozenset(starts), frozenset())
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.text)
+
+    def _state(self, descendant, child):
+        key = (descendant, child)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _State(descendant, child)
+        return state
+
+    def _plan(self, state, cls):
+        steps = self._steps
+        candidates = [index for index in state.descendant | state.child
+                      if steps[index].accepts(cls)]
+        conditional = tuple(index for index in candidates
+                            if steps[index].conditions)
+        unconditional = frozenset(index for index in candidates
+                                  if not steps[index].conditions)
+        if conditional:
+            plan = (None, conditional, unconditional)
+        else:
+            plan = self._after_node(state, unconditional)
+        state.plans[cls] = plan
+        return plan
+
+    def _after_node(self, state, matched_steps):
+        """ Get whether a node matched and the state after it """
+        key = (state, matched_steps)
+        after = self._after.get(key)
+        if after is None:
+            steps = self._steps
+            matched = False
+            # steps waiting to match anywhere below stay active, while those
+            # that had to match this node directly are used up
+            descendant = set(state.descendant)
+            child = set()
+            for index in matched_steps:
+                following = steps[index].following
+                if following is None:
+                    matched = True
+                elif steps[following].child:
+                    child.add(following)
+                else:
+                    descendant.add(following)
+            after = self._after[key] = (matched,
+                                        self._state(frozenset(descendant),
+                                                    frozenset(child)))
+        return after
+
+    def _enter_field(self, state, field):
+        """ Get the state of the nodes in one of a node's fields
+
+            Field steps are matched here. Node steps that must match directly
+            below the node pass through to the nodes in the field.
+        """
+        steps = self._steps
+        descendant = set(state.descendant)
+        child = set(index for index in state.child
+                    if steps[index].field is None)
+        for index in state.descendant | state.child:
+            step = steps[index]
+            if step.field == field:
+                following = step.following
+                if steps[following].child:
+                    child.add(following)
+                else:
+                    descendant.add(following)
+        field_state = state.fields[field] = self._state(frozenset(descendant),
+                                                        frozenset(child))
+        return field_state
+
+    def select(self, tree):
+        """ Generate the nodes in a tree that match, in document order """
+        steps = self._steps
+        AST = ast.AST
+        stack = [(tree, self._start)]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node, state = pop()
+            cls = node.__class__
+            plan = state.plans.get(cls)
+            if plan is None:
+                plan = self._plan(state, cls)
+            matched, after = plan[:2]
+            if matched is None:
+                matched_steps = set(plan[2])
+                for index in after:
+                    for condition in steps[index].conditions:
+                        if not condition(node):
+                            break
+                    else:
+                        matched_steps.add(index)
+                matched, after = self._after_node(state,
+                                                  frozenset(matched_steps))
+            if matched:
+                yield node
+            fields = after.fields
+            # push in reverse so that nodes come off the stack in order
+            for field in reversed(cls._fields):
+                value = getattr(node, field, None)
+                if isinstance(value, list):
+                    if not value:
+                        continue
+                    field_state = fields.get(field)
+                    if field_state is None:
+                        field_state = self._enter_field(after, field)
+                    for item in reversed(value):
+                        if isinstance(item, AST):
+                            push((item, field_state))
+                elif isinstance(value, AST):
+                    field_state = fields.get(field)
+                    if field_state is None:
+                        field_state = self._enter_field(after, field)
+                    push((value, field_state))
+
+    def first(self, tree):
+        """ Get the first node in a tree that matches, or None """
+        for node in self.select(tree):
+            return node
+        return None
+
+_compiled = {}
+_MAX_COMPILED = 256
+
+def compile_selector(text):
+    """ Compile a selector, reusing an earlier compilation of the same text """
+    selector = _compiled.get(text)
+    if selector is None:
+        if len(_compiled) >= _MAX_COMPILED:
+            _compiled.clear()
+        selector = _compiled[text] = Selector(text)
+    return selector
+
+def select(text, tree):
+    """ Generate the nodes in a tree that match a selector """
+    return compile_selector(text).select(tree)
@@ -0,0 +1,219 @@
+""" stats.py
+
+Collect timings for the imports handled by the processor import hook.
+
+For each module, ImportStats records the wall time spent in each phase:
+finding it, reading and parsing its source, each processor (or fused
+pipeline), compiling, loading from the code cache and executing it. Executing
+a module usually imports others, so a module's execution time is split, as
+with python -X importtime, into its own share and the time spent importing
+other modules while it ran. That second part is reported as the difference
+between the module's cumulative time and its self time.
+
+ProcessorProfile adds up the cost of each installed processor over all the
+modules processed in a run.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from timeit import default_timer
+
+class ImportStats(object):
+    """ Per-module, per-phase import timings """
+
+    def __init__(self):
+        self._phases = OrderedDict()
+        self._nested = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.misses = 0
+        self.miss_time = 0.0
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def record(self, fullname, phase, seconds):
+        """ Add time spent on a phase of importing a module """
+        with self._lock:
+            phases = self._phases.get(fullname)
+            if phases is None:
+                phases = self._phases[fullname] = OrderedDict()
+            phases[phase] = phases.get(phase, 0.0) + seconds
+        self._charge_importer(fullname, seconds)
+
+    def record_miss(self, seconds):
+        """ Add time spent looking for a module the hook didn't find """
+        with self._lock:
+            self.misses += 1
+            self.miss_time += seconds
+        self._charge_importer(None, seconds)
+
+    def _charge_importer(self, fullname, seconds):
+        # time spent while another module is executing belongs to that
+        # module's imports rather than to its own execution
+        stack = self._stack()
+        if stack and stack[-1][0] != fullname:
+            stack[-1][1] += seconds
+
+    def begin_exec(self, fullname):
+        self._stack().append([fullname, 0.0])
+
+    def end_exec(self, fullname, seconds):
+        """ Record a module's execution, which took seconds including the
+            modules it imported
+        """
+        nested = self._stack().pop()[1]
+        with self._lock:
+            self._nested[fullname] = self._nested.get(fullname, 0.0) + nested
+        stack = self._stack()
+        if stack:
+            # the importer's execution covers everything this module imported
+            stack[-1][1] += nested
+        self.record(fullname, 'exec', seconds - nested)
+
+    def modules(self):
+        """ Get the names of the modules with timings, in import order """
+        with self._lock:
+            return list(self._phases)
+
+    def phases(self, fullname):
+        """ Get a module's time per phase """
+        with self._lock:
+            return OrderedDict(self._phases.get(fullname, ()))
+
+    def self_time(self, fullname):
+        return sum(self.phases(fullname).values())
+
+    def cumulative_time(self, fullname):
+        """ Get a module's time including the modules it imported """
+        with self._lock:
+            nested = self._nested.get(fullname, 0.0)
+        return self.self_time(fullname) + nested
+
+    def totals(self):
+        """ Get the time per phase summed over all modules """
+        totals = OrderedDict()
+        with self._lock:
+            for phases in self._phases.values():
+                for phase, seconds in phases.items():
+                    totals[phase] = totals.get(phase, 0.0) + seconds
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self._phases.clear()
+            self._nested.clear()
+            self.misses = 0
+            self.miss_time = 0.0
+
+    def report(self, sort='cumulative', limit=None):
+        """ Format the timings as a table, slowest modules first
+
+            sort is 'cumulative' or 'self'.
+        """
+        if sort not in ('cumulative', 'self'):
+            raise ValueError("sort must be 'cumulative' or 'self', not %r"
+                             % (sort,))
+        key = self.cumulative_time if sort == 'cumulative' else self.self_time
+        modules = sorted(self.modules(), key=key, reverse=True)
+        if limit is not None:
+            modules = modules[:limit]
+        lines = ["%10s %10s  %s" % ('self [ms]', 'cumul [ms]', 'module')]
+        for fullname in modules:
+            breakdown = ', '.join("%s %.2f" % (phase, seconds * 1000)
+                                  for phase, seconds
+                                  in self.phases(fullname).items())
+            lines.append("%10.2f %10.2f  %s (%s)"
+                         % (self.self_time(fullname) * 1000,
+                            self.cumulative_time(fullname) * 1000,
+                            fullname, breakdown))
+        lines.append("total: %s" % ', '.join("%s %.2f ms" % (phase,
+                                                            seconds * 1000)
+                                            for phase, seconds
+                                            in self.totals().items()))
+        lines.append("lookups not found: %d (%.2f ms)"
+                     % (self.misses, self.miss_time * 1000))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, stream=None, sort='cumulative', limit=None):
+        if stream is None:
+            stream = sys.stderr
+        stream.write(self.report(sort, limit))
+
+def timed(stats, fullname, phase, func, *args):
+    """ Call func(*args), recording the time it takes if stats isn't None """
+    if stats is None:
+        return func(*args)
+    start = default_timer()
+    try:
+        return func(*args)
+    finally:
+        stats.record(fullname, phase, default_timer() - start)
+
+class ProcessorProfile(object):
+    """ The cost of each processor aggregated over every module processed
+
+        For each processor, this records how many times it has been run, the
+        time spent in it, the nodes it visited and the nodes it changed. A
+        pipeline processor visits the nodes its handlers are called with and
+        changes those it modifies, replaces or removes. Other processors are
+        treated as visiting every node in the tree they are given and
+        changing every node that is new or modified when they are done.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, processor, seconds, visited, changed):
+        with self._lock:
+            entry = self._entries.get(id(processor))
+            if entry is None:
+                entry = self._entries[id(processor)] = [processor, 0, 0.0,
+                                                        0, 0]
+            entry[1] += 1
+            entry[2] += seconds
+            entry[3] += visited
+            entry[4] += changed
+
+    def snapshot(self):
+        """ Get the current figures, keyed by processor class name in the
+            order the processors first ran
+        """
+        snapshot = OrderedDict()
+        with self._lock:
+            entries = [list(entry) for entry in self._entries.values()]
+        for processor, calls, seconds, visited, changed in entries:
+            name = label = processor.__class__.__name__
+            count = 1
+            while label in snapshot:
+                count += 1
+                label = '%s (%d)' % (name, count)
+            snapshot[label] = {'calls': calls,
+                               'time': seconds,
+                               'nodes_visited': visited,
+                               'nodes_changed': changed,
+                               }
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def table(self):
+        """ Format the figures as a table, most expensive processor first """
+        rows = sorted(self.snapshot().items(),
+                      key=lambda item: item[1]['time'], reverse=True)
+        lines = ["%-30s %8s %10s %12s %12s" % ('processor', 'calls',
+                                               'time [ms]', 'visited',
+                                               'changed')]
+        for label, figures in rows:
+            lines.append("%-30s %8d %10.2f %12d %12d"
+                         % (label, figures['calls'], figures['time'] * 1000,
+                            figures['nodes_visited'],
+                            figures['nodes_changed']))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,335 @@
+import os
+import shutil
+import sys
+import tempfile
+
+
+class CountingProcessor(object):
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def process(self, tree):
+        self.calls += 1
+        return tree
+
+
+class ConfiguredProcessor(object):
+    
+    def __init__(self, cache_key):
+        self.cache_key = cache_key
+    
+    def process(self, tree):
+        return tree
+
+
+class TestCodeCache(object):
+    
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.directory, 'frog.py')
+        self._write_source('jump = 1\n')
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+    
+    def teardown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        shutil.rmtree(self.directory)
+    
+    setup_method = setup
+    teardown_method = teardown
+    
+    def _write_source(self, source):
+        with open(self.source_path, 'w') as f:
+            f.write(source)
+    
+    def _make_one(self, *args, **kwargs):
+        from astkit.cache import CodeCache
+        return CodeCache(*args, **kwargs)
+    
+    def _store(self, cache, fingerprint=b'f' * 20):
+        key = cache.source_key(self.source_path)
+        code = compile('jump = 1\n', self.source_path, 'exec')
+        cache.store(self.source_path, fingerprint, key, code)
+        return key
+    
+    def test_entry_lives_in_pycache_by_default(self):
+        cache = self._make_one()
+        path = cache.cache_path(self.source_path)
+        assert os.path.dirname(path) == os.path.join(self.directory,
+                                                     '__pycache__')
+        assert os.path.basename(path).startswith('frog.')
+    
+    def test_entry_lives_in_central_directory(self):
+        central = os.path.join(self.directory, 'central')
+        cache = self._make_one(central)
+        self._store(cache)
+        path = cache.cache_path(self.source_path)
+        assert os.path.dirname(path) == central
+        assert os.path.exists(path)
+    
+    def test_load_stored_code(self):
+        cache = self._make_one()
+        key = self._store(cache)
+        code = cache.load(self.source_path, b'f' * 20, key)
+        namespace = {}
+        exec(code, namespace)
+        assert namespace['jump'] == 1
+        assert code.co_filename == self.source_path
+    
+    def test_miss_for_other_fingerprint(self):
+        cache = self._make_one()
+        key = self._store(cache)
+        assert cache.load(self.source_path, b'g' * 20, key) is None
+    
+    def test_miss_after_source_changes(self):
+        for validation in ('mtime', 'hash'):
+            cache = self._make_one(validation=validation)
+            self._write_source('jump = 1\n')
+            self._store(cache)
+            self._write_source('jump = 22\n')
+            key = cache.source_key(self.source_path)
+            assert cache.load(self.source_path, b'f' * 20, key) is None
+    
+    def test_miss_for_corrupt_entry(self):
+        cache = self._make_one()
+        key = self._store(cache)
+        path = cache.cache_path(self.source_path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:-4])
+        assert cache.load(self.source_path, b'f' * 20, key) is None
+    
+    def test_store_honors_dont_write_bytecode(self):
+        cache = self._make_one()
+        sys.dont_write_bytecode = True
+        self._store(cache)
+        assert not os.path.exists(cache.cache_path(self.source_path))
+    
+    def test_store_leaves_no_temporary_files(self):
+        cache = self._make_one()
+        self._store(cache)
+        self._store(cache)
+        assert os.listdir(os.path.dirname(cache.cache_path(self.source_path))) \
+            == [os.path.basename(cache.cache_path(self.source_path))]
+    
+    def test_invalid_validation(self):
+        try:
+            self._make_one(validation='never')
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError"
+
+
+class TestProcessorFingerprint(object):
+    
+    def test_depends_on_processor_order(self):
+        from astkit.cache import processor_fingerprint
+        one, two = CountingProcessor(), ConfiguredProcessor('x')
+        assert processor_fingerprint([one, two]) != \
+            processor_fingerprint([two, one])
+    
+    def test_depends_on_cache_key(self):
+        from astkit.cache import processor_fingerprint
+        assert processor_fingerprint([ConfiguredProcessor('x')]) != \
+            processor_fingerprint([ConfiguredProcessor('y')])
+        assert processor_fingerprint([ConfiguredProcessor('x')]) == \
+            processor_fingerprint([ConfiguredProcessor('x')])
+    
+    def test_depends_on_processor_module_version(self):
+        from astkit.cache import processor_fingerprint
+        module = sys.modules[__name__]
+        before = processor_fingerprint([CountingProcessor()])
+        module.__version__ = '2.0'
+        try:
+            assert processor_fingerprint([CountingProcessor()]) != before
+        finally:
+            del module.__version__
+        assert processor_fingerprint([CountingProcessor()]) == before
+    
+    def test_depends_on_processor_module_file(self):
+        from astkit import cache
+        before = cache.processor_fingerprint([CountingProcessor()])
+        path = sys.modules[__name__].__file__
+        stat = cache._module_stats[path]
+        cache._module_stats[path] = (stat[0] + 1, stat[1])
+        try:
+            assert cache.processor_fingerprint([CountingProcessor()]) != \
+                before
+        finally:
+            cache._module_stats[path] = stat
+    
+    def test_depends_on_astkit_version(self):
+        import astkit
+        from astkit.cache import processor_fingerprint
+        before = processor_fingerprint([])
+        version = astkit.__version__
+        astkit.__version__ = version + '.post1'
+        try:
+            assert processor_fingerprint([]) != before
+        finally:
+            astkit.__version__ = version
+
+
+class TestCachedModuleLoading(object):
+    
+    def setup(self):
+        from astkit.processor import _processor_manager, enable_code_cache
+        self.directory = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.directory, 'toad.py')
+        with open(self.source_path, 'w') as f:
+            f.write('hop = 3\n')
+        self.processor = CountingProcessor()
+        self.processors = _processor_manager._processors
+        _processor_manager._processors = [self.processor]
+        enable_code_cache(os.path.join(self.directory, 'cache'))
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+    
+    def teardown(self):
+        from astkit.processor import _processor_manager, disable_code_cache
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        _processor_manager._processors = self.processors
+        disable_code_cache()
+        sys.modules.pop('toad', None)
+        shutil.rmtree(self.directory)
+    
+    setup_method = setup
+    teardown_method = teardown
+    
+    def _load(self):
+        from astkit.processor import _ModuleLoader
+        sys.modules.pop('toad', None)
+        return _ModuleLoader(self.source_path).load_module('toad')
+    
+    def test_second_load_skips_processing(self):
+        assert self._load().hop == 3
+        assert self.processor.calls == 1
+        assert self._load().hop == 3
+        assert self.processor.calls == 1
+    
+    def test_new_processor_invalidates_entries(self):
+        from astkit.processor import _processor_manager
+        self._load()
+        _processor_manager._processors.append(ConfiguredProcessor('x'))
+        self._load()
+        assert self.processor.calls == 2
+
+
+class TestBoundedCodeCache(object):
+    
+    names = ['frog', 'toad', 'newt', 'eft']
+    
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = os.path.join(self.directory, 'cache')
+        for name in self.names:
+            with open(self._source(name), 'w') as f:
+                f.write('%s = 1\n' % name)
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+    
+    def teardown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        shutil.rmtree(self.directory)
+    
+    setup_method = setup
+    teardown_method = teardown
+    
+    def _source(self, name):
+        return os.path.join(self.directory, name + '.py')
+    
+    def _make_one(self, **kwargs):
+        from astkit.cache import CodeCache
+        return CodeCache(self.cache_directory, **kwargs)
+    
+    def _store(self, cache, name, mtime=None):
+        path = self._source(name)
+        code = compile('%s = 1\n' % name, path, 'exec')
+        cache.store(path, b'f' * 20, cache.source_key(path), code)
+        if mtime is not None:
+            os.utime(cache.cache_path(path), (mtime, mtime))
+    
+    def _load(self, cache, name):
+        path = self._source(name)
+        return cache.load(path, b'f' * 20, cache.source_key(path))
+    
+    def _cached(self, cache):
+        return set(name for name in self.names
+                   if os.path.exists(cache.cache_path(self._source(name))))
+    
+    def test_least_recently_stored_entries_are_evicted(self):
+        cache = self._make_one(max_entries=2)
+        self._store(cache, 'frog', 1000)
+        self._store(cache, 'toad', 2000)
+        self._store(cache, 'newt')
+        assert self._cached(cache) == set(['toad', 'newt'])
+        assert cache.stats()['evictions'] == 1
+        assert cache.usage()[0] == 2
+    
+    def test_loading_an_entry_keeps_it(self):
+        cache = self._make_one(max_entries=2)
+        self._store(cache, 'frog', 1000)
+        self._store(cache, 'toad', 2000)
+        assert self._load(cache, 'frog') is not None
+        self._store(cache, 'newt')
+        assert self._cached(cache) == set(['frog', 'newt'])
+    
+    def test_size_limit(self):
+        cache = self._make_one()
+        self._store(cache, 'frog')
+        entry_size = cache.usage()[1]
+        os.utime(cache.cache_path(self._source('frog')), (1000, 1000))
+        cache = self._make_one(max_size=entry_size * 2 + entry_size // 2)
+        self._store(cache, 'toad', 2000)
+        self._store(cache, 'newt', 3000)
+        self._store(cache, 'eft')
+        assert cache.usage()[0] == 2
+        assert self._cached(cache) == set(['newt', 'eft'])
+    
+    def test_other_processes_entries_are_counted(self):
+        other = self._make_one()
+        self._store(other, 'frog', 1000)
+        self._store(other, 'toad', 2000)
+        cache = self._make_one(max_entries=2)
+        self._store(cache, 'newt')
+        assert self._cached(cache) == set(['toad', 'newt'])
+    
+    def test_counters(self):
+        cache = self._make_one(max_entries=10)
+        assert self._load(cache, 'frog') is None
+        self._store(cache, 'frog')
+        assert self._load(cache, 'frog') is not None
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'stores': 1,
+                                 'evictions': 0}
+    
+    def test_abandoned_temporary_files_are_removed(self):
+        cache = self._make_one(max_entries=10)
+        self._store(cache, 'frog')
+        abandoned = os.path.join(self.cache_directory, 'tmpfrog.tmp')
+        recent = os.path.join(self.cache_directory, 'tmptoad.tmp')
+        for path in (abandoned, recent):
+            with open(path, 'w') as f:
+                f.write('half')
+        os.utime(abandoned, (1000, 1000))
+        cache.evict()
+        assert not os.path.exists(abandoned)
+        assert os.path.exists(recent)
+    
+    def test_only_central_cache_can_be_bounded(self):
+        from astkit.cache import CodeCache
+        try:
+            CodeCache(max_entries=10)
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError"
+    
+    def test_pickled_cache_keeps_limits(self):
+        import pickle
+        cache = pickle.loads(pickle.dumps(self._make_one(max_entries=3)))
+        assert cache.max_entries == 3
+        self._store(cache, 'frog')
+        assert cache.stats()['stores'] == 1
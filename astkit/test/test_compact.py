@@ -0,0 +1,128 @@
+import pickle
+
+from astkit.compat import ast
+from astkit.compact import CompactTree, node_type, node_type_id
+from astkit.compact import type_histogram
+from astkit.util import nodes_equal
+
+SOURCE = """
+import os
+
+def f(a, b=1, *args, **kwargs):
+    return {a: b, **kwargs}
+
+class C(object):
+    x = [y * 1.0 for y in range(3) if y]
+    z = -0.0, 0.0, True, 1, None, b'x'
+
+f(self.x, self.y)
+"""
+
+
+class TestCompactTree(object):
+
+    def _make_one(self):
+        return CompactTree(ast.parse(SOURCE))
+
+    def _dump(self, node):
+        return ast.dump(node, include_attributes=True)
+
+    def test_node_type_ids(self):
+        assert node_type(node_type_id(ast.Call)) is ast.Call
+        assert node_type_id(ast.Call) == node_type_id(ast.Call)
+
+    def test_columns(self):
+        tree = ast.parse(SOURCE)
+        compact = CompactTree(tree)
+        nodes = list(ast.walk(tree))
+        assert len(compact) == len(nodes)
+        for column in (compact.parents, compact.first_children,
+                       compact.next_siblings, compact.shapes,
+                       compact.linenos):
+            assert len(column) == len(nodes)
+        assert compact.node_type(0) is ast.Module
+        assert compact.parents[0] == -1
+        assert compact.linenos[0] == -1
+
+    def test_document_order(self):
+        compact = self._make_one()
+        functions = compact.find(ast.FunctionDef)
+        classes = compact.find(ast.ClassDef)
+        assert functions[0] < classes[0]
+        assert compact.linenos[functions[0]] == 4
+        assert compact.linenos[classes[0]] == 7
+
+    def test_children(self):
+        compact = self._make_one()
+        body = compact.children(0)
+        assert [compact.node_type(index) for index in body] == [
+            ast.Import, ast.FunctionDef, ast.ClassDef, ast.Expr]
+        for index in body:
+            assert compact.parents[index] == 0
+
+    def test_subtree_end(self):
+        compact = self._make_one()
+        body = compact.children(0)
+        assert compact.subtree_end(body[0]) == body[1]
+        assert compact.subtree_end(body[-1]) == len(compact)
+        assert compact.subtree_end(0) == len(compact)
+
+    def test_strings_interned(self):
+        compact = self._make_one()
+        assert compact.strings.count('self') == 1
+        assert compact.strings.count('y') == 1
+
+    def test_shapes_shared(self):
+        compact = self._make_one()
+        assert len(compact.shape_table) < len(compact)
+
+    def test_materialize_tree(self):
+        tree = ast.parse(SOURCE)
+        compact = CompactTree(tree)
+        assert self._dump(compact.materialize()) == self._dump(tree)
+
+    def test_materialize_subtree(self):
+        tree = ast.parse(SOURCE)
+        compact = CompactTree(tree)
+        index = compact.find(ast.ClassDef)[0]
+        materialized = compact.materialize(index)
+        assert self._dump(materialized) == self._dump(tree.body[2])
+
+    def test_materialize_keeps_constant_types(self):
+        tree = ast.parse(SOURCE)
+        compact = CompactTree(tree)
+        values = tree.body[2].body[1].value
+        materialized = compact.materialize(
+            compact.find(ast.ClassDef)[0]).body[1].value
+        assert nodes_equal(materialized, values)
+
+    def test_materialized_compiles(self):
+        compact = self._make_one()
+        compile(compact.materialize(), '<compact>', 'exec')
+
+    def test_find_abstract_type(self):
+        tree = ast.parse(SOURCE)
+        compact = CompactTree(tree)
+        statements = [node for node in ast.walk(tree)
+                      if isinstance(node, ast.stmt)]
+        assert len(compact.find(ast.stmt)) == len(statements)
+
+    def test_type_histogram(self):
+        tree = ast.parse(SOURCE)
+        compact = CompactTree(tree)
+        expected = {}
+        for node in ast.walk(tree):
+            expected[node.__class__] = expected.get(node.__class__, 0) + 1
+        assert compact.type_histogram() == expected
+
+    def test_type_histogram_of_many_trees(self):
+        compact = self._make_one()
+        other = CompactTree(ast.parse("f(x)\n"))
+        histogram = type_histogram([compact, other])
+        assert histogram[ast.Call] == compact.type_histogram()[ast.Call] + 1
+
+    def test_pickle(self):
+        tree = ast.parse(SOURCE)
+        compact = CompactTree(tree)
+        restored = pickle.loads(pickle.dumps(compact))
+        assert self._dump(restored.materialize()) == self._dump(tree)
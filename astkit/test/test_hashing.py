@@ -0,0 +1,137 @@
+from astkit.compat import ast
+from astkit.hashing import TreeHashes, subtree_digest
+
+SOURCE = """
+def first(a):
+    return a + 1
+
+def second(a):
+    return a + 1.0
+
+def third(a):
+    return a + 1
+"""
+
+
+class TestTreeHashes(object):
+
+    def _make_one(self):
+        return TreeHashes(ast.parse(SOURCE))
+
+    def _returns(self, tree):
+        return [function.body[0] for function in tree.body]
+
+    def test_every_node_hashed(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        for node in ast.walk(tree):
+            assert node in hashes
+        assert len(hashes.digest(tree)) == 20
+        assert len(hashes.hexdigest(tree)) == 40
+
+    def test_positions_ignored(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        first, second, third = self._returns(tree)
+        assert hashes.digest(first) == hashes.digest(third)
+        moved = ast.parse("\n\n\n" + SOURCE)
+        assert TreeHashes(moved).digest(moved) == hashes.digest(tree)
+
+    def test_constant_types_distinguished(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        first, second, third = self._returns(tree)
+        assert hashes.digest(first) != hashes.digest(second)
+
+    def test_names_distinguished(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        first, second, third = tree.body
+        assert hashes.digest(first) != hashes.digest(third)
+
+    def test_stable(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        other = ast.parse(SOURCE)
+        assert TreeHashes(other).digest(other.body[0]) == \
+            hashes.digest(tree.body[0])
+        assert subtree_digest(tree.body[0]) == hashes.digest(tree.body[0])
+
+    def test_unknown_node(self):
+        hashes = self._make_one()
+        try:
+            hashes.digest(ast.Pass())
+        except KeyError:
+            pass
+        else:
+            assert False, "expected a KeyError"
+
+    def test_parent(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        function = tree.body[1]
+        assert hashes.parent(function.body[0]) is function
+        assert hashes.parent(tree) is None
+
+    def test_update(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        function = tree.body[0]
+        before = hashes.digest(tree)
+        untouched = hashes.digest(tree.body[1])
+        function.body.insert(0, ast.Pass())
+        hashes.update(function)
+        assert function.body[0] in hashes
+        assert hashes.digest(tree) != before
+        assert hashes.digest(tree.body[1]) == untouched
+        assert hashes.digest(tree) == TreeHashes(tree).digest(tree)
+
+    def test_update_forgets_removed_nodes(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        removed = tree.body.pop(1)
+        replaced = tree.body[0].body[0]
+        tree.body[0].body[0] = ast.Pass()
+        hashes.update(tree.body[0])
+        hashes.update(tree)
+        for node in ast.walk(removed):
+            if not isinstance(node, (ast.expr_context, ast.operator)):
+                assert node not in hashes
+        assert replaced not in hashes
+        assert replaced.value not in hashes
+        assert len(hashes) == len(TreeHashes(tree))
+
+    def test_update_keeps_moved_nodes(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        moved = tree.body[0].body.pop()
+        tree.body[1].body.append(moved)
+        hashes.update(tree.body[1])
+        hashes.update(tree.body[0])
+        assert moved in hashes
+        assert hashes.parent(moved) is tree.body[1]
+        assert hashes.digest(tree) == TreeHashes(tree).digest(tree)
+
+    def test_update_field(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        function = tree.body[2]
+        function.name = 'first'
+        hashes.update(function)
+        assert hashes.digest(function) == hashes.digest(tree.body[0])
+        assert hashes.digest(tree) == TreeHashes(tree).digest(tree)
+
+    def test_update_stops_when_unchanged(self):
+        hashes = self._make_one()
+        tree = hashes.tree
+        function = tree.body[0]
+        statement = function.body[0]
+        statement.lineno = 42
+        calls = []
+        store = hashes._store
+        def counting_store(node):
+            calls.append(node)
+            return store(node)
+        hashes._store = counting_store
+        hashes.update(statement)
+        assert calls == [statement]
@@ -0,0 +1,173 @@
+from astkit.compat import ast
+from astkit.index import NodeIndex
+
+SOURCE = """
+import os
+
+def outer(path):
+    def inner():
+        return open(path)
+    return inner()
+
+class Thing(object):
+    def method(self):
+        return os.path.join(self.name, 'x')
+
+result = outer(os.getcwd())
+"""
+
+
+class TestNodeIndex(object):
+
+    def _make_one(self):
+        return NodeIndex(ast.parse(SOURCE))
+
+    def _find(self, tree, node_type, **attributes):
+        for node in ast.walk(tree):
+            if isinstance(node, node_type) and all(
+                    getattr(node, name, None) == value
+                    for name, value in attributes.items()):
+                return node
+
+    def _count(self, tree):
+        shared = (ast.expr_context, ast.boolop, ast.operator, ast.unaryop,
+                  ast.cmpop)
+        return len([node for node in ast.walk(tree)
+                    if not isinstance(node, shared)])
+
+    def test_len(self):
+        index = self._make_one()
+        tree = index.tree
+        assert len(index) == self._count(tree)
+        assert tree in index
+        assert ast.Load() not in index
+        assert ast.Name(id='x', ctx=ast.Load()) not in index
+
+    def test_nodes_in_document_order(self):
+        index = self._make_one()
+        tree = index.tree
+        walked = [node for node in ast.walk(tree)
+                  if isinstance(node, ast.Call)]
+        calls = index.nodes(ast.Call)
+        assert sorted(map(id, calls)) == sorted(map(id, walked))
+        lines = [call.lineno for call in calls]
+        assert lines == sorted(lines)
+
+    def test_nodes_of_abstract_type(self):
+        index = self._make_one()
+        tree = index.tree
+        walked = [node for node in ast.walk(tree)
+                  if isinstance(node, ast.expr)]
+        expressions = index.nodes(ast.expr)
+        assert sorted(map(id, expressions)) == sorted(map(id, walked))
+        assert any(isinstance(node, ast.Call) for node in expressions)
+        assert any(isinstance(node, ast.Attribute) for node in expressions)
+
+    def test_nodes_returns_a_copy(self):
+        index = self._make_one()
+        index.nodes(ast.Call).pop()
+        assert len(index.nodes(ast.Call)) == 5
+
+    def test_nodes_of_missing_type(self):
+        index = self._make_one()
+        assert index.nodes(ast.While) == []
+
+    def test_parent(self):
+        index = self._make_one()
+        tree = index.tree
+        function = self._find(tree, ast.FunctionDef, name='inner')
+        outer = self._find(tree, ast.FunctionDef, name='outer')
+        assert index.parent(function) is outer
+        assert index.parent_field(function) == 'body'
+        assert index.parent(tree) is None
+
+    def test_parent_of_unknown_node(self):
+        index = self._make_one()
+        try:
+            index.parent(ast.Pass())
+        except KeyError:
+            pass
+        else:
+            assert False, "expected a KeyError"
+
+    def test_enclosing_scope(self):
+        index = self._make_one()
+        tree = index.tree
+        opened = self._find(tree, ast.Name, id='open')
+        assert index.enclosing_scope(opened) is \
+            self._find(tree, ast.FunctionDef, name='inner')
+        joined = self._find(tree, ast.Attribute, attr='join')
+        assert index.enclosing_scope(joined) is \
+            self._find(tree, ast.FunctionDef, name='method')
+        method = self._find(tree, ast.FunctionDef, name='method')
+        assert index.enclosing_scope(method) is \
+            self._find(tree, ast.ClassDef, name='Thing')
+        result = self._find(tree, ast.Name, id='result')
+        assert index.enclosing_scope(result) is None
+
+    def test_ancestors(self):
+        index = self._make_one()
+        tree = index.tree
+        opened = self._find(tree, ast.Name, id='open')
+        ancestors = list(index.ancestors(opened))
+        assert ancestors[0] is self._find(tree, ast.Call, lineno=6)
+        assert ancestors[-1] is tree
+
+    def test_replace(self):
+        index = self._make_one()
+        tree = index.tree
+        opened = self._find(tree, ast.Call, lineno=6)
+        replacement = ast.Name(id='path', ctx=ast.Load())
+        parent = index.parent(opened)
+        index.replace(opened, replacement)
+        assert parent.value is replacement
+        assert opened not in index
+        assert opened.func not in index
+        assert index.parent(replacement) is parent
+        assert index.enclosing_scope(replacement) is \
+            self._find(tree, ast.FunctionDef, name='inner')
+        assert len(index.nodes(ast.Call)) == 4
+        assert replacement in index.nodes(ast.expr)
+        assert len(index) == self._count(tree)
+
+    def test_replace_in_list(self):
+        index = self._make_one()
+        tree = index.tree
+        statement = tree.body[0]
+        first, second = ast.Pass(), ast.Pass()
+        index.replace(statement, [first, second])
+        assert tree.body[:2] == [first, second]
+        assert index.nodes(ast.Import) == []
+        assert index.nodes(ast.Pass) == [first, second]
+        assert index.parent(second) is tree
+
+    def test_remove(self):
+        index = self._make_one()
+        tree = index.tree
+        statement = tree.body[-1]
+        index.replace(statement, None)
+        assert statement not in tree.body
+        assert self._find(tree, ast.Name, id='result') is None
+        assert len(index) == self._count(tree)
+
+    def test_reindex_changed_node(self):
+        index = self._make_one()
+        tree = index.tree
+        function = self._find(tree, ast.FunctionDef, name='outer')
+        function.body = [ast.Pass()]
+        index.replace(function, function)
+        assert len(index) == self._count(tree)
+        assert len(index.nodes(ast.Call)) == 3
+        assert index.parent(function.body[0]) is function
+        assert index.enclosing_scope(function.body[0]) is function
+
+    def test_replace_single_node_with_list(self):
+        index = self._make_one()
+        tree = index.tree
+        opened = self._find(tree, ast.Call, lineno=6)
+        try:
+            index.replace(opened, [ast.Pass(), ast.Pass()])
+        except ValueError:
+            pass
+        else:
+            assert False, "expected a ValueError"
@@ -0,0 +1,325 @@
+from astkit import ast
+from astkit.pipeline import Pipeline, PipelineProcessor
+
+
+class Rename(PipelineProcessor):
+    
+    def __init__(self, old, new, log=None):
+        self.old = old
+        self.new = new
+        self.log = log
+    
+    def handle_Name(self, node):
+        if self.log is not None:
+            self.log.append((self.old, node.id))
+        if node.id == self.old:
+            node.id = self.new
+        return node
+
+
+class ExpandToSum(PipelineProcessor):
+    """ Replace a name with the sum of two others """
+    
+    def __init__(self, name, left, right):
+        self.name = name
+        self.left = left
+        self.right = right
+    
+    def handle_Name(self, node):
+        if node.id != self.name:
+            return node
+        return ast.BinOp(left=ast.Name(id=self.left, ctx=ast.Load()),
+                         op=ast.Add(),
+                         right=ast.Name(id=self.right, ctx=ast.Load()))
+
+
+class DropPass(PipelineProcessor):
+    
+    def handle_Pass(self, node):
+        return None
+
+
+class Duplicate(PipelineProcessor):
+    """ Evaluate every expression statement twice """
+    
+    def handle_Expr(self, node):
+        return [node, ast.Expr(value=ast.Name(id=node.value.id,
+                                              ctx=ast.Load()))]
+
+
+class InsertTrace(PipelineProcessor):
+    """ Call trace() at the start of every function, changing it in place """
+    
+    def handle_FunctionDef(self, node):
+        node.body.insert(0, ast.Expr(value=ast.Call(
+            func=ast.Name(id='trace', ctx=ast.Load()), args=[], keywords=[])))
+        return node
+
+
+class LogCalls(PipelineProcessor):
+    
+    def __init__(self, log):
+        self.log = log
+    
+    def handle_Call(self, node):
+        self.log.append('%s()' % (node.func.id,))
+        return node
+
+
+class RenameTransformer(ast.NodeTransformer):
+    """ An ordinary processor with its own traversal """
+    
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+    
+    def process(self, tree):
+        return self.visit(tree)
+    
+    def visit_Name(self, node):
+        if node.id == self.old:
+            node.id = self.new
+        return node
+
+
+def sequential(processors, tree):
+    for processor in processors:
+        tree = processor.process(tree)
+    return tree
+
+
+class TestPipeline(object):
+    
+    source = "def f(a, b):\n    x = a + y\n    pass\n    return x * y\n"
+    
+    def _compare(self, make_processors):
+        expected = sequential(make_processors(), ast.parse(self.source))
+        result = Pipeline(make_processors()).process(ast.parse(self.source))
+        assert ast.dump(expected) == ast.dump(result)
+        return result
+    
+    def test_matches_sequential_processing(self):
+        self._compare(lambda: [Rename('x', 'z'), DropPass(),
+                               Rename('z', 'w')])
+    
+    def test_each_node_is_visited_once(self):
+        log = []
+        Pipeline([Rename('x', 'z', log),
+                  Rename('y', 'v', log)]).process(ast.parse(self.source))
+        assert [name for old, name in log if old == 'x'] == \
+            ['x', 'a', 'y', 'x', 'y']
+        assert [name for old, name in log if old == 'y'] == \
+            ['z', 'a', 'y', 'z', 'y']
+    
+    def test_replacement_is_seen_by_later_processors(self):
+        result = self._compare(lambda: [ExpandToSum('y', 'c', 'd'),
+                                        Rename('c', 'e')])
+        names = set(node.id for node in ast.walk(result)
+                    if isinstance(node, ast.Name))
+        assert 'e' in names and 'c' not in names and 'y' not in names
+    
+    def test_replacement_is_not_seen_by_earlier_processors(self):
+        self._compare(lambda: [Rename('c', 'e'),
+                               ExpandToSum('y', 'c', 'd')])
+    
+    def test_reused_nodes_are_not_processed_again(self):
+        log = []
+        source = "frog\n"
+        Pipeline([Duplicate(), Rename('frog', 'toad', log)]).process(
+            ast.parse(source))
+        # the original Name and the one in the new Expr
+        assert len(log) == 2
+    
+    def test_list_results_are_spliced(self):
+        tree = self._compare(lambda: [Duplicate(), Rename('x', 'z')])
+        assert len(tree.body) == 1
+        tree = Pipeline([Duplicate()]).process(ast.parse("frog\ntoad\n"))
+        assert [stmt.value.id for stmt in tree.body] == \
+            ['frog', 'frog', 'toad', 'toad']
+    
+    def test_children_added_in_place_are_seen_by_later_processors(self):
+        source = "def f():\n    g()\n"
+        expected = []
+        sequential([InsertTrace(), LogCalls(expected)], ast.parse(source))
+        log = []
+        Pipeline([InsertTrace(), LogCalls(log)]).process(ast.parse(source))
+        assert expected == ['trace()', 'g()']
+        assert sorted(log) == sorted(expected)
+        assert len(log) == 2
+    
+    def test_ordinary_processors_run_between_fused_stages(self):
+        self._compare(lambda: [Rename('x', 'z'), RenameTransformer('z', 'q'),
+                               Rename('q', 'r')])
+    
+    def test_unfusible_processor_runs_alone(self):
+        class Unfusible(Rename):
+            fusible = False
+        log = []
+        Pipeline([Rename('x', 'z', log), Unfusible('y', 'v', log),
+                  Rename('v', 'u', log)]).process(ast.parse(self.source))
+        olds = [old for old, name in log]
+        assert olds == ['x'] * 5 + ['y'] * 5 + ['v'] * 5
+    
+    def test_processor_alone(self):
+        tree = DropPass().process(ast.parse(self.source))
+        assert not any(isinstance(node, ast.Pass) for node in ast.walk(tree))
+
+
+class TestManagerPipeline(object):
+    
+    def test_manager_fuses_pipeline_processors(self):
+        from astkit.processor import _ProcessorManager
+        man = _ProcessorManager()
+        man._install_import_hook = lambda: None
+        log = []
+        man.add_processor(Rename('x', 'z', log))
+        man.add_processor(Rename('y', 'v', log))
+        man.process(ast.parse("x + y\n"))
+        assert [old for old, name in log] == ['x', 'y', 'x', 'y']
+    
+    def test_manager_reuses_pipeline_until_processors_change(self):
+        from astkit.processor import _ProcessorManager
+        man = _ProcessorManager()
+        man._install_import_hook = lambda: None
+        log = []
+        man.add_processor(Rename('x', 'z', log))
+        pipeline = man._pipeline(man._processors)
+        man.process(ast.parse("x\n"))
+        assert man._pipeline(man._processors) is pipeline
+        man.add_processor(Rename('z', 'v', log))
+        assert man._pipeline(man._processors) is not pipeline
+        tree = man.process(ast.parse("x\n"))
+        assert tree.body[0].value.id == 'v'
+
+
+    def test_shared_pipeline_runs_in_threads(self):
+        import threading
+        import time
+        from astkit.processor import _ProcessorManager
+        from astkit.stats import ProcessorProfile
+        
+        class SlowRename(Rename):
+            def handle_Name(self, node):
+                # give the other threads a chance to run mid-traversal
+                time.sleep(0.0005)
+                return Rename.handle_Name(self, node)
+        
+        man = _ProcessorManager()
+        man._install_import_hook = lambda: None
+        man.add_processor(SlowRename('x', 'y'))
+        man.add_processor(Rename('y', 'z'))
+        man.processor_profile = ProcessorProfile()
+        source = "x + x\n" * 5
+        results = []
+        errors = []
+        def work():
+            try:
+                results.append(man.process(ast.parse(source)))
+            except Exception as exc:
+                errors.append(exc)
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert errors == []
+        assert len(results) == 8
+        for tree in results:
+            assert set(node.id for node in ast.walk(tree)
+                       if isinstance(node, ast.Name)) == set(['z'])
+        figures = man.processor_profile.snapshot()
+        assert figures['SlowRename']['calls'] == 8
+        assert figures['SlowRename']['nodes_visited'] == 8 * 10
+        assert figures['Rename']['nodes_visited'] == 8 * 10
+
+
+class CountingProcessor(object):
+    """ An ordinary processor that declares its interests """
+    
+    def __init__(self, node_types=None):
+        if node_types is not None:
+            self.node_types = node_types
+        self.calls = 0
+    
+    def process(self, tree):
+        self.calls += 1
+        return tree
+
+
+class AddAssert(object):
+    """ An ordinary processor that introduces a node type """
+    
+    def process(self, tree):
+        tree.body.append(ast.Assert(test=ast.Name(id='frog', ctx=ast.Load()),
+                                    msg=None))
+        return tree
+
+
+class DropAsserts(PipelineProcessor):
+    
+    def handle_Assert(self, node):
+        return None
+
+
+class VisitCountingStage(object):
+    """ Count the nodes a fused traversal visits """
+    
+    def __init__(self, processors):
+        from astkit.pipeline import _FusedStage
+        self.visited = []
+        visited = self.visited
+        class Stage(_FusedStage):
+            def _visit(self, run, node, start):
+                visited.append(node)
+                return _FusedStage._visit(self, run, node, start)
+        self.stage = Stage(processors)
+
+
+class TestInterestDeclarations(object):
+    
+    source = "def f(a):\n    return g(a)\n\nclass C(object):\n    x = y\n"
+    
+    def test_interest_of_pipeline_processor_comes_from_handlers(self):
+        from astkit.pipeline import interest_mask, node_bit
+        assert interest_mask(DropAsserts()) == node_bit(ast.Assert)
+        assert interest_mask(CountingProcessor()) is None
+    
+    def test_abstract_node_types_include_subclasses(self):
+        from astkit.pipeline import interest_mask, node_bit
+        mask = interest_mask(CountingProcessor([ast.expr]))
+        assert mask & node_bit(ast.Name)
+        assert mask & node_bit(ast.Call)
+        assert not mask & node_bit(ast.Return)
+    
+    def test_uninterested_processors_are_skipped(self):
+        calls = CountingProcessor([ast.Call])
+        asserts = CountingProcessor([ast.Assert])
+        undeclared = CountingProcessor()
+        Pipeline([calls, asserts, undeclared]).process(
+            ast.parse(self.source))
+        assert (calls.calls, asserts.calls, undeclared.calls) == (1, 0, 1)
+    
+    def test_node_types_introduced_by_earlier_processors_are_seen(self):
+        asserts = CountingProcessor([ast.Assert])
+        Pipeline([AddAssert(), asserts]).process(ast.parse(self.source))
+        assert asserts.calls == 1
+    
+    def test_irrelevant_subtrees_are_not_visited(self):
+        from astkit.pipeline import subtree_masks
+        tree = ast.parse(self.source + "assert x\n")
+        counter = VisitCountingStage([DropAsserts()])
+        tree = counter.stage.process(tree, subtree_masks(tree))
+        assert not any(isinstance(node, ast.Assert)
+                       for node in ast.walk(tree))
+        # the module, the assert and its operand, and the two definitions
+        # that are passed over without being entered
+        assert len(counter.visited) == 5
+    
+    def test_pruned_pipeline_matches_sequential_processing(self):
+        def make_processors():
+            return [Rename('y', 'z'), DropAsserts(), Rename('g', 'h')]
+        source = self.source + "assert y\n"
+        expected = sequential(make_processors(), ast.parse(source))
+        result = Pipeline(make_processors()).process(ast.parse(source))
+        assert ast.dump(expected) == ast.dump(result)
@@ -0,0 +1,142 @@
+import os
+import shutil
+import sys
+import tempfile
+
+
+class CountingProcessor(object):
+    
+    calls = 0
+    
+    def process(self, tree):
+        CountingProcessor.calls += 1
+        return tree
+
+
+class TestPrecompile(object):
+    
+    def setup(self):
+        from astkit.processor import _ProcessorManager
+        from astkit.cache import CodeCache
+        self.directory = tempfile.mkdtemp()
+        self._write('top.py', 'x = 1\n')
+        self._write(os.path.join('pond', '__init__.py'), '')
+        self._write(os.path.join('pond', 'frog.py'), 'y = 2\n')
+        self._write(os.path.join('pond', 'broken.py'), 'y = \n')
+        self._write(os.path.join('notapackage', 'toad.py'), 'z = 3\n')
+        self.manager = _ProcessorManager()
+        self.manager._install_import_hook = lambda: None
+        self.manager.add_processor(CountingProcessor())
+        self.manager.code_cache = CodeCache(os.path.join(self.directory,
+                                                         'cache'))
+        CountingProcessor.calls = 0
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+    
+    def teardown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        shutil.rmtree(self.directory)
+    
+    setup_method = setup
+    teardown_method = teardown
+    
+    def _write(self, name, source):
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(source)
+    
+    def _is_cached(self, fullname, path):
+        manager = self.manager
+        cache = manager.code_cache
+        return cache.load(path, manager.fingerprint(fullname, path),
+                          cache.source_key(path)) is not None
+    
+    def test_find_modules(self):
+        from astkit.precompile import find_modules
+        names = [fullname for fullname, path in find_modules(self.directory)]
+        assert names == ['top', 'pond', 'pond.broken', 'pond.frog']
+        names = [fullname for fullname, path
+                 in find_modules(self.directory, 'lake')]
+        assert names[0] == 'lake.top'
+    
+    def _precompile(self, workers):
+        from astkit.precompile import precompile
+        failures = precompile(self.directory, workers, self.manager)
+        assert [fullname for fullname, path, error in failures] == \
+            ['pond.broken']
+        assert 'SyntaxError' in failures[0][2]
+        for fullname, name in [('top', 'top.py'),
+                               ('pond.frog', os.path.join('pond', 'frog.py'))]:
+            assert self._is_cached(fullname,
+                                   os.path.join(self.directory, name))
+    
+    def test_precompile_in_process(self):
+        self._precompile(1)
+        assert CountingProcessor.calls == 3
+    
+    def test_precompile_in_pool(self):
+        self._precompile(2)
+    
+    def test_import_after_precompile_is_cache_hit(self):
+        from astkit.processor import _ModuleLoader
+        self._precompile(1)
+        calls = CountingProcessor.calls
+        loader = _ModuleLoader(os.path.join(self.directory, 'top.py'),
+                               self.manager)
+        loader._get_code('top')
+        assert CountingProcessor.calls == calls
+    
+    def test_uninteresting_modules_are_skipped(self):
+        from astkit.processor import ModuleFilter
+        self.manager.module_filter = ModuleFilter(exclude=['pond'])
+        from astkit.precompile import precompile
+        assert precompile(self.directory, 1, self.manager) == []
+        assert CountingProcessor.calls == 1
+    
+    def test_cache_is_required(self):
+        from astkit.precompile import precompile
+        self.manager.code_cache = None
+        try:
+            precompile(self.directory, 1, self.manager)
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError"
+    
+    def test_main_keeps_cache_enabled_by_setup(self):
+        from astkit import processor
+        from astkit.precompile import main
+        self._write('frogsetup.py',
+                    "from astkit.processor import enable_code_cache\n"
+                    "enable_code_cache(%r, max_entries=5)\n"
+                    % os.path.join(self.directory, 'setup-cache'))
+        sys.path.insert(0, self.directory)
+        try:
+            main(['--setup', 'frogsetup', '--hash', self.directory])
+        except SystemExit:
+            pass
+        else:
+            assert False, "expected SystemExit"
+        finally:
+            sys.path.remove(self.directory)
+            sys.modules.pop('frogsetup', None)
+            cache = processor._processor_manager.code_cache
+            processor.disable_code_cache()
+        assert cache.max_entries == 5
+        assert cache.validation == 'mtime'
+
+    def test_manager_survives_pickling(self):
+        import pickle
+        from astkit.processor import ModuleFilter
+        self.manager.add_processor(CountingProcessor(), include=['pond'])
+        self.manager.module_filter = ModuleFilter(exclude=['lake'])
+        del self.manager._install_import_hook
+        manager = pickle.loads(pickle.dumps(self.manager))
+        assert len(manager.processors_for('top', '/top.py')) == 1
+        assert len(manager.processors_for('pond.frog', '/pond/frog.py')) == 2
+        assert not manager.wants('lake')
+        assert manager.import_hook.manager is manager
+        assert manager.code_cache.directory == \
+            self.manager.code_cache.directory
@@ -1,11 +1,23 @@
+import logging
 import os
 import sys
+import types
 
 
 class DummyProcessor(object):
     pass
 
 
+class RecordingProcessor(object):
+
+    def __init__(self):
+        self.processed = []
+
+    def process(self, tree):
+        self.processed.append(tree)
+        return tree
+
+
 class TestProcessorManager(object):
 
     def _make_one(self):
@@ -21,6 +33,7 @@ class TestProcessorManager(object):
         proc = DummyProcessor()
         man.add_processor(proc)
         assert proc in man._processors
+        man._remove_import_hook()
 
     def test_add_and_remove_import_hook(self):
         import sys
@@ -31,6 +44,19 @@ class TestProcessorManager(object):
         man._remove_import_hook()
         assert man.import_hook not in sys.meta_path
 
+    def test_import_hook_precedes_path_finder(self):
+        try:
+            from importlib.machinery import PathFinder
+        except ImportError:
+            return
+        man = self._make_one()
+        man._install_import_hook()
+        try:
+            assert sys.meta_path.index(man.import_hook) < \
+                sys.meta_path.index(PathFinder)
+        finally:
+            man._remove_import_hook()
+
 
 class TestImportHook(object):
 
@@ -66,6 +92,290 @@ class TestImportHook(object):
         assert isinstance(loader, _ModuleLoader), loader
 
 
+    def test_find_spec_for_module(self):
+        import astkit
+        from astkit.processor import _ModuleLoader
+        hook = self._make_one()
+        path = os.path.join(astkit.__path__[0], 'test', 'modules')
+        spec = hook.find_spec('astkit.test.modules.one', [path])
+        assert isinstance(spec.loader, _ModuleLoader), spec.loader
+        assert spec.origin == os.path.join(path, 'one.py')
+        assert spec.submodule_search_locations is None
+
+    def test_find_spec_for_package(self):
+        import astkit
+        hook = self._make_one()
+        path = os.path.join(astkit.__path__[0], 'test')
+        spec = hook.find_spec('astkit.test.modules', [path])
+        assert spec.origin == os.path.join(path, 'modules', '__init__.py')
+        assert spec.submodule_search_locations == \
+            [os.path.join(path, 'modules')]
+
+    def test_find_spec_for_missing_module(self):
+        import astkit
+        hook = self._make_one()
+        assert hook.find_spec('astkit.frogspawn', astkit.__path__) is None
+
+
+class TestDirectoryListingCache(object):
+
+    def setup(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+        sys.modules.pop('tadpole', None)
+
+    setup_method = setup
+    teardown_method = teardown
+
+    def _make_one(self):
+        from astkit.processor import _ImportHook
+        return _ImportHook()
+
+    def _add_module(self, name):
+        with open(os.path.join(self.directory, name + '.py'), 'w') as f:
+            f.write('')
+
+    def _touch_directory(self, mtime):
+        os.utime(self.directory, (mtime, mtime))
+
+    def test_listing_is_reused_while_directory_is_unchanged(self):
+        hook = self._make_one()
+        self._touch_directory(1000000)
+        assert hook._loader_for_path(self.directory, 'tadpole') is None
+        self._add_module('tadpole')
+        self._touch_directory(1000000)
+        assert hook._loader_for_path(self.directory, 'tadpole') is None
+
+    def test_listing_is_refreshed_when_directory_changes(self):
+        hook = self._make_one()
+        self._touch_directory(1000000)
+        assert hook._loader_for_path(self.directory, 'tadpole') is None
+        self._add_module('tadpole')
+        self._touch_directory(2000000)
+        assert hook._loader_for_path(self.directory, 'tadpole') is not None
+
+    def test_invalidate_caches(self):
+        hook = self._make_one()
+        self._touch_directory(1000000)
+        assert hook._loader_for_path(self.directory, 'tadpole') is None
+        self._add_module('tadpole')
+        self._touch_directory(1000000)
+        hook.invalidate_caches()
+        assert hook._loader_for_path(self.directory, 'tadpole') is not None
+
+    def test_package_found_before_module(self):
+        os.mkdir(os.path.join(self.directory, 'tadpole'))
+        with open(os.path.join(self.directory, 'tadpole', '__init__.py'),
+                  'w') as f:
+            f.write('')
+        self._add_module('tadpole')
+        loader = self._make_one()._loader_for_path(self.directory, 'tadpole')
+        assert loader.fullpath == \
+            os.path.join(self.directory, 'tadpole', '__init__.py')
+
+    def test_extension_module_is_left_to_path_finder(self):
+        from astkit.processor import EXTENSION_SUFFIXES
+        if not EXTENSION_SUFFIXES:
+            return
+        import tempfile
+        import shutil
+        self._add_module('tadpole')
+        with open(os.path.join(self.directory,
+                               'tadpole' + EXTENSION_SUFFIXES[0]), 'w') as f:
+            f.write('')
+        later = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(later, 'tadpole.py'), 'w') as f:
+                f.write('')
+            hook = self._make_one()
+            assert hook._search('tadpole', [self.directory, later]) is None
+            assert hook._search('tadpole', [later, self.directory]) \
+                is not None
+        finally:
+            shutil.rmtree(later)
+
+    def test_import_through_hook(self):
+        try:
+            import importlib.machinery
+        except ImportError:
+            return
+        from astkit.processor import _ModuleLoader, _ProcessorManager
+        self._add_module('tadpole')
+        man = _ProcessorManager()
+        processor = RecordingProcessor()
+        man.add_processor(processor)
+        sys.path.insert(0, self.directory)
+        try:
+            import tadpole
+        finally:
+            sys.path.remove(self.directory)
+            man._remove_import_hook()
+        assert isinstance(tadpole.__loader__, _ModuleLoader)
+        assert tadpole.__file__ == os.path.join(self.directory, 'tadpole.py')
+        assert len(processor.processed) == 1
+
+
+class TestMissCache(object):
+
+    def _make_one(self, *args):
+        from astkit.processor import _MissCache
+        return _MissCache(*args)
+
+    def test_hit_counts_saved_stats(self):
+        cache = self._make_one()
+        assert not cache.hit('frog', ('/pond',))
+        cache.add('frog', ('/pond',), 2)
+        assert cache.hit('frog', ('/pond',))
+        assert cache.hit('frog', ('/pond',))
+        assert not cache.hit('frog', ('/lake',))
+        assert not cache.hit('frog', ('/pond', '/lake'))
+        assert cache.stats() == {'entries': 1, 'hits': 2, 'evictions': 0,
+                                 'stats_saved': 4}
+
+    def test_oldest_entries_are_evicted(self):
+        cache = self._make_one(2)
+        cache.add('frog', ('/pond',), 1)
+        cache.add('toad', ('/pond',), 1)
+        assert cache.hit('frog', ('/pond',))
+        cache.add('newt', ('/pond',), 1)
+        assert len(cache) == 2
+        assert cache.evictions == 1
+        assert not cache.hit('toad', ('/pond',))
+        assert cache.hit('frog', ('/pond',))
+
+    def test_hook_remembers_misses_until_caches_are_invalidated(self):
+        import importlib
+        import astkit
+        from astkit.processor import _ImportHook
+        hook = _ImportHook()
+        assert hook.find_module('astkit.frogspawn', astkit.__path__) is None
+        assert hook.find_module('astkit.frogspawn', astkit.__path__) is None
+        assert hook.miss_cache.hits == 1
+        assert hook.miss_cache.stats_saved == len(astkit.__path__)
+        # Python 2's importlib has no invalidate_caches
+        invalidate_caches = getattr(importlib, 'invalidate_caches',
+                                    hook.invalidate_caches)
+        sys.meta_path.insert(0, hook)
+        try:
+            invalidate_caches()
+        finally:
+            sys.meta_path.remove(hook)
+        assert len(hook.miss_cache) == 0
+
+
+    def test_search_miss_is_checked_before_listing(self):
+        import tempfile
+        import shutil
+        from astkit.processor import _ImportHook
+        directory = tempfile.mkdtemp()
+        try:
+            hook = _ImportHook()
+            assert hook._search('polliwog', [directory]) is None
+            hook._listings.clear()
+            assert hook._search('polliwog', [directory]) is None
+            assert hook._listings == {}
+            assert hook.miss_cache.stats_saved == 1
+            with open(os.path.join(directory, 'polliwog.py'), 'w') as f:
+                f.write('')
+            hook.invalidate_caches()
+            assert hook._search('polliwog', [directory]) is not None
+        finally:
+            shutil.rmtree(directory)
+
+class TestModuleFilter(object):
+
+    def _make_one(self, *args, **kwargs):
+        from astkit.processor import ModuleFilter
+        return ModuleFilter(*args, **kwargs)
+
+    def test_empty_filter_accepts_everything(self):
+        module_filter = self._make_one()
+        assert not module_filter
+        assert module_filter.might_accept('frog')
+        assert module_filter.accepts('frog', '/pond/frog.py')
+
+    def test_dotted_name_prefix(self):
+        module_filter = self._make_one(include=['pond'])
+        assert module_filter.might_accept('pond')
+        assert module_filter.might_accept('pond.frog')
+        assert not module_filter.might_accept('ponder')
+        assert not module_filter.accepts('lake.frog', '/lake/frog.py')
+
+    def test_glob(self):
+        module_filter = self._make_one(include=['pond.*.frog'],
+                                       exclude=['pond.green.*'])
+        assert module_filter.accepts('pond.brown.frog', '/p/frog.py')
+        assert not module_filter.accepts('pond.green.frog', '/p/frog.py')
+        assert not module_filter.might_accept('pond.brown.toad')
+
+    def test_path(self):
+        pond = os.path.join(os.sep, 'pond')
+        module_filter = self._make_one(include=[pond + os.sep],
+                                       exclude=[os.path.join(pond, '*.pyx')])
+        # name rules can't reject a module that a path rule might include
+        assert module_filter.might_accept('lake')
+        assert module_filter.accepts('frog', os.path.join(pond, 'frog.py'))
+        assert not module_filter.accepts('frog',
+                                         os.path.join(pond, 'frog.pyx'))
+        assert not module_filter.accepts('frog', pond + 'er.py')
+
+    def test_exclude_wins(self):
+        module_filter = self._make_one(include=['pond'], exclude=['pond.toad'])
+        assert module_filter.might_accept('pond.frog')
+        assert not module_filter.might_accept('pond.toad.warts')
+
+
+class TestProcessorFiltering(object):
+
+    def _make_one(self):
+        from astkit.processor import _ProcessorManager
+        man = _ProcessorManager()
+        man._install_import_hook = lambda: None
+        return man
+
+    def test_processors_apply_to_matching_modules(self):
+        man = self._make_one()
+        frogs, everything = RecordingProcessor(), RecordingProcessor()
+        man.add_processor(frogs, include=['pond.frog'])
+        man.add_processor(everything)
+        assert man.processors_for('pond.frog', '/pond/frog.py') == \
+            [frogs, everything]
+        assert man.processors_for('pond.toad', '/pond/toad.py') == \
+            [everything]
+
+    def test_uninteresting_modules_are_left_alone(self):
+        man = self._make_one()
+        man.add_processor(RecordingProcessor(), exclude=['astkit'])
+        assert not man.wants('astkit.frogspawn')
+        assert man.import_hook.find_module('astkit.frogspawn') is None
+        assert len(man.import_hook.miss_cache) == 0
+
+    def test_global_filter(self):
+        from astkit.processor import ModuleFilter
+        man = self._make_one()
+        man.add_processor(RecordingProcessor())
+        man.module_filter = ModuleFilter(include=['pond'])
+        assert man.wants('pond.frog')
+        assert man.wants('pond.frog', '/pond/frog.py')
+        assert not man.wants('lake.frog')
+
+    def test_path_rules_are_checked_once_module_is_found(self):
+        import astkit
+        from astkit.processor import ModuleFilter
+        man = self._make_one()
+        man.add_processor(RecordingProcessor())
+        man.module_filter = ModuleFilter(
+            exclude=[os.path.join(astkit.__path__[0], 'test')])
+        path = os.path.join(astkit.__path__[0], 'test', 'modules')
+        assert man.wants('astkit.test.modules.one')
+        assert man.import_hook.find_spec('astkit.test.modules.one',
+                                         [path]) is None
+
+
 class Test_ModuleLoader(object):
 
     def _make_one(self, fullpath):
@@ -82,3 +392,249 @@ class Test_ModuleLoader(object):
         simple = loader.load_module(fullname)
         assert fullname in sys.modules
         del sys.modules[fullname]
+
+
+class TestProcessedSourceLogging(object):
+    
+    def setup(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+    
+    def teardown(self):
+        import shutil
+        from astkit.processor import dump_processed_source
+        dump_processed_source(None)
+        shutil.rmtree(self.directory)
+        sys.modules.pop('astkit.test.samples.aliases', None)
+    
+    setup_method = setup
+    teardown_method = teardown
+    
+    def _load(self, fullname, filename):
+        from astkit.processor import _ModuleLoader
+        fullpath = os.path.join(os.path.dirname(__file__),
+                                'samples', filename)
+        return _ModuleLoader(fullpath).load_module(fullname)
+    
+    def test_no_rendering_when_debug_logging_is_disabled(self):
+        from astkit import processor
+        calls = []
+        class RecordingRenderer(processor.SourceCodeRenderer):
+            @classmethod
+            def render(cls, *args, **kwargs):
+                calls.append(args)
+        logger = logging.getLogger('astkit.processor')
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        processor.SourceCodeRenderer = RecordingRenderer
+        try:
+            self._load('astkit.test.samples.aliases', 'aliases.py')
+        finally:
+            processor.SourceCodeRenderer = RecordingRenderer.__bases__[0]
+            logger.setLevel(level)
+        assert calls == []
+    
+    def test_dump_processed_source(self):
+        from astkit.processor import dump_processed_source
+        dump_directory = os.path.join(self.directory, 'dump')
+        dump_processed_source(dump_directory)
+        module = self._load('astkit.test.samples.aliases', 'aliases.py')
+        assert module.path is os.path
+        path = os.path.join(dump_directory, 'astkit.test.samples.aliases.py')
+        with open(path) as f:
+            assert f.read() == "import os\npath = os.path\n"
+
+
+class SlowCountingProcessor(object):
+    """ Take long enough over each module for other threads to catch up """
+
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.names = []
+
+    def process(self, tree):
+        import time
+        time.sleep(0.02)
+        with self.lock:
+            self.names.append(tree)
+        return tree
+
+
+class TestConcurrentImports(object):
+
+    names = ['bullfrog', 'treefrog', 'spadefoot', 'natterjack', 'midwife']
+
+    def setup(self):
+        import tempfile
+        from astkit.processor import _ProcessorManager
+        self.directory = tempfile.mkdtemp()
+        for name in self.names:
+            with open(os.path.join(self.directory, name + '.py'), 'w') as f:
+                f.write("import time\ntime.sleep(0.01)\nready = True\n")
+        self.processor = SlowCountingProcessor()
+        self.manager = _ProcessorManager()
+        self.manager.add_processor(self.processor)
+        sys.path.insert(0, self.directory)
+
+    def teardown(self):
+        import shutil
+        self.manager._remove_import_hook()
+        sys.path.remove(self.directory)
+        for name in self.names:
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.directory)
+
+    setup_method = setup
+    teardown_method = teardown
+
+    def _run_threads(self, target, count=8):
+        import threading
+        start = threading.Event()
+        results = []
+        errors = []
+        def run(index):
+            start.wait()
+            try:
+                results.append(target(index))
+            except Exception:
+                errors.append(sys.exc_info()[1])
+        threads = [threading.Thread(target=run, args=(index,))
+                   for index in range(count)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        assert errors == [], errors
+        return results
+
+    def test_concurrent_imports_process_module_once(self):
+        import importlib
+        modules = self._run_threads(
+            lambda index: importlib.import_module('bullfrog'))
+        assert len(self.processor.names) == 1
+        assert all(module is modules[0] for module in modules)
+        assert all(module.ready for module in modules)
+
+    def test_concurrent_loads_process_module_once(self):
+        from astkit.processor import _ModuleLoader
+        path = os.path.join(self.directory, 'bullfrog.py')
+        modules = self._run_threads(
+            lambda index: _ModuleLoader(path, self.manager).load_module(
+                'bullfrog'))
+        assert len(self.processor.names) == 1
+        assert all(module is modules[0] for module in modules)
+        assert all(module.ready for module in modules)
+
+    def test_stress(self):
+        import importlib
+        import random
+        def import_all(index):
+            names = list(self.names)
+            random.Random(index).shuffle(names)
+            return [importlib.import_module(name) for name in names]
+        results = self._run_threads(import_all, 16)
+        assert len(self.processor.names) == len(self.names)
+        for modules in results:
+            assert all(module.ready for module in modules)
+            assert all(sys.modules[module.__name__] is module
+                       for module in modules)
+
+    def test_failed_load_is_not_left_in_sys_modules(self):
+        from astkit.processor import _ModuleLoader
+        path = os.path.join(self.directory, 'bullfrog.py')
+        with open(path, 'w') as f:
+            f.write("raise ValueError('croak')\n")
+        try:
+            _ModuleLoader(path, self.manager).load_module('bullfrog')
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError"
+        assert 'bullfrog' not in sys.modules
+
+    def test_load_during_execution_is_not_a_reload(self):
+        import threading
+        import time
+        from astkit.processor import _ModuleLoader
+        sync = types.ModuleType('frogsync')
+        sync.started = threading.Event()
+        sync.proceed = threading.Event()
+        sys.modules['frogsync'] = sync
+        path = os.path.join(self.directory, 'bullfrog.py')
+        with open(path, 'w') as f:
+            f.write("import frogsync\n"
+                    "frogsync.started.set()\n"
+                    "frogsync.proceed.wait(5)\n"
+                    "ready = True\n")
+        modules = []
+        def load():
+            loader = _ModuleLoader(path, self.manager)
+            modules.append(loader.load_module('bullfrog'))
+        try:
+            first = threading.Thread(target=load)
+            first.start()
+            assert sync.started.wait(5)
+            # the second load finds the module while it is still executing
+            second = threading.Thread(target=load)
+            second.start()
+            time.sleep(0.1)
+            sync.proceed.set()
+            first.join()
+            second.join()
+        finally:
+            sys.modules.pop('frogsync', None)
+        assert len(self.processor.names) == 1
+        assert len(modules) == 2 and modules[0] is modules[1]
+        assert modules[0].ready
+
+    def test_load_during_import_is_not_a_reload(self):
+        import importlib
+        import threading
+        import time
+        sync = types.ModuleType('frogsync')
+        sync.started = threading.Event()
+        sync.proceed = threading.Event()
+        sync.count = 0
+        sys.modules['frogsync'] = sync
+        path = os.path.join(self.directory, 'bullfrog.py')
+        with open(path, 'w') as f:
+            f.write("import frogsync\n"
+                    "frogsync.count += 1\n"
+                    "frogsync.started.set()\n"
+                    "frogsync.proceed.wait(5)\n"
+                    "ready = True\n")
+        modules = []
+        def load():
+            module = sys.modules['bullfrog']
+            modules.append(module.__loader__.load_module('bullfrog'))
+        try:
+            first = threading.Thread(
+                target=lambda: modules.append(
+                    importlib.import_module('bullfrog')))
+            first.start()
+            assert sync.started.wait(5)
+            # the load waits for the import, which is still executing
+            second = threading.Thread(target=load)
+            second.start()
+            time.sleep(0.1)
+            sync.proceed.set()
+            first.join()
+            second.join()
+        finally:
+            sys.modules.pop('frogsync', None)
+        assert sync.count == 1
+        assert len(self.processor.names) == 1
+        assert len(modules) == 2 and modules[0] is modules[1]
+        assert modules[0].ready
+
+    def test_load_of_loaded_module_reloads_it(self):
+        from astkit.processor import _ModuleLoader
+        path = os.path.join(self.directory, 'bullfrog.py')
+        loader = _ModuleLoader(path, self.manager)
+        module = loader.load_module('bullfrog')
+        module.ready = False
+        assert loader.load_module('bullfrog') is module
+        assert module.ready
+        assert len(self.processor.names) == 2
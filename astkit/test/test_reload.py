@@ -0,0 +1,129 @@
+import os
+import shutil
+import sys
+import tempfile
+
+
+class RecordingProcessor(object):
+    
+    def __init__(self):
+        self.bodies = []
+    
+    def process(self, tree):
+        self.bodies.append(len(tree.body))
+        return tree
+
+
+original = """\
+import time
+
+calls = []
+calls.append(time)
+
+def croak(times=1):
+    return 'croak' * times
+
+class Frog(object):
+    def jump(self):
+        return 'jump'
+    def swim(self):
+        return 'swim'
+"""
+
+
+class TestHotReload(object):
+    
+    def setup(self):
+        from astkit.processor import _ProcessorManager
+        from astkit.reload import enable_hot_reload
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bullfrog.py')
+        self._write(original)
+        self.processor = RecordingProcessor()
+        self.manager = _ProcessorManager()
+        self.manager.add_processor(self.processor)
+        enable_hot_reload(self.manager)
+        sys.path.insert(0, self.directory)
+        import bullfrog
+        self.module = bullfrog
+    
+    def teardown(self):
+        self.manager._remove_import_hook()
+        sys.path.remove(self.directory)
+        sys.modules.pop('bullfrog', None)
+        shutil.rmtree(self.directory)
+    
+    setup_method = setup
+    teardown_method = teardown
+    
+    def _write(self, source):
+        with open(self.path, 'w') as f:
+            f.write(source)
+    
+    def _reload(self, source):
+        from astkit.reload import reload
+        self._write(source)
+        return reload(self.module)
+    
+    def test_unchanged_module(self):
+        result = self._reload(original)
+        assert result == {'changed': 0, 'unchanged': 5, 'patched': [],
+                          'full': False}
+        assert self.processor.bodies == [5]
+    
+    def test_changed_function_is_patched_in_place(self):
+        croak = self.module.croak
+        result = self._reload(original.replace("'croak' * times",
+                                               "'ribbit' * times"))
+        assert result['changed'] == 1
+        assert result['patched'] == ['croak']
+        assert self.module.croak is croak
+        assert croak(2) == 'ribbitribbit'
+        # only the changed definition was processed again
+        assert self.processor.bodies == [5, 1]
+    
+    def test_unchanged_statements_are_not_executed(self):
+        calls = self.module.calls
+        self._reload(original.replace("times=1", "times=2"))
+        assert self.module.calls is calls
+        assert len(calls) == 1
+        assert self.module.croak() == 'croakcroak'
+    
+    def test_changed_class_is_patched_in_place(self):
+        frog = self.module.Frog()
+        Frog = self.module.Frog
+        result = self._reload(original.replace("return 'jump'",
+                                               "return 'leap'") +
+                              "    def hop(self):\n        return 'hop'\n")
+        assert result['patched'] == ['Frog']
+        assert self.module.Frog is Frog
+        assert frog.jump() == 'leap'
+        assert frog.hop() == 'hop'
+        assert frog.swim() == 'swim'
+    
+    def test_moved_statements_are_unchanged(self):
+        moved = original.replace("import time\n", "") + "import time\n"
+        result = self._reload("\n\n" + moved)
+        assert result['changed'] == 0
+    
+    def test_new_and_changed_statements_run_in_order(self):
+        result = self._reload(original + "\ncalls.append(croak())\n"
+                              "newt = len(calls)\n")
+        assert result['changed'] == 2
+        assert self.module.calls[-1] == 'croak'
+        assert self.module.newt == 2
+    
+    def test_decorated_functions_are_rebound(self):
+        source = original.replace("def croak", "@staticmethod\ndef croak")
+        self._reload(source)
+        assert isinstance(self.module.croak, staticmethod)
+    
+    def test_full_reload_without_recorded_source(self):
+        from astkit.reload import reload
+        self.manager.reload_sources.clear()
+        self._write(original.replace("'croak' * times", "'ribbit' * times"))
+        croak = self.module.croak
+        result = reload(self.module)
+        assert result['full']
+        assert self.module.croak is not croak
+        assert self.module.croak() == 'ribbit'
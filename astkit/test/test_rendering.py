@@ -38,20 +38,20 @@ class RoundtripTestCase(object):
 class TestRendering(RoundtripTestCase):
     
     roundtrips = ["""
-if (length == 5):
+if length == 5:
     printf('five')
 """,
                   """
-if (length == 5):
+if length == 5:
     printf('five')
 else:
     printf('17')
 """,
                   """
-if (length == 5):
+if length == 5:
     printf('five')
 else:
-    if (length == 4):
+    if length == 4:
         printf('four')
     else:
         printf('17')
@@ -64,18 +64,18 @@ def func(a, b, c='c', *stargs, **kwargs):
 
     def test_elif(self):
         initial = """
-if (length == 5):
+if length == 5:
     printf('five')
-elif (length == 4):
+elif length == 4:
     printf('four')
 else:
     printf('17')
 """.lstrip()
         expected = """
-if (length == 5):
+if length == 5:
     printf('five')
 else:
-    if (length == 4):
+    if length == 4:
         printf('four')
     else:
         printf('17')
@@ -272,7 +272,7 @@ class TestStatementRendering(NodeRenderingTestCase):
                                         op=ast.NotEq(),
                                         right=ast.Num(n=7)),
                          msg=ast.Str(s="Let's hope this assert is true")),
-              "assert (5 != 7), \"Let's hope this assert is true\"\n"),
+              "assert 5 != 7, \"Let's hope this assert is true\"\n"),
 
              (ast.Assign(targets=[ast.Name(id="frog"),
                                      ast.Name(id="toad")],
@@ -366,7 +366,7 @@ class TestStatementRendering(NodeRenderingTestCase):
                                           comparators=[ast.Str(s="Summer")]),
                          body=a_body,
                          orelse=an_else),
-               ("while (season == 'Summer'):\n"
+               ("while season == 'Summer':\n"
                 "    result = 'No class'\n"
                 "    return result\n"
                 "else:\n"
@@ -414,17 +414,17 @@ if sys.version_info[:2] >= (2, 7):
                           generators=standard_comprehensions),
              ("{yolk: yolk.radius\n"
               "  for egg in dozen\n"
-              "  if (egg != 'rotten')\n"
+              "  if egg != 'rotten'\n"
               "  for yolk in egg.yolks\n"
-              "  if (yolk == 'yellow')")),
+              "  if yolk == 'yellow'")),
             
              (ast.SetComp(elt=ast.Name(id="frog"),
                           generators=standard_comprehensions),
               ("{ frog\n"
                "  for egg in dozen\n"
-               "  if (egg != 'rotten')\n"
+               "  if egg != 'rotten'\n"
                "  for yolk in egg.yolks\n"
-               "  if (yolk == 'yellow') }")),
+               "  if yolk == 'yellow' }")),
 
             (ast.Set(elts=[ast.Num(n=1),
                            ast.Num(n=2),
@@ -453,7 +453,7 @@ class TestExpressionRendering(NodeRenderingTestCase):
               "'frog'.length"),
 
              (ast.BinOp(left=ast.Str(s="frog"), op=ast.Add(), right=ast.Str(s="io")),
-              "('frog' + 'io')"),
+              "'frog' + 'io'"),
 
              (ast.BitOr(),
               '|'),
@@ -466,7 +466,7 @@ class TestExpressionRendering(NodeRenderingTestCase):
                                                ast.Name(id="c"),
                                                ]
                          ),
-              "(a and b and c)"),
+              "a and b and c"),
              
               (ast.Call(func=ast.Name(id="funcy"),
                         args=[ast.Name(id="a"), ast.Name(id="b")],
@@ -479,7 +479,7 @@ class TestExpressionRendering(NodeRenderingTestCase):
                           ops=[ast.Eq(), ast.NotEq()],
                           comparators=[ast.Name(id="toad"),
                                        ast.Str(s="friends")]),
-              "(frog == toad != 'friends')"),
+              "frog == toad != 'friends'"),
 
              (ast.Dict(keys=[ast.Str(s="frog"), ast.Name(id="toad")],
                        values=[ast.Name(id="friends"), ast.Str(s="enemies")]),
@@ -507,9 +507,9 @@ class TestExpressionRendering(NodeRenderingTestCase):
                                generators=standard_comprehensions),
               ("( frog\n"
                "  for egg in dozen\n"
-               "  if (egg != 'rotten')\n"
+               "  if egg != 'rotten'\n"
                "  for yolk in egg.yolks\n"
-               "  if (yolk == 'yellow') )")),
+               "  if yolk == 'yellow' )")),
              
              (ast.Gt(), ">"),
 
@@ -520,7 +520,7 @@ class TestExpressionRendering(NodeRenderingTestCase):
                                          comparators=[ast.Str(s="McQueen")]),
                         body=ast.Str(s="Steve"),
                         orelse=ast.Str(s="Stew")),
-              "( 'Steve' if (lastname == 'McQueen') else 'Stew' )"),
+              "'Steve' if lastname == 'McQueen' else 'Stew'"),
 
              (ast.In(), "in"),
 
@@ -529,7 +529,7 @@ class TestExpressionRendering(NodeRenderingTestCase):
              (ast.Index(value=ast.BinOp(left=ast.Num(n=4),
                                         op=ast.Add(),
                                         right=ast.Num(n=5))),
-              "(4 + 5)"),
+              "4 + 5"),
 
              (ast.Is(), "is"),
 
@@ -541,7 +541,7 @@ class TestExpressionRendering(NodeRenderingTestCase):
              (ast.Lambda(args=["x"], body=ast.BinOp(left=ast.Name(id="x"),
                                                     op=ast.Pow(),
                                                     right=ast.Num(n=2))),
-              "lambda x: (x ** 2)"),
+              "lambda x: x ** 2"),
 
              (ast.List(elts=[ast.Name(id="a"), ast.Str(s="b"), ast.Num(n=4)]),
               "[a, 'b', 4]"),
@@ -550,9 +550,9 @@ class TestExpressionRendering(NodeRenderingTestCase):
                            generators=standard_comprehensions),
               ("[ frog\n"
                "  for egg in dozen\n"
-               "  if (egg != 'rotten')\n"
+               "  if egg != 'rotten'\n"
                "  for yolk in egg.yolks\n"
-               "  if (yolk == 'yellow') ]")),
+               "  if yolk == 'yellow' ]")),
 
              (ast.Lt(), '<'),
 
@@ -592,10 +592,10 @@ class TestExpressionRendering(NodeRenderingTestCase):
               'eggs[12]'),
              
              (ast.Tuple(elts=[ast.Name(id="a"), ast.Str(s="b"), ast.Num(n=4)]),
-              "(a, 'b', 4, )"),
+              "(a, 'b', 4)"),
 
              (ast.UnaryOp(op=ast.USub(), operand=ast.Num(n=42)),
-              "- 42"),
+              "-42"),
 
              (ast.USub(), '-'),
 
@@ -624,3 +624,375 @@ class TestStatementRenderingWithNonDefaultIndentation(NodeRenderingTestCase):
                "  result = 'No class'\n"
                "  return result\n")),
              ]
+
+class TestDispatchTable(object):
+    
+    def test_subclass_overrides_are_dispatched(self):
+        class ShoutingRenderer(astkit.render.SourceCodeRenderer):
+            def render_Name(self, node):
+                return node.id.upper()
+        node = ast.Attribute(value=ast.Name(id="frog"), attr="length")
+        assert "frog.length" == render_expr(node)
+        assert "FROG.length" == ShoutingRenderer.render(node)
+        assert "frog.length" == render_expr(node)
+    
+    def test_missing_render_method_raises(self):
+        class Unrenderable(ast.AST):
+            pass
+        try:
+            render_expr(Unrenderable())
+        except AttributeError:
+            pass
+        else:
+            assert False, "expected an AttributeError"
+
+class TestStreamingRendering(object):
+    
+    source = """
+def frog(a, b):
+    if a:
+        return b
+    else:
+        return a
+toad = frog
+""".lstrip()
+    
+    def test_render_to_matches_render(self):
+        import io
+        tree = ast.parse(self.source)
+        fp = io.StringIO()
+        astkit.render.SourceCodeRenderer.render_to(tree, fp)
+        assert render_stmt(tree) == fp.getvalue()
+    
+    def test_render_to_expression(self):
+        import io
+        fp = io.StringIO()
+        node = ast.Attribute(value=ast.Name(id="frog"), attr="length")
+        astkit.render.SourceCodeRenderer.render_to(node, fp)
+        assert "frog.length" == fp.getvalue()
+    
+    def test_iter_render_matches_render(self):
+        tree = ast.parse(self.source)
+        lines = list(astkit.render.SourceCodeRenderer.iter_render(tree))
+        assert render_stmt(tree) == ''.join(lines)
+        assert all(line.endswith("\n") for line in lines)
+    
+    def test_iter_render_is_lazy(self):
+        rendered = []
+        class RecordingRenderer(astkit.render.SourceCodeRenderer):
+            def render_Assign(self, node):
+                rendered.append(node)
+                super(RecordingRenderer, self).render_Assign(node)
+        tree = ast.parse("frog = toad\ntoad = frog\n")
+        lines = RecordingRenderer.iter_render(tree)
+        assert "frog = toad\n" == next(lines)
+        assert 1 == len(rendered)
+        assert ["toad = frog\n"] == list(lines)
+        assert 2 == len(rendered)
+
+class StackRenderer(astkit.render.SourceCodeRenderer):
+    """ Renders every node through the explicit-stack engine """
+    _max_depth = 0
+
+class Unrenderable(ast.AST):
+    pass
+
+class TestExplicitStackRendering(object):
+    
+    def _assert_same_rendering(self, node, indentation=4):
+        try:
+            expected = render_stmt(node, indentation)
+        except Exception as exc:
+            try:
+                StackRenderer.render(node, indentation)
+            except Exception as stack_exc:
+                assert type(exc) == type(stack_exc), (exc, stack_exc)
+            else:
+                assert False, "expected %r" % exc
+        else:
+            assert expected == StackRenderer.render(node, indentation)
+    
+    def test_matches_recursive_rendering(self):
+        for case in list(globals().values()):
+            if isinstance(case, type) and \
+                    issubclass(case, NodeRenderingTestCase):
+                for node, _ in case.nodes:
+                    self._assert_same_rendering(node)
+        self._assert_same_rendering(
+            ast.parse(TestStreamingRendering.source), 2)
+    
+    def test_unused_unrenderable_child_is_ignored(self):
+        node = ast.FunctionDef(decorator_list=[],
+                               name="frog",
+                               args=ast.arguments(args=[],
+                                                  defaults=[],
+                                                  vararg=Unrenderable(),
+                                                  kwarg=None),
+                               body=[ast.Pass()])
+        self._assert_same_rendering(node)
+    
+    def test_unrenderable_child_raises(self):
+        node = ast.BinOp(left=Unrenderable(),
+                         op=ast.Add(),
+                         right=ast.Name(id="b"))
+        try:
+            StackRenderer.render(node)
+        except AttributeError:
+            pass
+        else:
+            assert False, "expected an AttributeError"
+    
+    def test_deep_expression(self):
+        depth = 100000
+        node = ast.Name(id="a")
+        for _ in range(depth):
+            node = ast.BinOp(left=node, op=ast.Add(), right=ast.Name(id="b"))
+        source = render_expr(node)
+        assert len(source) == 1 + 4 * depth
+        assert source.startswith("a + b + b")
+        assert source.endswith(" + b + b")
+    
+    def test_deep_statements(self):
+        depth = 2000
+        body = [ast.Pass()]
+        for _ in range(depth):
+            body = [ast.If(test=ast.Name(id="frog"), body=body, orelse=[])]
+        lines = render_stmt(ast.Module(body=body), 1).splitlines()
+        assert len(lines) == depth + 1
+        assert lines[0] == "if frog:"
+        assert lines[-2] == " " * (depth - 1) + "if frog:"
+        assert lines[-1] == " " * depth + "pass"
+
+class TestRenderCache(object):
+    
+    source = """
+def frog(a):
+    return a
+def toad(b):
+    if b:
+        return frog(b)
+    return b
+newt = toad
+""".lstrip()
+    
+    def _make_renderer(self):
+        rendered = []
+        class RecordingRenderer(astkit.render.SourceCodeRenderer):
+            def _render_cached(self, node):
+                if self._cache.lookup(node) is None:
+                    rendered.append(node)
+                return super(RecordingRenderer, self)._render_cached(node)
+        return RecordingRenderer, rendered
+    
+    def test_cached_rendering_matches_render(self):
+        tree = ast.parse(self.source)
+        cache = astkit.render.RenderCache()
+        expected = render_stmt(tree)
+        assert expected == render_stmt(tree, cache=cache)
+        assert expected == render_stmt(tree, cache=cache)
+    
+    def test_unchanged_tree_is_not_rerendered(self):
+        renderer, rendered = self._make_renderer()
+        tree = ast.parse(self.source)
+        cache = astkit.render.RenderCache()
+        renderer.render(tree, cache=cache)
+        del rendered[:]
+        assert render_stmt(tree) == renderer.render(tree, cache=cache)
+        assert [] == rendered
+    
+    def test_invalidate_rerenders_path_to_root(self):
+        renderer, rendered = self._make_renderer()
+        tree = ast.parse(self.source)
+        cache = astkit.render.RenderCache()
+        renderer.render(tree, cache=cache)
+        del rendered[:]
+        
+        toad = tree.body[1]
+        call = toad.body[0].body[0].value
+        call.func.id = "newt"
+        cache.invalidate(call.func)
+        
+        assert render_stmt(tree) == renderer.render(tree, cache=cache)
+        assert "return newt(b)" in render_stmt(tree)
+        assert [tree, toad, toad.body[0], toad.body[0].body[0]] == rendered
+    
+    def test_replaced_statement_is_noticed(self):
+        renderer, rendered = self._make_renderer()
+        tree = ast.parse(self.source)
+        cache = astkit.render.RenderCache()
+        renderer.render(tree, cache=cache)
+        del rendered[:]
+        
+        newt = ast.parse("newt = frog").body[0]
+        tree.body[2] = newt
+        
+        assert render_stmt(tree) == renderer.render(tree, cache=cache)
+        assert [tree, newt] == rendered
+    
+    def test_replaced_statement_is_forgotten(self):
+        import gc
+        tree = ast.parse(self.source)
+        cache = astkit.render.RenderCache()
+        render_stmt(tree, cache=cache)
+        entries = len(cache._entries)
+        
+        tree.body[2] = ast.parse("newt = frog").body[0]
+        render_stmt(tree, cache=cache)
+        gc.collect()
+        assert entries == len(cache._entries)
+    
+    def test_indentation_change_clears_cache(self):
+        tree = ast.parse(self.source)
+        cache = astkit.render.RenderCache()
+        render_stmt(tree, cache=cache)
+        assert render_stmt(tree, 2) == render_stmt(tree, 2, cache=cache)
+
+if sys.version_info[:2] >= (3, 8):
+    class TestSpliceRendering(object):
+        
+        source = """
+# frogs and toads
+
+def frog(a):
+    # a frog is a frog
+    return a  # always
+
+
+def toad(b):
+    return b
+
+newt = toad
+""".lstrip()
+        
+        def _render(self, tree):
+            return astkit.render.SpliceRenderer.render(tree, self.source)
+        
+        def test_unchanged_source_is_copied(self):
+            tree = ast.parse(self.source)
+            assert self.source == self._render(tree)
+        
+        def test_changed_statement_is_rendered(self):
+            tree = ast.parse(self.source)
+            toad = tree.body[1]
+            toad.body[0].value.id = "frog"
+            expected = self.source.replace("return b", "return frog")
+            assert expected == self._render(tree)
+        
+        def test_changed_function_body_keeps_untouched_statements(self):
+            tree = ast.parse(self.source)
+            frog = tree.body[0]
+            frog.args.args[0].arg = "egg"
+            frog.body[0].value.id = "egg"
+            expected = """
+# frogs and toads
+
+def frog(egg):
+    # a frog is a frog
+    return egg
+
+
+def toad(b):
+    return b
+
+newt = toad
+""".lstrip()
+            assert expected == self._render(tree)
+        
+        def test_filler_kept_in_deeply_nested_blocks(self):
+            depth = astkit.render.MAX_RECURSION_DEPTH + 10
+            lines = []
+            for level in range(depth):
+                lines.append("    " * level + "if frog%d:" % level)
+                lines.append("")
+                lines.append("    " * (level + 1) + "# toad %d" % level)
+            lines.append("    " * depth + "newt = a")
+            source = "\n".join(lines) + "\n"
+            tree = ast.parse(source)
+            innermost = tree
+            for level in range(depth):
+                innermost = innermost.body[0]
+            innermost.body[0].value.id = "b"
+            expected = source.replace("newt = a", "newt = b")
+            assert expected == \
+                astkit.render.SpliceRenderer.render(tree, source)
+        
+        def test_inserted_statement_is_rendered(self):
+            tree = ast.parse(self.source)
+            tree.body.insert(2, ast.parse("tadpole = frog").body[0])
+            expected = self.source.replace("return b\n",
+                                           "return b\ntadpole = frog\n")
+            assert expected == self._render(tree)
+
+class TestMinimalParentheses(object):
+    
+    minimal = [
+        "a + b * c",
+        "(a + b) * c",
+        "a - b - c",
+        "a - (b - c)",
+        "a ** b ** c",
+        "(a ** b) ** c",
+        "(-a) ** b",
+        "-a ** b",
+        "a ** -b",
+        "-(a + b)",
+        "~a + b",
+        "not a == b",
+        "not (a and b)",
+        "a and b or c",
+        "a and (b or c)",
+        "(a and b) and c",
+        "a < b < c",
+        "(a < b) < c",
+        "a | b ^ c & d",
+        "(a | b) & c",
+        "a << b + c",
+        "(a << b) + c",
+        "a if b else c",
+        "(a if b else c) if d else e",
+        "a if b else c if d else e",
+        "a if (b if c else d) else e",
+        "lambda x: a if b else c",
+        "(lambda x: a)(b)",
+        "(a or b)(c)",
+        "(a + b).c",
+        "(a + b)[c]",
+        "a[b:c]",
+        "f(a, b=c + d)",
+        "f(*(a or b))",
+        "[a + b, (c, d), (e,)]",
+        "f((yield a))",
+        ]
+    
+    redundant = [
+        ("((a + b))", "a + b"),
+        ("(a * b) + c", "a * b + c"),
+        ("a + (b * c)", "a + b * c"),
+        ("(not a) or (b and c)", "not a or b and c"),
+        ("f((a))", "f(a)"),
+        ]
+    
+    def _render(self, source):
+        return render_expr(ast.parse(source, mode='eval').body)
+    
+    def _assert_same_tree(self, source, rendered):
+        assert ast.dump(ast.parse(source, mode='eval')) == \
+            ast.dump(ast.parse(rendered, mode='eval')), (source, rendered)
+    
+    def test_minimal_parentheses_are_kept(self):
+        for source in self.minimal:
+            rendered = self._render(source)
+            self._assert_same_tree(source, rendered)
+            assert source == rendered, (source, rendered)
+    
+    def test_redundant_parentheses_are_dropped(self):
+        for source, expected in self.redundant:
+            rendered = self._render(source)
+            self._assert_same_tree(source, rendered)
+            assert expected == rendered, (expected, rendered)
+    
+    def test_statement_roundtrip(self):
+        source = "if a and not b:\n    c = d * (e + f)\n"
+        tree = ast.parse(source)
+        assert source == render_stmt(tree)
+        assert ast.dump(tree) == ast.dump(ast.parse(render_stmt(tree)))
@@ -0,0 +1,123 @@
+from astkit.compat import ast
+from astkit.selector import Selector, compile_selector, select
+
+SOURCE = """
+import os
+
+@decorated
+def outer(path):
+    handle = open(path)
+    def inner():
+        return open(path).read()
+    return os.path.join(path, handle.name)
+
+class Thing(object):
+    def method(self, count=3):
+        open('thing')
+
+open('top')
+"""
+
+
+class TestSelector(object):
+
+    def _lines(self, text):
+        return [(node.__class__.__name__, node.lineno)
+                for node in select(text, ast.parse(SOURCE))]
+
+    def test_type(self):
+        assert self._lines('ClassDef') == [('ClassDef', 11)]
+
+    def test_abstract_type(self):
+        tree = ast.parse(SOURCE)
+        statements = list(select('stmt', tree))
+        assert len(statements) == len([node for node in ast.walk(tree)
+                                       if isinstance(node, ast.stmt)])
+        assert all(isinstance(node, ast.stmt) for node in statements)
+
+    def test_any(self):
+        tree = ast.parse(SOURCE)
+        assert len(list(select('*', tree))) == len(list(ast.walk(tree)))
+
+    def test_condition(self):
+        assert self._lines('Call[func.id=open]') == [('Call', 6), ('Call', 8),
+                                                     ('Call', 13),
+                                                     ('Call', 15)]
+
+    def test_condition_operators(self):
+        assert self._lines('Attribute[attr^=jo]') == [('Attribute', 9)]
+        assert self._lines('Attribute[attr$=ad]') == [('Attribute', 8)]
+        assert self._lines('Attribute[attr*=oi]') == [('Attribute', 9)]
+        assert self._lines('FunctionDef[name!=outer]') == [
+            ('FunctionDef', 7), ('FunctionDef', 12)]
+
+    def test_condition_presence(self):
+        assert self._lines('FunctionDef[decorator_list]') == [
+            ('FunctionDef', 5)]
+        assert self._lines('FunctionDef[returns]') == []
+
+    def test_condition_values(self):
+        assert self._lines('stmt[lineno=13]') == [('Expr', 13)]
+        assert self._lines('Name[id="path"]') == self._lines('Name[id=path]')
+        assert self._lines('FunctionDef[returns=None]') == [
+            ('FunctionDef', 5), ('FunctionDef', 7), ('FunctionDef', 12)]
+
+    def test_descendant(self):
+        assert self._lines('FunctionDef Call[func.id=open]') == [
+            ('Call', 6), ('Call', 8), ('Call', 13)]
+        assert self._lines('FunctionDef FunctionDef') == [('FunctionDef', 7)]
+
+    def test_child(self):
+        assert self._lines('ClassDef > FunctionDef') == [('FunctionDef', 12)]
+        assert self._lines('Module > FunctionDef') == [('FunctionDef', 5)]
+        assert self._lines('Return > Call') == [('Call', 8), ('Call', 9)]
+
+    def test_field(self):
+        assert self._lines('FunctionDef > body Call[func.id=open]') == [
+            ('Call', 6), ('Call', 8), ('Call', 13)]
+        assert self._lines('FunctionDef > decorator_list') == [('Name', 4)]
+        assert self._lines('Call > args > Name') == [('Name', 6), ('Name', 8),
+                                                     ('Name', 9)]
+        assert self._lines('Assign > targets') == [('Name', 6)]
+
+    def test_field_at_start(self):
+        assert self._lines('decorator_list Name') == [('Name', 4)]
+
+    def test_group(self):
+        assert self._lines('Import, ClassDef') == [('Import', 2),
+                                                   ('ClassDef', 11)]
+
+    def test_group_yields_once(self):
+        assert self._lines('ClassDef, stmt[name=Thing]') == [('ClassDef', 11)]
+
+    def test_lazy(self):
+        tree = ast.parse(SOURCE)
+        results = select('Call', tree)
+        assert next(results).lineno == 6
+
+    def test_first(self):
+        tree = ast.parse(SOURCE)
+        assert compile_selector('Return').first(tree).lineno == 8
+        assert compile_selector('While').first(tree) is None
+
+    def test_compile_selector_is_cached(self):
+        assert compile_selector('Call') is compile_selector('Call')
+        assert isinstance(compile_selector('Call'), Selector)
+
+    def test_matches_reused_on_other_trees(self):
+        tree = ast.parse(SOURCE)
+        compiled = compile_selector('Call[func.id=open]')
+        assert len(list(compiled.select(tree))) == 4
+        other = ast.parse("open('a')\nclose('b')\n")
+        assert len(list(compiled.select(other))) == 1
+
+    def test_invalid(self):
+        for text in ['', '> Call', 'Call >', 'Call >> Name', 'Call,',
+                     'Nope', 'body[x=1]', 'Call[', 'Call[x]Name',
+                     'Call[func.id~=x]']:
+            try:
+                Selector(text)
+            except ValueError:
+                pass
+            else:
+                assert False, "%r should be invalid" % (text,)
@@ -0,0 +1,173 @@
+import os
+import shutil
+import sys
+import tempfile
+
+
+class IdentityProcessor(object):
+    
+    def process(self, tree):
+        return tree
+
+
+class TestImportStats(object):
+    
+    def _make_one(self):
+        from astkit.stats import ImportStats
+        return ImportStats()
+    
+    def test_phases_accumulate(self):
+        stats = self._make_one()
+        stats.record('frog', 'parse', 0.25)
+        stats.record('frog', 'compile', 0.5)
+        stats.record('frog', 'parse', 0.25)
+        assert list(stats.phases('frog').items()) == [('parse', 0.5),
+                                                      ('compile', 0.5)]
+        assert stats.self_time('frog') == 1.0
+        assert stats.modules() == ['frog']
+    
+    def test_nested_imports_are_charged_to_importer(self):
+        stats = self._make_one()
+        stats.record('frog', 'parse', 1.0)
+        stats.begin_exec('frog')
+        stats.record('toad', 'parse', 2.0)
+        stats.begin_exec('toad')
+        stats.record('newt', 'parse', 4.0)
+        stats.record_miss(8.0)
+        stats.end_exec('toad', 13.0)
+        stats.end_exec('frog', 32.0)
+        assert stats.phases('toad')['exec'] == 1.0
+        assert stats.cumulative_time('toad') == 15.0
+        assert stats.phases('frog')['exec'] == 17.0
+        assert stats.cumulative_time('frog') == 33.0
+        assert stats.self_time('newt') == 4.0
+        assert stats.misses == 1
+    
+    def test_totals(self):
+        stats = self._make_one()
+        stats.record('frog', 'parse', 1.0)
+        stats.record('toad', 'parse', 2.0)
+        stats.record('toad', 'exec', 4.0)
+        assert stats.totals() == {'parse': 3.0, 'exec': 4.0}
+    
+    def test_report_is_sorted(self):
+        stats = self._make_one()
+        stats.record('frog', 'parse', 0.001)
+        stats.record('toad', 'parse', 0.002)
+        lines = stats.report().splitlines()
+        assert lines[1].endswith('toad (parse 2.00)')
+        assert lines[2].endswith('frog (parse 1.00)')
+        assert len(stats.report(limit=1).splitlines()) == 4
+
+
+class TestImportHookStats(object):
+    
+    def setup(self):
+        from astkit.processor import _ProcessorManager
+        from astkit.stats import ImportStats
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'spawn.py'), 'w') as f:
+            f.write('import polliwog\n')
+        with open(os.path.join(self.directory, 'polliwog.py'), 'w') as f:
+            f.write('tail = True\n')
+        self.manager = _ProcessorManager()
+        self.manager.import_stats = ImportStats()
+        self.manager.add_processor(IdentityProcessor())
+        sys.path.insert(0, self.directory)
+    
+    def teardown(self):
+        self.manager._remove_import_hook()
+        sys.path.remove(self.directory)
+        for name in ('spawn', 'polliwog'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.directory)
+    
+    setup_method = setup
+    teardown_method = teardown
+    
+    def test_phases_are_timed(self):
+        import spawn
+        stats = self.manager.import_stats
+        assert stats.modules() == ['spawn', 'polliwog']
+        assert list(stats.phases('polliwog')) == \
+            ['find', 'read', 'parse', 'IdentityProcessor', 'compile', 'exec']
+        assert stats.cumulative_time('spawn') >= \
+            stats.self_time('spawn') + stats.self_time('polliwog')
+    
+    def test_dump(self):
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        import spawn
+        stream = StringIO()
+        self.manager.import_stats.dump(stream)
+        assert 'polliwog' in stream.getvalue()
+
+
+class RenameFrogs(object):
+    """ An ordinary processor """
+    
+    def process(self, tree):
+        from astkit import ast
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id == 'frog':
+                node.id = 'toad'
+        return tree
+
+
+class TestProcessorProfile(object):
+    
+    def _make_manager(self, *processors):
+        from astkit.processor import _ProcessorManager
+        from astkit.stats import ProcessorProfile
+        man = _ProcessorManager()
+        man._install_import_hook = lambda: None
+        for processor in processors:
+            man.add_processor(processor)
+        man.processor_profile = ProcessorProfile()
+        return man
+    
+    def test_ordinary_processors(self):
+        from astkit import ast
+        man = self._make_manager(RenameFrogs(), IdentityProcessor())
+        man.process(ast.parse("frog(newt)\n"), 'pond', '/pond.py')
+        man.process(ast.parse("frog\n"), 'lake', '/lake.py')
+        snapshot = man.processor_profile.snapshot()
+        assert list(snapshot) == ['RenameFrogs', 'IdentityProcessor']
+        # Module, Expr, Call, Name, Load, Name, Load and then
+        # Module, Expr, Name, Load
+        assert snapshot['RenameFrogs']['calls'] == 2
+        assert snapshot['RenameFrogs']['nodes_visited'] == 11
+        assert snapshot['RenameFrogs']['nodes_changed'] == 2
+        assert snapshot['IdentityProcessor']['nodes_changed'] == 0
+    
+    def test_pipeline_processors(self):
+        from astkit import ast
+        from astkit.pipeline import PipelineProcessor
+        class DropPass(PipelineProcessor):
+            def handle_Pass(self, node):
+                return None
+        class Rename(PipelineProcessor):
+            def handle_Name(self, node):
+                node.id = 'toad'
+                return node
+        drop, rename = DropPass(), Rename()
+        man = self._make_manager(drop, rename, Rename())
+        man.process(ast.parse("pass\nfrog\npass\n"), 'pond', '/pond.py')
+        snapshot = man.processor_profile.snapshot()
+        assert snapshot['DropPass']['nodes_visited'] == 2
+        assert snapshot['DropPass']['nodes_changed'] == 2
+        assert snapshot['Rename']['nodes_visited'] == 1
+        assert snapshot['Rename']['nodes_changed'] == 1
+        # the second renamer leaves the name as it found it
+        assert snapshot['Rename (2)']['nodes_changed'] == 0
+    
+    def test_table(self):
+        from astkit import ast
+        man = self._make_manager(RenameFrogs())
+        man.process(ast.parse("frog\n"), 'pond', '/pond.py')
+        lines = man.processor_profile.table().splitlines()
+        assert lines[0].split() == ['processor', 'calls', 'time', '[ms]',
+                                    'visited', 'changed']
+        assert lines[1].split()[0] == 'RenameFrogs'
@@ -0,0 +1,69 @@
+from astkit.compat import ast
+from astkit.util import ASTClassTree, ast_class_tree
+
+
+class TestASTClassTree(object):
+    
+    def test_create(self):
+        tree = ASTClassTree.create()
+        assert list(tree) == [ast.AST]
+        assert ast.stmt in tree[ast.AST]
+        assert ast.FunctionDef in tree[ast.AST][ast.stmt]
+    
+    def test_contains(self):
+        tree = ASTClassTree.create()
+        assert tree.contains(object)
+        assert tree.contains(ast.Name)
+        stmt = tree.find(ast.stmt)
+        assert stmt.contains(ast.stmt)
+        assert stmt.contains(ast.Return)
+        assert not stmt.contains(ast.Name)
+        assert not tree.contains(int)
+    
+    def test_find(self):
+        tree = ASTClassTree.create()
+        expr = tree.find(ast.expr)
+        assert expr._root is ast.expr
+        assert expr.find(ast.Name) is tree.find(ast.Name)
+        assert expr.find(ast.Return) is None
+    
+    def test_ancestors(self):
+        tree = ASTClassTree.create()
+        assert tree.ancestors(ast.Name) == (ast.expr, ast.AST, object)
+        assert tree.ancestors(object) == ()
+    
+    def test_descendants(self):
+        tree = ASTClassTree.create()
+        expressions = tree.descendants(ast.expr)
+        assert ast.Name in expressions
+        assert ast.Call in expressions
+        assert ast.Return not in expressions
+        assert ast.expr not in expressions
+        assert tree.find(ast.expr).descendants() == expressions
+    
+    def test_leaves(self):
+        tree = ASTClassTree.create()
+        leaves = tree.leaves()
+        assert ast.Name in leaves
+        assert ast.expr not in leaves
+        leaves.remove(ast.Name)
+        assert ast.Name in tree.leaves()
+    
+    def test_insert_updates_queries(self):
+        tree = ASTClassTree.create()
+        class Frog(ast.Name):
+            pass
+        class Tadpole(Frog):
+            pass
+        assert ast.Name in tree.leaves()
+        tree.insert(Tadpole)
+        assert tree.ancestors(Tadpole) == (Frog, ast.Name, ast.expr,
+                                           ast.AST, object)
+        assert Tadpole in tree.descendants(ast.expr)
+        assert Tadpole in tree.leaves()
+        assert ast.Name not in tree.leaves()
+        assert tree.find(ast.Name).contains(Tadpole)
+    
+    def test_module_level_tree_is_shared(self):
+        assert ast_class_tree() is ast_class_tree()
+        assert ast_class_tree().contains(ast.Call)
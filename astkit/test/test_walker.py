@@ -0,0 +1,74 @@
+from astkit.compat import ast
+from astkit.walker import child_fields, iter_child_nodes, walk
+
+SOURCE = """
+def f(a, b=1):
+    return a + g(b)
+
+class C(object):
+    x = [y for y in range(3)]
+"""
+
+
+class TestWalker(object):
+
+    def test_child_fields(self):
+        assert child_fields(ast.Name) == ('ctx',)
+        assert 'attr' not in child_fields(ast.Attribute)
+        assert 'value' in child_fields(ast.Attribute)
+        assert child_fields(ast.BinOp) == ast.BinOp._fields
+
+    def test_child_fields_of_new_class(self):
+        class Wrapper(ast.expr):
+            _fields = ('inner', 'label')
+        assert child_fields(Wrapper) == ('inner', 'label')
+        node = Wrapper(inner=ast.Name(id='x', ctx=ast.Load()), label='l')
+        assert [child.__class__ for child in walk(node)] == [Wrapper,
+                                                             ast.Name,
+                                                             ast.Load]
+
+    def test_iter_child_nodes(self):
+        tree = ast.parse(SOURCE)
+        for node in ast.walk(tree):
+            assert list(iter_child_nodes(node)) == \
+                list(ast.iter_child_nodes(node))
+
+    def test_walk_visits_what_ast_walk_visits(self):
+        tree = ast.parse(SOURCE)
+        assert sorted(map(id, walk(tree))) == \
+            sorted(map(id, ast.walk(tree)))
+        assert sorted(map(id, walk(tree, 'post'))) == \
+            sorted(map(id, ast.walk(tree)))
+
+    def test_pre_order(self):
+        tree = ast.parse(SOURCE)
+        function = tree.body[0]
+        names = [node.__class__.__name__ for node in walk(function.body[0])]
+        assert names == ['Return', 'BinOp', 'Name', 'Load', 'Add', 'Call',
+                         'Name', 'Load', 'Name', 'Load']
+
+    def test_post_order(self):
+        tree = ast.parse(SOURCE)
+        function = tree.body[0]
+        names = [node.__class__.__name__
+                 for node in walk(function.body[0], 'post')]
+        assert names == ['Load', 'Name', 'Add', 'Load', 'Name', 'Load',
+                         'Name', 'Call', 'BinOp', 'Return']
+
+    def test_prune(self):
+        tree = ast.parse(SOURCE)
+        is_class = lambda node: isinstance(node, ast.ClassDef)
+        for order in ('pre', 'post'):
+            nodes = list(walk(tree, order, prune=is_class))
+            assert tree.body[1] in nodes
+            assert not any(isinstance(node, ast.ListComp) for node in nodes)
+            assert any(isinstance(node, ast.BinOp) for node in nodes)
+
+    def test_invalid_order(self):
+        tree = ast.parse(SOURCE)
+        try:
+            walk(tree, 'breadth')
+        except ValueError:
+            pass
+        else:
+            assert False, "expected a ValueError"
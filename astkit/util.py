@@ -2,7 +2,53 @@ import inspect
 
 from astkit import ast
 
+def _scalars_equal(value, other):
+    # 1, 1.0 and True compare equal but are different constants
+    return value.__class__ is other.__class__ and value == other
+
+def nodes_equal(node, other):
+    """ Are two trees the same, ignoring line and column attributes? """
+    stack = [(node, other)]
+    while stack:
+        node, other = stack.pop()
+        if node.__class__ is not other.__class__:
+            return False
+        for field in node._fields:
+            value = getattr(node, field, None)
+            other_value = getattr(other, field, None)
+            if isinstance(value, ast.AST):
+                stack.append((value, other_value))
+            elif isinstance(value, list):
+                if not isinstance(other_value, list) \
+                        or len(value) != len(other_value):
+                    return False
+                for item, other_item in zip(value, other_value):
+                    if isinstance(item, ast.AST):
+                        stack.append((item, other_item))
+                    elif not _scalars_equal(item, other_item):
+                        return False
+            elif not _scalars_equal(value, other_value):
+                return False
+    return True
+
+def shallow_key(node):
+    """ The node's own field values, with children compared by identity """
+    key = []
+    for field in node._fields:
+        value = getattr(node, field, None)
+        if isinstance(value, list):
+            value = tuple(value)
+        key.append(value)
+    return tuple(key)
+
 class ASTClassTree(dict):
+    """ The hierarchy of AST node classes
+        
+        Each tree maps the direct subclasses of its root class to their own
+        subtrees. All of the subtrees of a tree share an index from class to
+        subtree, so finding a class, its ancestors or its descendants costs a
+        dictionary lookup rather than a search of the tree.
+    """
     
     @classmethod
     def create(cls):
@@ -14,59 +60,80 @@ class ASTClassTree(dict):
                 tree.insert(item)
         return tree
     
-    def __init__(self, root):
+    def __init__(self, root, parent=None):
         self._root = root
+        self._parent = parent
+        if parent is None:
+            self._index = {root: self}
+            self._ancestors = ()
+        else:
+            self._index = parent._index
+            self._ancestors = (parent._root,) + parent._ancestors
+        self._ancestor_set = frozenset(self._ancestors)
+        # descendants and leaves, worked out when first asked for and
+        # forgotten whenever a class is inserted below this subtree
+        self._descendants = None
+        self._leaves = None
     
     def contains(self, key):
-        if key == self._root:
-            return True
-        
-        elif key in self:
-            return True
-        
-        else:
-            for node in self:
-                if self[node].contains(key):
-                    return True
+        subtree = self._index.get(key)
+        return subtree is not None and (subtree is self or
+                                        self._root in subtree._ancestor_set)
     
     def find(self, key):
-        if key == self._root:
-            return self
-        
-        elif key in self:
-            return self[key]
-        
-        else:
-            for node in self:
-                child = self[node]
-                if child.contains(key):
-                    return child.find(key)
+        if self.contains(key):
+            return self._index[key]
     
     def insert(self, item):
-        lineage = inspect.getmro(item)
-        parent = lineage[1]
-        subtree = self.__class__(item)
+        subtree = self._index.get(item)
+        if subtree is not None:
+            return subtree
         
-        if self.contains(item):
-            return self.find(item)
-        
-        elif self.contains(parent):
-            self.find(parent)[item] = subtree
-            
-        else:
-            self.insert(parent)[item] = subtree
+        parent = inspect.getmro(item)[1]
+        parent_tree = self._index.get(parent)
+        if parent_tree is None:
+            parent_tree = self.insert(parent)
+        subtree = self.__class__(item, parent_tree)
+        parent_tree[item] = subtree
+        self._index[item] = subtree
         
+        ancestor = parent_tree
+        while ancestor is not None:
+            ancestor._descendants = None
+            ancestor._leaves = None
+            ancestor = ancestor._parent
         return subtree
     
-    def leaves(self):
-        if not self:
-            return [self._root]
-        
+    def ancestors(self, key):
+        """ The classes above key, nearest first, up to the tree's root """
+        return self._index[key]._ancestors
+    
+    def descendants(self, key=None):
+        """ All of the classes below key, or below this tree's root """
+        if key is None:
+            subtree = self
         else:
-            _leaves = []
-            for key in self:
-                _leaves += self[key].leaves()
-            return _leaves
+            subtree = self._index[key]
+        if subtree._descendants is None:
+            descendants = set()
+            stack = [subtree]
+            while stack:
+                tree = stack.pop()
+                descendants.update(tree)
+                stack.extend(tree.values())
+            subtree._descendants = frozenset(descendants)
+        return subtree._descendants
+    
+    def leaves(self):
+        if self._leaves is None:
+            if not self:
+                self._leaves = [self._root]
+            else:
+                _leaves = []
+                for key in self:
+                    _leaves += self[key].leaves()
+                self._leaves = _leaves
+        return list(self._leaves)
     
     def __str__(self):
         lines = [str(self._root) + " " + str(len(self))]
@@ -75,6 +142,18 @@ class ASTClassTree(dict):
                       for line in str(self[key]).splitlines()]
         return "\n".join(lines)
 
+_ast_class_tree = None
+
+def ast_class_tree():
+    """ Get the class tree of the ast module, created on first use
+        
+        The tree is shared, so don't insert classes into it.
+    """
+    global _ast_class_tree
+    if _ast_class_tree is None:
+        _ast_class_tree = ASTClassTree.create()
+    return _ast_class_tree
+
 if __name__ == '__main__':
     # The snippet below will do something similar using a builtin function,
     # which sounds nice. I like what I've got here, though, so I'll stick
@@ -0,0 +1,169 @@
+""" walker.py
+
+Walk trees without asking every node which of its fields hold nodes.
+
+ast.walk and ast.iter_child_nodes look at every field of every node through
+ast.iter_fields. Many fields only ever hold names, flags or constants, so the
+fields worth looking at are worked out once per node class here, for every
+class in the ast class tree, and walks use those with an explicit stack:
+
+    >>> from astkit.walker import walk
+    >>> for node in walk(tree):
+    ...     pass
+    >>> for node in walk(tree, order='post', prune=is_function):
+    ...     pass
+
+walk visits nodes depth-first in the order they appear in the source, unlike
+ast.walk, which goes breadth-first.
+"""
+from astkit import ast
+from astkit.util import ast_class_tree
+
+# Fields that never hold nodes, by class name. Leaving a field out of this
+# table only costs a getattr; fields whose type differs between versions of
+# the grammar (ExceptHandler.name, arguments.vararg) are not listed.
+_SCALAR_FIELDS = {
+    'FunctionDef': ('name', 'type_comment'),
+    'AsyncFunctionDef': ('name', 'type_comment'),
+    'ClassDef': ('name',),
+    'Assign': ('type_comment',),
+    'AnnAssign': ('simple',),
+    'For': ('type_comment',),
+    'AsyncFor': ('type_comment',),
+    'With': ('type_comment',),
+    'AsyncWith': ('type_comment',),
+    'ImportFrom': ('module', 'level'),
+    'Global': ('names',),
+    'Nonlocal': ('names',),
+    'Attribute': ('attr',),
+    'Name': ('id',),
+    'Constant': ('value', 'kind'),
+    'Num': ('n',),
+    'Str': ('s',),
+    'Bytes': ('s',),
+    'NameConstant': ('value',),
+    'FormattedValue': ('conversion',),
+    'comprehension': ('is_async',),
+    'arg': ('arg', 'type_comment'),
+    'keyword': ('arg',),
+    'alias': ('name', 'asname'),
+    'MatchSingleton': ('value',),
+    'MatchStar': ('name',),
+    'MatchMapping': ('rest',),
+    'MatchClass': ('kwd_attrs',),
+    'MatchAs': ('name',),
+    'TypeIgnore': ('lineno', 'tag'),
+    'TypeVar': ('name',),
+    'ParamSpec': ('name',),
+    'TypeVarTuple': ('name',),
+    'Print': ('nl',),
+    }
+
+# node class -> fields that may hold nodes, in reverse, since that is the
+# order children are pushed on a stack
+_reversed_fields = {}
+
+def _compute_child_fields(cls):
+    scalars = _SCALAR_FIELDS.get(cls.__name__, ())
+    fields = tuple(field for field in cls._fields if field not in scalars)
+    _reversed_fields[cls] = fields[::-1]
+    return fields
+
+def _precompute():
+    class_tree = ast_class_tree()
+    for cls in class_tree.descendants(ast.AST):
+        _compute_child_fields(cls)
+
+_precompute()
+
+def child_fields(cls):
+    """ Get the fields of a node class that may hold nodes or lists of nodes
+    """
+    fields = _reversed_fields.get(cls)
+    if fields is None:
+        return _compute_child_fields(cls)
+    return fields[::-1]
+
+def iter_child_nodes(node):
+    """ Like ast.iter_child_nodes, but only looking at fields that can hold
+        nodes
+    """
+    fields = _reversed_fields.get(node.__class__)
+    if fields is None:
+        _compute_child_fields(node.__class__)
+        fields = _reversed_fields[node.__class__]
+    AST = ast.AST
+    for field in reversed(fields):
+        value = getattr(node, field, None)
+        if isinstance(value, AST):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, AST):
+                    yield item
+
+def walk(node, order='pre', prune=None):
+    """ Generate a node and all of its descendants depth-first
+
+        order is 'pre' to produce each node before its descendants or 'post'
+        to produce it after them. If prune is given, it is called with each
+        node and the node's descendants are skipped when it returns true.
+    """
+    if order == 'pre':
+        return _walk_pre(node, prune)
+    if order == 'post':
+        return _walk_post(node, prune)
+    raise ValueError("order must be 'pre' or 'post', not %r" % (order,))
+
+def _walk_pre(node, prune):
+    AST = ast.AST
+    reversed_fields = _reversed_fields
+    stack = [node]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node = pop()
+        yield node
+        if prune is not None and prune(node):
+            continue
+        fields = reversed_fields.get(node.__class__)
+        if fields is None:
+            _compute_child_fields(node.__class__)
+            fields = reversed_fields[node.__class__]
+        for field in fields:
+            value = getattr(node, field, None)
+            if isinstance(value, AST):
+                push(value)
+            elif isinstance(value, list):
+                for item in reversed(value):
+                    if isinstance(item, AST):
+                        push(item)
+
+def _walk_post(node, prune):
+    AST = ast.AST
+    reversed_fields = _reversed_fields
+    # a node is pushed twice: with False to expand it, then with True under
+    # its children to produce it once they are done
+    stack = [(node, False)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node, expanded = pop()
+        if expanded:
+            yield node
+            continue
+        push((node, True))
+        if prune is not None and prune(node):
+            continue
+        fields = reversed_fields.get(node.__class__)
+        if fields is None:
+            _compute_child_fields(node.__class__)
+            fields = reversed_fields[node.__class__]
+        for field in fields:
+            value = getattr(node, field, None)
+            if isinstance(value, AST):
+                push((value, False))
+            elif isinstance(value, list):
+                for item in reversed(value):
+                    if isinstance(item, AST):
+                        push((item, False))
@@ -0,0 +1,96 @@
+""" compact.py
+
+Compare keeping a corpus as ast trees with keeping it as CompactTrees.
+
+The corpus is every module of the standard library that parses on the
+running interpreter. Memory is measured with tracemalloc, so this needs
+Python 3.4 or later. The histogram is a count of nodes by class, done with
+ast.walk over the trees and with type_histogram over the compact trees.
+
+    python benchmarks/compact.py [directory] [repeat]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+from astkit import ast
+from astkit.compact import CompactTree, numpy, type_histogram
+
+
+def load_sources(directory):
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames
+                       if name not in ('test', 'tests', 'site-packages')]
+        for filename in filenames:
+            if not filename.endswith('.py'):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                with open(path) as f:
+                    source = f.read()
+                ast.parse(source)
+            except (SyntaxError, UnicodeDecodeError, ValueError):
+                continue
+            sources.append((path, source))
+    return sources
+
+
+def measure(build):
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def walk_histogram(trees):
+    counts = {}
+    for tree in trees:
+        for node in ast.walk(tree):
+            counts[node.__class__] = counts.get(node.__class__, 0) + 1
+    return counts
+
+
+def best_time(func, argument, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(argument)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    directory = argv[1] if len(argv) > 1 else os.path.dirname(os.__file__)
+    repeat = int(argv[2]) if len(argv) > 2 else 3
+    sources = load_sources(directory)
+    trees, tree_size = measure(
+        lambda: [ast.parse(source, path) for path, source in sources])
+    compact, compact_size = measure(
+        lambda: [CompactTree(tree) for tree in trees])
+    nodes = sum(len(tree) for tree in compact)
+    sys.stdout.write("corpus: %d modules, %d nodes from %s\n"
+                     % (len(trees), nodes, directory))
+    sys.stdout.write("ast trees     %10.1f MB %8.1f bytes/node\n"
+                     % (tree_size / 1e6, float(tree_size) / nodes))
+    sys.stdout.write("compact trees %10.1f MB %8.1f bytes/node\n"
+                     % (compact_size / 1e6, float(compact_size) / nodes))
+    if walk_histogram(trees) != type_histogram(compact):
+        sys.stdout.write("histograms differ\n")
+        return
+    walk_time = best_time(walk_histogram, trees, repeat)
+    compact_time = best_time(type_histogram, compact, repeat)
+    sys.stdout.write("histogram: ast.walk %.3fs, compact %.3fs%s (%.1fx)\n"
+                     % (walk_time, compact_time,
+                        ' with numpy' if numpy is not None else '',
+                        walk_time / compact_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,94 @@
+""" render_dispatch.py
+
+Compare the throughput of SourceCodeRenderer's per-class dispatch table with
+the old per-node ``getattr('render_%s' % ...)`` lookup.
+
+The corpus is every top-level statement of the standard library that the
+renderer can handle on the running interpreter, so the numbers reflect
+real-world node mixes rather than synthetic trees. On interpreters that parse
+literals to Constant, which the renderer has no method for, that leaves only
+the statements without literals, and the output says so.
+
+    python benchmarks/render_dispatch.py [directory] [repeat]
+"""
+import os
+import sys
+import time
+
+from astkit import ast
+from astkit.render import SourceCodeRenderer
+
+
+class GetattrDispatchRenderer(SourceCodeRenderer):
+    """ The renderer as it was before the dispatch table was introduced """
+
+    def _render(self, node):
+        render_method = getattr(self, 'render_%s' % node.__class__.__name__)
+        return render_method(node)
+
+
+def load_corpus(directory):
+    statements = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames
+                       if name not in ('test', 'tests', 'site-packages')]
+        for filename in filenames:
+            if not filename.endswith('.py'):
+                continue
+            try:
+                with open(os.path.join(dirpath, filename)) as f:
+                    tree = ast.parse(f.read())
+            except (SyntaxError, UnicodeDecodeError, ValueError):
+                continue
+            for statement in tree.body:
+                try:
+                    GetattrDispatchRenderer.render(statement)
+                except Exception:
+                    continue
+                statements.append(statement)
+    return statements
+
+
+def count_nodes(statements):
+    return sum(len(list(ast.walk(statement))) for statement in statements)
+
+
+def time_renderer(renderer_class, statements, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for statement in statements:
+            renderer_class.render(statement)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    directory = argv[1] if len(argv) > 1 else os.path.dirname(os.__file__)
+    repeat = int(argv[2]) if len(argv) > 2 else 5
+    statements = load_corpus(directory)
+    nodes = count_nodes(statements)
+    if hasattr(SourceCodeRenderer, 'render_Constant'):
+        kind = "renderable statements"
+    else:
+        kind = "renderable statements without literals"
+    sys.stdout.write("corpus: %d %s, %d nodes from %s\n"
+                     % (len(statements), kind, nodes, directory))
+    if not statements:
+        sys.stdout.write("nothing to render\n")
+        return
+    results = []
+    for renderer_class in (GetattrDispatchRenderer, SourceCodeRenderer):
+        # a tiny corpus can render faster than the clock ticks
+        elapsed = max(time_renderer(renderer_class, statements, repeat),
+                      1e-9)
+        results.append(elapsed)
+        sys.stdout.write("%-24s %8.3fs %12.0f nodes/s\n"
+                         % (renderer_class.__name__, elapsed, nodes / elapsed))
+    sys.stdout.write("speedup: %.2fx\n" % (results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
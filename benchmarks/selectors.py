@@ -0,0 +1,146 @@
+""" selectors.py
+
+Compare astkit.selector with hand-written ast.NodeVisitor subclasses that
+find the same nodes.
+
+The corpus is every module of the standard library that parses on the
+running interpreter. Each query is checked to find the same nodes both ways
+before it is timed.
+
+    python benchmarks/selectors.py [directory] [repeat]
+"""
+import os
+import sys
+import time
+
+from astkit import ast
+from astkit.selector import compile_selector
+
+
+class OpenCallsInFunctions(ast.NodeVisitor):
+    """ FunctionDef > body Call[func.id=open] """
+
+    def __init__(self):
+        self.found = []
+        self.depth = 0
+
+    def visit_FunctionDef(self, node):
+        for field, value in ast.iter_fields(node):
+            if field == 'body':
+                self.depth += 1
+                for statement in value:
+                    self.visit(statement)
+                self.depth -= 1
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        self.visit(item)
+            elif isinstance(value, ast.AST):
+                self.visit(value)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Call(self, node):
+        if (self.depth and isinstance(node.func, ast.Name) and
+            node.func.id == 'open'):
+            self.found.append(node)
+        self.generic_visit(node)
+
+
+class Methods(ast.NodeVisitor):
+    """ ClassDef > FunctionDef """
+
+    def __init__(self):
+        self.found = []
+
+    def visit_ClassDef(self, node):
+        for statement in node.body:
+            if isinstance(statement, ast.FunctionDef):
+                self.found.append(statement)
+        self.generic_visit(node)
+
+
+class JoinCalls(ast.NodeVisitor):
+    """ Call[func.attr=join] """
+
+    def __init__(self):
+        self.found = []
+
+    def visit_Call(self, node):
+        if getattr(node.func, 'attr', None) == 'join':
+            self.found.append(node)
+        self.generic_visit(node)
+
+
+QUERIES = [(OpenCallsInFunctions, 'FunctionDef > body Call[func.id=open]'),
+           (Methods, 'ClassDef > FunctionDef'),
+           (JoinCalls, 'Call[func.attr=join]'),
+           ]
+
+
+def load_corpus(directory):
+    trees = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames
+                       if name not in ('test', 'tests', 'site-packages')]
+        for filename in filenames:
+            if not filename.endswith('.py'):
+                continue
+            try:
+                with open(os.path.join(dirpath, filename)) as f:
+                    trees.append(ast.parse(f.read()))
+            except (SyntaxError, UnicodeDecodeError, ValueError):
+                continue
+    return trees
+
+
+def run_visitor(visitor_class, trees):
+    found = []
+    for tree in trees:
+        visitor = visitor_class()
+        visitor.visit(tree)
+        found.extend(visitor.found)
+    return found
+
+
+def run_selector(text, trees):
+    compiled = compile_selector(text)
+    found = []
+    for tree in trees:
+        found.extend(compiled.select(tree))
+    return found
+
+
+def best_time(func, repeat, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    directory = argv[1] if len(argv) > 1 else os.path.dirname(os.__file__)
+    repeat = int(argv[2]) if len(argv) > 2 else 3
+    trees = load_corpus(directory)
+    sys.stdout.write("corpus: %d modules from %s\n" % (len(trees), directory))
+    for visitor_class, text in QUERIES:
+        expected = run_visitor(visitor_class, trees)
+        found = run_selector(text, trees)
+        if sorted(map(id, expected)) != sorted(map(id, found)):
+            sys.stdout.write("%s: results differ (%d vs %d)\n"
+                             % (text, len(expected), len(found)))
+            continue
+        visitor_time = best_time(run_visitor, repeat, visitor_class, trees)
+        selector_time = best_time(run_selector, repeat, text, trees)
+        sys.stdout.write("%-40s %6d found  visitor %7.3fs  selector %7.3fs"
+                         "  (%.2fx)\n"
+                         % (text, len(found), visitor_time, selector_time,
+                            visitor_time / selector_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,87 @@
+""" walk.py
+
+Compare astkit.walker.walk with ast.walk.
+
+The corpus is every module of the standard library that parses on the
+running interpreter; each walker visits every node of every module.
+
+    python benchmarks/walk.py [directory] [repeat]
+"""
+import os
+import sys
+import time
+
+from astkit import ast
+from astkit.walker import walk
+
+
+def load_corpus(directory):
+    trees = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames
+                       if name not in ('test', 'tests', 'site-packages')]
+        for filename in filenames:
+            if not filename.endswith('.py'):
+                continue
+            try:
+                with open(os.path.join(dirpath, filename)) as f:
+                    trees.append(ast.parse(f.read()))
+            except (SyntaxError, UnicodeDecodeError, ValueError):
+                continue
+    return trees
+
+
+def ast_walk(trees):
+    count = 0
+    for tree in trees:
+        for node in ast.walk(tree):
+            count += 1
+    return count
+
+
+def astkit_pre(trees):
+    count = 0
+    for tree in trees:
+        for node in walk(tree):
+            count += 1
+    return count
+
+
+def astkit_post(trees):
+    count = 0
+    for tree in trees:
+        for node in walk(tree, 'post'):
+            count += 1
+    return count
+
+
+def best_time(func, trees, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(trees)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    directory = argv[1] if len(argv) > 1 else os.path.dirname(os.__file__)
+    repeat = int(argv[2]) if len(argv) > 2 else 3
+    trees = load_corpus(directory)
+    nodes = ast_walk(trees)
+    sys.stdout.write("corpus: %d modules, %d nodes from %s\n"
+                     % (len(trees), nodes, directory))
+    baseline = None
+    for func in (ast_walk, astkit_pre, astkit_post):
+        elapsed = best_time(func, trees, repeat)
+        if baseline is None:
+            baseline = elapsed
+        sys.stdout.write("%-12s %8.3fs %12.0f nodes/s %6.2fx\n"
+                         % (func.__name__, elapsed, nodes / elapsed,
+                            baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
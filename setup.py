@@ -1,7 +1,10 @@
 from setuptools import setup, find_packages
-import sys, os
+import sys, os, re
 
-version = '0.5.4'
+# astkit/__init__.py holds the version; it's read rather than imported so
+# that installing doesn't import the package
+with open(os.path.join(os.path.dirname(__file__), 'astkit', '__init__.py')) as f:
+    version = re.search(r"^__version__ = '([^']+)'", f.read(), re.M).group(1)
 
 setup(name='astkit',
       version=version,